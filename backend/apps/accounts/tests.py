@@ -1,3 +1,97 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from apps.cart import guest
+from apps.cart.models import Cart, CartItem, StockReservation
+from apps.products.models import Category, Product, ProductVariant
+
+User = get_user_model()
+
+PASSWORD = 'Clave-segura-123'
+
+
+@override_settings(STOCK_RESERVATION_TTL=600)
+class GuestCartMergeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='mujer', display_name='Mujer')
+        self.product = Product.objects.create(name='Blusa', description='Blusa', category=category, price=50000)
+        self.other = Product.objects.create(name='Falda', description='Falda', category=category, price=80000)
+        self.variant = ProductVariant.objects.create(product=self.product, size='M', color='azul', stock=10)
+        self.user = User.objects.create_user(username='cliente', email='cliente@example.com', password=PASSWORD)
+        self.client = APIClient()
+
+    def add(self, client, product, variant=None, quantity=1):
+        response = client.post('/api/cart/add/', {
+            'product_id': product.pk, 'variant_id': variant.pk if variant else None, 'quantity': quantity,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def guest_cart(self):
+        """Fill a guest cart, flushed to the database, and return its token"""
+        self.add(self.client, self.product, self.variant, 2)
+        self.add(self.client, self.other)
+        token = guest.unsign_token(self.client.cookies[guest.COOKIE_NAME].value)
+        guest.flush_dirty_carts()
+        self.assertTrue(Cart.objects.filter(session_key=token).exists())
+        return token
+
+    def post(self, path, data):
+        # The cached guest cart is dropped once the merge commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(path, data, format='json')
+
+    def login(self, password=PASSWORD):
+        return self.post('/api/accounts/login/', {'email': self.user.email, 'password': password})
+
+    def lines(self, user):
+        return sorted(CartItem.objects.filter(cart__user=user).values_list('product_id', 'variant_id', 'quantity'))
+
+    def assertGuestCartGone(self, token, response):
+        self.assertFalse(Cart.objects.filter(session_key=token).exists())
+        self.assertIsNone(cache.get(f'guest-cart:{token}'))
+        self.assertFalse(StockReservation.objects.filter(holder=f'guest:{token}').exists())
+        self.assertEqual(response.cookies[guest.COOKIE_NAME].value, '')
+
+    def test_login_adds_the_guest_lines_to_the_user_cart(self):
+        user_client = APIClient()
+        user_client.force_authenticate(self.user)
+        self.add(user_client, self.product, self.variant, 1)
+        token = self.guest_cart()
+
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.lines(self.user), sorted([
+            (self.product.pk, self.variant.pk, 3), (self.other.pk, None, 1),
+        ]))
+        self.assertGuestCartGone(token, response)
+        # The user's cart now holds what both carts held
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(dict(StockReservation.objects.values_list('holder', 'quantity')), {f'cart:{cart.pk}': 3})
+
+    def test_register_keeps_the_guest_cart(self):
+        token = self.guest_cart()
+        response = self.post('/api/accounts/register/', {
+            'email': 'nueva@example.com', 'username': 'nueva', 'password': PASSWORD, 'password_confirm': PASSWORD,
+        })
+        self.assertEqual(response.status_code, 201)
+        user = User.objects.get(email='nueva@example.com')
+        self.assertEqual(self.lines(user), sorted([(self.product.pk, self.variant.pk, 2), (self.other.pk, None, 1)]))
+        self.assertGuestCartGone(token, response)
+        cart = Cart.objects.get(user=user)
+        self.assertEqual(dict(StockReservation.objects.values_list('holder', 'quantity')), {f'cart:{cart.pk}': 2})
+
+    def test_failed_login_leaves_the_guest_cart_alone(self):
+        token = self.guest_cart()
+        response = self.login(password='otra')
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+        self.assertTrue(Cart.objects.filter(session_key=token).exists())
+        self.assertEqual(StockReservation.objects.get().holder, f'guest:{token}')
+        self.assertEqual(self.client.get('/api/cart/count/').data['total_items'], 3)
+
+    def test_login_without_a_guest_cart_creates_nothing(self):
+        self.assertEqual(self.login().status_code, 200)
+        self.assertFalse(Cart.objects.exists())
@@ -5,6 +5,8 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import get_user_model, authenticate
 from .serializers import UserRegistrationSerializer, UserSerializer, AdminUserSerializer
 from .models import GuestUser
+from apps.cart.guest import GuestCart
+from apps.cart.merge import merge_guest_cart
 
 User = get_user_model()
 
@@ -16,16 +18,18 @@ class RegisterView(generics.CreateAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.save()
+        # What the visitor put in the cart before registering stays in it
+        merge_guest_cart(request, user)
 
         refresh = RefreshToken.for_user(user)
 
-        return Response({
+        return GuestCart.delete_token(Response({
             "user": UserSerializer(user).data,
             "tokens" : {
                 'refresh': str(refresh),
                 'access': str(refresh.access_token)
             }
-        }, status=status.HTTP_201_CREATED)
+        }, status=status.HTTP_201_CREATED))
 
 
 @api_view(['POST'])
@@ -37,14 +41,15 @@ def login_view(request):
     if email and password:
         user = authenticate(request, username=email, password=password)
         if user:
+            merge_guest_cart(request, user)
             refresh = RefreshToken.for_user(user)
-            return Response({
+            return GuestCart.delete_token(Response({
                 'user': UserSerializer(user).data,
                 'tokens': {
                     'refresh': str(refresh),
                     'access': str(refresh.access_token),
                 }
-            })
+            }))
         else:
             return Response({'error': 'Credenciales inválidas'},
                             status=status.HTTP_401_UNAUTHORIZED)
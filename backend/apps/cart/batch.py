@@ -0,0 +1,69 @@
+"""Apply a list of add / set / remove operations to a cart in one go"""
+from django.db import transaction
+
+from . import reservations
+from .models import Cart, CartItem
+
+
+class CartOperationError(LookupError):
+    def __init__(self, index, message):
+        super().__init__(message)
+        self.index = index
+        self.message = message
+
+
+def apply_operations(quantities, item_keys, operations):
+    """Fold validated operations into quantities, a dict of (product_id, variant_id) -> quantity.
+
+    item_keys maps the cart's line ids to their keys. Lines set to 0 are
+    left in the dict with quantity 0 for the caller to delete.
+    """
+    for index, operation in enumerate(operations):
+        if 'item_id' in operation:
+            key = item_keys.get(operation['item_id'])
+            if key is None:
+                raise CartOperationError(index, 'Item no encontrado')
+        else:
+            key = (operation['product_id'], operation.get('variant_id'))
+
+        if operation['op'] == 'add':
+            quantities[key] = quantities.get(key, 0) + operation['quantity']
+        elif operation['op'] == 'set':
+            quantities[key] = operation['quantity']
+        else:
+            quantities[key] = 0
+    return quantities
+
+
+def apply_to_cart(cart, operations):
+    """Apply operations to a database cart in one transaction with bulk writes"""
+    with transaction.atomic():
+        # Concurrent batches on the same cart queue up behind this row lock
+        Cart.objects.select_for_update().filter(pk=cart.pk).first()
+        existing = {
+            (product_id, variant_id): (pk, quantity)
+            for pk, product_id, variant_id, quantity in cart.items.values_list('pk', 'product_id', 'variant_id', 'quantity')
+        }
+        quantities = apply_operations(
+            {key: quantity for key, (pk, quantity) in existing.items()},
+            {pk: key for key, (pk, quantity) in existing.items()},
+            operations,
+        )
+
+        removed_keys = [key for key, quantity in quantities.items() if quantity == 0 and key in existing]
+        removed = [existing[key][0] for key in removed_keys]
+        changed = [
+            (key, quantity) for key, quantity in quantities.items()
+            if quantity > 0 and existing.get(key, (None, None))[1] != quantity
+        ]
+        CartItem.objects.filter(pk__in=removed).delete()
+        CartItem.objects.bulk_update(
+            [CartItem(pk=existing[key][0], quantity=quantity) for key, quantity in changed if key in existing],
+            ['quantity'],
+        )
+        # New lines go through INSERT ... ON CONFLICT: a line another request created since the read
+        # above is added to rather than failing on the unique constraints (the row lock is a no-op on SQLite)
+        CartItem.objects.add_quantities(cart, [(*key, quantity) for key, quantity in changed if key not in existing])
+        # Raises InsufficientStock, rolling the batch back, when a line asks for more than is left
+        reservations.sync(cart, [key[1] for key in removed_keys + [key for key, quantity in changed]])
+        cart.save(update_fields=['updated_at'])
@@ -0,0 +1,352 @@
+"""Guest carts kept in the shared cache instead of a Cart row per anonymous visitor.
+
+A guest is identified by a signed random token, sent back and forth in the
+cart_token cookie or the X-Cart-Token header. The cart lives in the cache
+under that token and changes to it are cache writes only: no Cart row and
+no database session is created for browsing guests. With stock reservations
+on, changes to variant lines also update the cart's StockReservation rows.
+
+The cart is copied to the Cart/CartItem tables (write-behind) when the
+guest reaches checkout, once it has not changed for GUEST_CART_FLUSH_AFTER
+seconds and the guest comes back to it, and by the periodic
+flush_guest_carts command, which writes every cart changed since its last
+run. A cart evicted from the cache is reloaded from its last flushed copy;
+changes made since then are lost.
+
+Carts created before guest carts moved to the cache are keyed by the Django
+session key; a request still carrying that session adopts the key as its
+token.
+"""
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from apps.products.models import Product, ProductVariant
+from . import reservations
+from .batch import apply_operations
+from .models import Cart, CartItem
+
+COOKIE_NAME = 'cart_token'
+HEADER_NAME = 'X-Cart-Token'
+SIGNING_SALT = 'apps.cart.guest'
+# Seconds a mutation waits for, and at most holds, the per-cart lock
+LOCK_TIMEOUT = 5
+# Sequence of carts that went from flushed to dirty, one cache key per entry
+DIRTY_LOG = 'guest-cart:dirty'
+
+
+def _cache_key(token):
+    return f'guest-cart:{token}'
+
+
+def sign_token(token):
+    return signing.Signer(salt=SIGNING_SALT).sign(token)
+
+
+def unsign_token(value):
+    try:
+        return signing.Signer(salt=SIGNING_SALT).unsign(value)
+    except signing.BadSignature:
+        return None
+
+
+class CartBusy(APIException):
+    """Another request held the cart's lock for all of LOCK_TIMEOUT"""
+    # Raised from any view that touches a guest cart, so DRF turns it into the response
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'El carrito se está actualizando, intente de nuevo'
+    default_code = 'cart_busy'
+
+
+@contextmanager
+def _locked(token):
+    """Serialize read-modify-write cycles on one cart across processes; raises CartBusy"""
+    lock = f'{_cache_key(token)}:lock'
+    owner = uuid.uuid4().hex
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    # A crashed holder's lock expires on its own after LOCK_TIMEOUT
+    while not cache.add(lock, owner, LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            raise CartBusy()
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        # A lock held past LOCK_TIMEOUT may have expired and been taken by another request
+        if cache.get(lock) == owner:
+            cache.delete(lock)
+
+
+def _mark_dirty(token):
+    """Record the token in the dirty-cart log read by flush_dirty_carts"""
+    cache.add(DIRTY_LOG, 0, None)
+    cache.set(f'{DIRTY_LOG}:{cache.incr(DIRTY_LOG)}', token, settings.GUEST_CART_TIMEOUT)
+
+
+def _empty():
+    now = time.time()
+    return {'lines': [], 'next_id': 1, 'cart_id': None, 'created_at': now, 'updated_at': now, 'dirty': False}
+
+
+class GuestCart:
+    def __init__(self, token, data, send_token=False):
+        self.token = token
+        self.data = data
+        # The client does not hold this token yet
+        self.send_token = send_token
+        self._items = None
+
+    @classmethod
+    def from_request(cls, request):
+        value = request.COOKIES.get(COOKIE_NAME) or request.headers.get(HEADER_NAME)
+        token = unsign_token(value) if value else None
+        send_token = token is None
+        if token is None:
+            # Reading the session key from the cookie does not touch the session table
+            session_key = request.session.session_key
+            if session_key and Cart.objects.filter(session_key=session_key, user=None).exists():
+                token = session_key
+            else:
+                token = uuid.uuid4().hex
+        cart = cls(token, cls.load(token), send_token=send_token)
+        if cart.data['dirty'] and time.time() - cart.data['updated_at'] > settings.GUEST_CART_FLUSH_AFTER:
+            cart.flush()
+        return cart
+
+    @staticmethod
+    def load(token):
+        data = cache.get(_cache_key(token))
+        if data is not None:
+            return data
+        # Evicted or never cached: fall back to the flushed copy, if any
+        data = _empty()
+        cart = Cart.objects.filter(session_key=token, user=None).first()
+        if cart is not None:
+            items = list(cart.items.order_by('pk').values_list('line_id', 'pk', 'product_id', 'variant_id', 'quantity'))
+            # Lines keep the ids the client holds; rows flushed before line_id existed use their pk
+            data['lines'] = [
+                {'id': line_id or pk, 'product_id': product_id, 'variant_id': variant_id, 'quantity': quantity}
+                for line_id, pk, product_id, variant_id, quantity in items
+            ]
+            data['next_id'] = max([line['id'] for line in data['lines']], default=0) + 1
+            data['cart_id'] = cart.pk
+            data['created_at'] = data['updated_at'] = cart.updated_at.timestamp()
+        return data
+
+    def save(self, dirty=True):
+        if dirty:
+            if not self.data['dirty']:
+                _mark_dirty(self.token)
+            self.data['dirty'] = True
+            self.data['updated_at'] = time.time()
+        cache.set(_cache_key(self.token), self.data, settings.GUEST_CART_TIMEOUT)
+        self._items = None
+
+    @contextmanager
+    def changing(self):
+        """Apply a change on the latest cached state under the cart lock, then store it"""
+        with _locked(self.token):
+            self.data = self.load(self.token)
+            before = self._variant_quantities()
+            yield self.data['lines']
+            after = self._variant_quantities()
+            # Raises InsufficientStock before anything is stored
+            reservations.reserve(self, {
+                variant_id: after.get(variant_id, 0)
+                for variant_id in before.keys() | after.keys() if before.get(variant_id) != after.get(variant_id)
+            })
+            self.save()
+
+    def _variant_quantities(self):
+        return {line['variant_id']: line['quantity'] for line in self.data['lines'] if line['variant_id']}
+
+    def add(self, product_id, variant_id, quantity):
+        with self.changing() as lines:
+            for line in lines:
+                if line['product_id'] == product_id and line['variant_id'] == variant_id:
+                    line['quantity'] += quantity
+                    break
+            else:
+                lines.append({
+                    'id': self.data['next_id'], 'product_id': product_id, 'variant_id': variant_id, 'quantity': quantity,
+                })
+                self.data['next_id'] += 1
+
+    def set_quantity(self, line_id, quantity):
+        """Returns False when the cart has no such line"""
+        with self.changing() as lines:
+            line = next((line for line in lines if line['id'] == line_id), None)
+            if line is not None:
+                line['quantity'] = quantity
+        return line is not None
+
+    def remove(self, line_id):
+        """Returns False when the cart has no such line"""
+        with self.changing() as lines:
+            count = len(lines)
+            lines[:] = [line for line in lines if line['id'] != line_id]
+        return len(lines) != count
+
+    def apply(self, operations):
+        """Apply batch operations (see apps.cart.batch) with a single cache write"""
+        with self.changing() as lines:
+            ids = {(line['product_id'], line['variant_id']): line['id'] for line in lines}
+            quantities = apply_operations(
+                {(line['product_id'], line['variant_id']): line['quantity'] for line in lines},
+                {line_id: key for key, line_id in ids.items()},
+                operations,
+            )
+            lines[:] = []
+            for (product_id, variant_id), quantity in quantities.items():
+                if quantity == 0:
+                    continue
+                line_id = ids.get((product_id, variant_id))
+                if line_id is None:
+                    line_id = self.data['next_id']
+                    self.data['next_id'] += 1
+                lines.append({'id': line_id, 'product_id': product_id, 'variant_id': variant_id, 'quantity': quantity})
+
+    def clear(self):
+        with _locked(self.token):
+            cache.delete(_cache_key(self.token))
+            Cart.objects.filter(session_key=self.token, user=None).delete()
+        self.data = _empty()
+        self._items = None
+
+    def merge_into(self, user):
+        """Add the lines to the user's cart, summing quantities, and delete this cart.
+
+        Returns the user's Cart, or None when there was nothing to merge.
+        """
+        with _locked(self.token), transaction.atomic():
+            self.data = self.load(self.token)
+            if not self.data['lines'] and self.data['cart_id'] is None:
+                return None
+            cart, created = Cart.objects.get_or_create(user=user)
+            # Lines whose product or variant has been deleted are dropped
+            CartItem.objects.add_quantities(
+                cart, [(item.product_id, item.variant_id, item.quantity) for item in self.items],
+            )
+            cart.save(update_fields=['updated_at'])
+            Cart.objects.filter(session_key=self.token, user=None).delete()
+            transaction.on_commit(lambda: cache.delete(_cache_key(self.token)))
+        self.data = _empty()
+        self._items = None
+        return cart
+
+    def flush(self):
+        """Write the cart to the Cart/CartItem tables"""
+        with _locked(self.token), transaction.atomic():
+            self.data = self.load(self.token)
+            cart = Cart.objects.filter(session_key=self.token, user=None).first()
+            if cart is None:
+                cart = Cart.objects.create(session_key=self.token)
+            else:
+                cart.save(update_fields=['updated_at'])
+            cart.items.all().delete()
+            # Lines whose product or variant has been deleted are dropped
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product=item.product, variant=item.variant, quantity=item.quantity, line_id=item.id)
+                for item in self.items
+            ])
+            self.data['cart_id'] = cart.pk
+            self.data['dirty'] = False
+            self.save(dirty=False)
+
+    @property
+    def items(self):
+        """The lines as unsaved CartItems, with products and variants loaded in two queries"""
+        if self._items is None:
+            lines = self.data['lines']
+            products = Product.objects.select_related('brand', 'main_image_ref').in_bulk(
+                {line['product_id'] for line in lines}
+            )
+            variants = ProductVariant.objects.in_bulk({line['variant_id'] for line in lines if line['variant_id']})
+            self._items = []
+            for line in lines:
+                product = products.get(line['product_id'])
+                variant = variants.get(line['variant_id'])
+                if product is None or (line['variant_id'] and variant is None):
+                    continue
+                item = CartItem(id=line['id'], product=product, variant=variant, quantity=line['quantity'])
+                item.unit_price = product.price + (variant.price_adjustment if variant else Decimal('0'))
+                self._items.append(item)
+        return self._items
+
+    @property
+    def id(self):
+        return self.data['cart_id']
+
+    @property
+    def reservation_holder(self):
+        return f'guest:{self.token}'
+
+    @property
+    def total_items(self):
+        # Counted from the cached lines, so the header badge never queries the database
+        return sum(line['quantity'] for line in self.data['lines'])
+
+    @property
+    def total_price(self):
+        return sum((item.subtotal for item in self.items), Decimal('0'))
+
+    @property
+    def created_at(self):
+        return datetime.fromtimestamp(self.data['created_at'], tz=dt_timezone.utc)
+
+    @property
+    def updated_at(self):
+        return datetime.fromtimestamp(self.data['updated_at'], tz=dt_timezone.utc)
+
+    @staticmethod
+    def delete_token(response):
+        response.delete_cookie(COOKIE_NAME, samesite='Lax')
+        return response
+
+    def set_token(self, response):
+        """Hand the token to a client that does not have it yet"""
+        if self.send_token and (self.data['lines'] or self.data['cart_id']):
+            signed = sign_token(self.token)
+            response.set_cookie(
+                COOKIE_NAME, signed, max_age=settings.GUEST_CART_TIMEOUT, httponly=True, samesite='Lax',
+            )
+            response[HEADER_NAME] = signed
+        return response
+
+
+def flush_dirty_carts(batch_size=500):
+    """Write every guest cart changed since the previous call to the database.
+
+    Carts that were flushed since they were logged are skipped. Returns the
+    number of carts written.
+    """
+    last = cache.get(f'{DIRTY_LOG}:flushed', 0)
+    current = cache.get(DIRTY_LOG, 0)
+    # The sequence itself was evicted and started over
+    if current < last:
+        last = 0
+    flushed = 0
+    for start in range(last + 1, current + 1, batch_size):
+        keys = [f'{DIRTY_LOG}:{slot}' for slot in range(start, min(start + batch_size, current + 1))]
+        for token in set(cache.get_many(keys).values()):
+            cart = GuestCart(token, GuestCart.load(token))
+            if not cart.data['dirty']:
+                continue
+            try:
+                cart.flush()
+                flushed += 1
+            except CartBusy:
+                # Still dirty, so log it again for the next run
+                _mark_dirty(token)
+        cache.delete_many(keys)
+    cache.set(f'{DIRTY_LOG}:flushed', current, None)
+    return flushed
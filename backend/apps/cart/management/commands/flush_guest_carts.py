@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.cart.guest import flush_dirty_carts
+
+
+class Command(BaseCommand):
+    help = 'Write guest carts changed since the last run to the database; run every few minutes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        flushed = flush_dirty_carts(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Flushed {flushed} guest carts'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.cart.reservations import sweep_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete expired stock reservations in bulk; run every few minutes while reservations are on'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        deleted = sweep_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Removed {deleted} expired reservations'))
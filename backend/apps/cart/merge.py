@@ -0,0 +1,24 @@
+"""Carry a guest's cart over when they log in or register"""
+from django.db import transaction
+
+from . import reservations
+from .guest import GuestCart
+
+
+def merge_guest_cart(request, user):
+    """Merge the request's guest cart into the user's cart in one transaction.
+
+    Quantities of lines in both carts are added up. The guest cart, its
+    flushed copy, its stock reservations and its session are deleted.
+    Returns the user's Cart, or None when the guest had no cart.
+    """
+    guest = GuestCart.from_request(request)
+    with transaction.atomic():
+        cart = guest.merge_into(user)
+        if cart is not None:
+            reservations.transfer(guest, cart)
+        # Guests only ever had a session for their cart or order lookups
+        if request.session.session_key:
+            request.session.flush()
+    return cart
+
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:09
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    # Lines without a variant could be duplicated before the constraint; keep the oldest with the summed quantity
+    CartItem = apps.get_model('cart', 'CartItem')
+    duplicates = (
+        CartItem.objects.filter(variant__isnull=True)
+        .values('cart_id', 'product_id')
+        .annotate(lines=Count('id'), keep=Min('id'), total=Sum('quantity'))
+        .filter(lines__gt=1)
+    )
+    for duplicate in duplicates:
+        lines = CartItem.objects.filter(
+            cart_id=duplicate['cart_id'], product_id=duplicate['product_id'], variant__isnull=True,
+        )
+        lines.exclude(id=duplicate['keep']).delete()
+        lines.update(quantity=duplicate['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0002_cart_session_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('variant__isnull', True)), fields=('cart', 'product'), name='cart_item_no_variant_uniq'),
+        ),
+    ]
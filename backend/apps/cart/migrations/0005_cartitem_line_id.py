@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0004_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='line_id',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
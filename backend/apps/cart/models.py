@@ -1,4 +1,8 @@
-from django.db import models
+from functools import cached_property
+
+from django.db import connection, models
+from django.db.models import DecimalField, ExpressionWrapper, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -9,35 +13,115 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Only guest carts have a session key
+            models.Index(fields=['session_key'], condition=Q(session_key__isnull=False), name='cart_session_idx'),
+        ]
+
     def __str__(self):
         if self.user:
             return f"Cart for {self.user.email}"
         return f"Guest cart {self.session_key}"
     
+    @cached_property
+    def totals(self):
+        """Item count and price total in one aggregate query"""
+        return self.items.with_prices().aggregate(
+            total_items=Coalesce(Sum('quantity'), 0),
+            total_price=Coalesce(Sum('line_total'), Value(0), output_field=PRICE_FIELD),
+        )
+
     @property
     def total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.totals['total_items']
     
     @property
     def total_price(self):
-        return sum(item.total_price for item in self.items.all())
+        return self.totals['total_price']
+
+    @property
+    def reservation_holder(self):
+        """Holder of the cart's stock reservations (see apps.cart.reservations)"""
+        return f'cart:{self.pk}'
     
 
+PRICE_FIELD = DecimalField(max_digits=10, decimal_places=2)
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_prices(self):
+        """Annotate unit_price and line_total, computed in the database from the product and variant"""
+        unit_price = ExpressionWrapper(
+            F('product__price') + Coalesce(F('variant__price_adjustment'), Value(0), output_field=PRICE_FIELD),
+            output_field=PRICE_FIELD,
+        )
+        return self.annotate(unit_price=unit_price).annotate(
+            line_total=ExpressionWrapper(F('unit_price') * F('quantity'), output_field=PRICE_FIELD),
+        )
+
+    def for_display(self):
+        """Everything CartItemSerializer reads, in a single query"""
+        return self.with_prices().select_related('product__brand', 'product__main_image_ref', 'variant')
+
+    def add_quantity(self, cart, product_id, variant_id, quantity):
+        """Create the line or add quantity to it in one INSERT ... ON CONFLICT statement.
+
+        The increment happens in the database, so concurrent adds to the same
+        line neither lose updates nor fail on the unique constraints.
+        """
+        self.add_quantities(cart, [(product_id, variant_id, quantity)])
+
+    def add_quantities(self, cart, lines):
+        """add_quantity for many (product_id, variant_id, quantity) lines, one statement per conflict target.
+
+        A line may appear only once: one statement cannot update a row twice.
+        """
+        table = self.model._meta.db_table
+        targets = [
+            ('(cart_id, product_id, variant_id)', [line for line in lines if line[1]]),
+            # NULL variants never conflict on (cart, product, variant); they are caught by the partial constraint
+            ('(cart_id, product_id) WHERE variant_id IS NULL', [line for line in lines if not line[1]]),
+        ]
+        with connection.cursor() as cursor:
+            for target, rows in targets:
+                if not rows:
+                    continue
+                values = ', '.join(['(%s, %s, %s, %s)'] * len(rows))
+                sql = f"""
+                    INSERT INTO {table} (cart_id, product_id, variant_id, quantity)
+                    VALUES {values}
+                    ON CONFLICT {target} DO UPDATE SET quantity = {table}.quantity + excluded.quantity
+                """
+                cursor.execute(sql, [value for row in rows for value in (cart.pk, *row)])
+
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey('products.Product', on_delete=models.CASCADE)
     variant = models.ForeignKey('products.ProductVariant', on_delete=models.CASCADE, null=True, blank=True)
     quantity = models.PositiveIntegerField(default=1)
+    # Id of the line in the cached guest cart this row was flushed from (see apps.cart.guest)
+    line_id = models.PositiveIntegerField(null=True, blank=True, editable=False)
 
+    objects = CartItemQuerySet.as_manager()
 
     class Meta:
         unique_together = ['cart', 'product', 'variant']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['cart', 'product'], condition=Q(variant__isnull=True), name='cart_item_no_variant_uniq',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.product.name} x {self.quantity}"
     
     @property
     def price(self):
+        # Rows loaded through with_prices() carry the price without touching product or variant
+        if hasattr(self, 'unit_price'):
+            return self.unit_price
         if self.variant:
             return self.variant.final_price
         return self.product.price
@@ -50,3 +134,26 @@ class CartItem(models.Model):
     def total_price(self):
         return self.subtotal
     
+
+
+class StockReservation(models.Model):
+    """Variant stock held by a cart until expires_at (see apps.cart.reservations)"""
+    variant = models.ForeignKey('products.ProductVariant', on_delete=models.CASCADE, related_name='reservations')
+    # 'cart:<id>' for a user's cart, 'guest:<token>' for a guest cart kept in the cache
+    holder = models.CharField(max_length=64)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['holder', 'variant'], name='reservation_holder_variant_uniq'),
+        ]
+        indexes = [
+            # Covers the live-reservation sum of a variant, so availability reads never touch the table
+            models.Index(fields=['variant', 'expires_at', 'quantity'], name='reservation_available_idx'),
+            # Range scanned by the sweeper
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.holder}: {self.variant_id} x {self.quantity}"
@@ -0,0 +1,213 @@
+"""Time-boxed stock reservations for cart lines.
+
+When STOCK_RESERVATION_TTL is set, every change to a cart line of a variant
+(adding, setting the quantity, batch operations, removing) makes the cart
+hold exactly the line's quantity of the variant's stock for TTL seconds, and
+other shoppers can only take what is left. Each cart holds at most one
+StockReservation row per variant; every change renews its expiry. A change
+asking for more than is left is refused and nothing is written.
+
+Placing an order consumes the cart's reservations: the ordered quantities
+must fit in what other carts leave available, are taken out of the
+variants' stock in the order's transaction, and the cart's holds on them are
+dropped. Cancelling or rejecting the order gives the stock back. Lines
+without a variant are not reserved.
+
+Available stock is the variant's stock minus its live reservations. The sum
+is read from reservation_available_idx alone, so it stays index-only however
+many reservations come and go. Expired rows stop counting the moment they
+expire and are deleted in batches by sweep_expired (the sweep_reservations
+command).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from apps.products.catalog import products_changed
+from apps.products.models import Product, ProductVariant
+from .models import StockReservation
+
+
+class InsufficientStock(ValueError):
+    def __init__(self, variant_id, available):
+        super().__init__(f'Only {available} of variant {variant_id} available')
+        self.variant_id = variant_id
+        self.available = available
+
+
+def enabled():
+    return bool(settings.STOCK_RESERVATION_TTL)
+
+
+def _reserved(now, exclude_holder=None):
+    """Subquery of the live reserved quantity of the outer variant"""
+    live = StockReservation.objects.filter(variant=OuterRef('pk'), expires_at__gt=now).order_by()
+    if exclude_holder is not None:
+        live = live.exclude(holder=exclude_holder)
+    return Subquery(live.values('variant').annotate(total=Sum('quantity')).values('total'))
+
+
+def available_stock(variant_ids, now=None, exclude_holder=None):
+    """{variant_id: stock not held by live reservations}, in one query.
+
+    Reservations of exclude_holder count as available.
+    """
+    now = now or timezone.now()
+    available = Greatest(F('stock') - Coalesce(_reserved(now, exclude_holder), Value(0)), Value(0))
+    return dict(
+        ProductVariant.objects.filter(pk__in=variant_ids).annotate(available=available).values_list('pk', 'available')
+    )
+
+
+def _lock(variant_ids):
+    """Lock the variants' rows so holds and orders of the same variants queue up"""
+    list(ProductVariant.objects.select_for_update().filter(pk__in=variant_ids).order_by('pk').values_list('pk'))
+
+
+def _check(holder, quantities, now, own_counts=True):
+    """Raise InsufficientStock for the first quantity that does not fit"""
+    available = available_stock(quantities, now=now, exclude_holder=holder)
+    held = {}
+    if own_counts:
+        held = dict(
+            StockReservation.objects.filter(holder=holder, variant_id__in=quantities, expires_at__gt=now)
+            .values_list('variant_id', 'quantity')
+        )
+    for variant_id, quantity in sorted(quantities.items()):
+        # Lowering a line the cart already holds never fails
+        if quantity > held.get(variant_id, 0) and quantity > available.get(variant_id, 0):
+            raise InsufficientStock(variant_id, available.get(variant_id, 0))
+
+
+def reserve(cart, quantities):
+    """Make the cart hold exactly the given quantities, {variant_id: quantity}, and renew them.
+
+    A quantity of 0 drops the cart's reservation of that variant. Raises
+    InsufficientStock, reserving nothing, when a quantity is more than the
+    cart holds already and more than other carts leave available. Call it
+    in the transaction that writes the cart's lines.
+    """
+    if not enabled() or not quantities:
+        return
+    holder = cart.reservation_holder
+    now = timezone.now()
+    with transaction.atomic():
+        _lock(quantities)
+        _check(holder, quantities, now)
+        StockReservation.objects.filter(
+            holder=holder, variant_id__in=[variant_id for variant_id, quantity in quantities.items() if not quantity],
+        ).delete()
+        StockReservation.objects.bulk_create(
+            [
+                StockReservation(
+                    holder=holder, variant_id=variant_id, quantity=quantity,
+                    expires_at=now + timedelta(seconds=settings.STOCK_RESERVATION_TTL),
+                )
+                for variant_id, quantity in sorted(quantities.items()) if quantity
+            ],
+            update_conflicts=True, unique_fields=['holder', 'variant'], update_fields=['quantity', 'expires_at'],
+        )
+
+
+def sync(cart, variant_ids):
+    """Reserve what a database cart's lines now hold of the given variants (see reserve)"""
+    variant_ids = {variant_id for variant_id in variant_ids if variant_id}
+    if not enabled() or not variant_ids:
+        return
+    quantities = dict.fromkeys(variant_ids, 0)
+    quantities.update(cart.items.filter(variant_id__in=variant_ids).values_list('variant_id', 'quantity'))
+    reserve(cart, quantities)
+
+
+def _move_stock(quantities, sign):
+    for variant_id, quantity in quantities.items():
+        ProductVariant.objects.filter(pk=variant_id).update(stock=Greatest(F('stock') + sign * quantity, 0))
+    # Bulk updates bypass ProductVariant.save(), so the product totals and the catalog follow here
+    product_ids = set(ProductVariant.objects.filter(pk__in=quantities).values_list('product_id', flat=True))
+    Product.objects.filter(pk__in=product_ids).recompute_stock()
+    products_changed(product_ids)
+
+
+def consume(cart, quantities):
+    """Take an order's quantities, {variant_id: quantity}, out of stock and drop the cart's holds on them.
+
+    cart is the cart the order was placed from, or None. Raises
+    InsufficientStock, changing nothing, when a quantity is more than other
+    carts leave available. Returns False when reservations are off, in
+    which case the stock is left alone.
+    """
+    if not enabled():
+        return False
+    holder = cart.reservation_holder if cart is not None else None
+    with transaction.atomic():
+        _lock(quantities)
+        _check(holder, quantities, timezone.now(), own_counts=False)
+        _move_stock(quantities, -1)
+        if holder is not None:
+            StockReservation.objects.filter(holder=holder, variant_id__in=quantities).delete()
+    return True
+
+
+def restock(quantities):
+    """Give back the stock an order consumed, e.g. when it is cancelled"""
+    with transaction.atomic():
+        _move_stock(quantities, 1)
+
+
+def release(cart, variant_ids=None):
+    """Drop the cart's reservations, of the given variants or all of them"""
+    # With reservations off, whatever is left expires and is swept
+    if not enabled():
+        return
+    reservations = StockReservation.objects.filter(holder=cart.reservation_holder)
+    if variant_ids is not None:
+        reservations = reservations.filter(variant_id__in=variant_ids)
+    reservations.delete()
+
+
+def transfer(source, target):
+    """Move source's live reservations to target, adding to what target already holds, and drop source's"""
+    now = timezone.now()
+    reservations = StockReservation.objects.filter(holder=source.reservation_holder)
+    moved = {
+        variant_id: (quantity, expires_at)
+        for variant_id, quantity, expires_at in reservations.filter(expires_at__gt=now)
+        .values_list('variant_id', 'quantity', 'expires_at')
+    }
+    if moved:
+        held = {
+            variant_id: (quantity, expires_at)
+            for variant_id, quantity, expires_at in StockReservation.objects.filter(
+                holder=target.reservation_holder, variant_id__in=moved, expires_at__gt=now,
+            ).values_list('variant_id', 'quantity', 'expires_at')
+        }
+        StockReservation.objects.bulk_create(
+            [
+                StockReservation(
+                    holder=target.reservation_holder, variant_id=variant_id,
+                    quantity=quantity + held.get(variant_id, (0, expires_at))[0],
+                    expires_at=max(expires_at, held.get(variant_id, (0, expires_at))[1]),
+                )
+                for variant_id, (quantity, expires_at) in moved.items()
+            ],
+            update_conflicts=True, unique_fields=['holder', 'variant'], update_fields=['quantity', 'expires_at'],
+        )
+    reservations.delete()
+
+
+def sweep_expired(batch_size=5000, now=None):
+    """Delete expired reservations in batches of set-based deletes; returns the number deleted"""
+    now = now or timezone.now()
+    expired = StockReservation.objects.filter(expires_at__lte=now).order_by()
+    deleted = 0
+    while True:
+        # Short transactions keep the sweeper from blocking add-to-cart for long
+        batch = list(expired.values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        count, _ = StockReservation.objects.filter(pk__in=batch).delete()
+        deleted += count
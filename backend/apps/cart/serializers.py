@@ -1,10 +1,27 @@
 from rest_framework import serializers
 from .models import Cart, CartItem
-from apps.products.serializers import ProductSerializer, ProductVariantSerializer
+from apps.products.models import Product, ProductVariant
+
+
+class CartProductSerializer(serializers.ModelSerializer):
+    """Only what the cart drawer shows of a product"""
+    brand_name = serializers.CharField(source='brand.name', read_only=True, default=None)
+    main_image = serializers.ReadOnlyField()
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'brand_name', 'price', 'main_image']
+
+
+class CartVariantSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductVariant
+        fields = ['id', 'size', 'color']
+
 
 class CartItemSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
-    variant = ProductVariantSerializer(read_only=True)
+    product = CartProductSerializer(read_only=True)
+    variant = CartVariantSerializer(read_only=True)
     price = serializers.ReadOnlyField()
     subtotal = serializers.ReadOnlyField()
     
@@ -13,7 +30,7 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'variant', 'quantity', 'price', 'subtotal']
 
 class CartSerializer(serializers.ModelSerializer):
-    items = CartItemSerializer(many=True, read_only=True)
+    items = serializers.SerializerMethodField()
     total_items = serializers.ReadOnlyField()
     total_price = serializers.ReadOnlyField()
     
@@ -21,6 +38,20 @@ class CartSerializer(serializers.ModelSerializer):
         model = Cart
         fields = ['id', 'items', 'total_items', 'total_price', 'created_at', 'updated_at']
 
+    def get_items(self, obj):
+        # Loaded here rather than through the relation so the query count never depends on the caller
+        return CartItemSerializer(obj.items.for_display().order_by('pk'), many=True).data
+
+class GuestCartSerializer(serializers.Serializer):
+    """Same representation as CartSerializer for a GuestCart held in the cache"""
+    id = serializers.ReadOnlyField()
+    items = CartItemSerializer(many=True, read_only=True)
+    total_items = serializers.ReadOnlyField()
+    total_price = serializers.ReadOnlyField()
+    created_at = serializers.DateTimeField(read_only=True)
+    updated_at = serializers.DateTimeField(read_only=True)
+
+
 class AddToCartSerializer(serializers.Serializer):
     product_id = serializers.IntegerField()
     variant_id = serializers.IntegerField(required=False, allow_null=True)
@@ -29,4 +60,53 @@ class AddToCartSerializer(serializers.Serializer):
     def validate_quantity(self, value):
         if value < 1:
             raise serializers.ValidationError("La cantidad debe ser mayor a 0")
-        return value
\ No newline at end of file
+        return value
+
+
+class CartOperationSerializer(serializers.Serializer):
+    """One step of a batch: add to a line, set its quantity (0 removes it) or remove it.
+
+    Lines are given by item_id or by product_id plus variant_id.
+    """
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    item_id = serializers.IntegerField(required=False)
+    product_id = serializers.IntegerField(required=False)
+    variant_id = serializers.IntegerField(required=False, allow_null=True)
+    quantity = serializers.IntegerField(required=False, min_value=0)
+
+    def validate(self, attrs):
+        if attrs['op'] == 'add' and 'product_id' not in attrs:
+            raise serializers.ValidationError('product_id es requerido para agregar')
+        if 'item_id' not in attrs and 'product_id' not in attrs:
+            raise serializers.ValidationError('Se requiere item_id o product_id')
+        if attrs['op'] != 'remove' and 'quantity' not in attrs:
+            raise serializers.ValidationError('quantity es requerido')
+        if attrs['op'] == 'add' and attrs['quantity'] < 1:
+            raise serializers.ValidationError('La cantidad debe ser mayor a 0')
+        return attrs
+
+
+class CartBatchSerializer(serializers.Serializer):
+    MAX_OPERATIONS = 100
+
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=MAX_OPERATIONS)
+
+    def validate_operations(self, operations):
+        # One query for all products and one for all variants, whatever the batch size
+        product_ids = {operation['product_id'] for operation in operations if 'product_id' in operation}
+        variant_ids = {operation['variant_id'] for operation in operations if operation.get('variant_id')}
+        products = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+        variants = dict(ProductVariant.objects.filter(pk__in=variant_ids).values_list('pk', 'product_id'))
+
+        errors = []
+        for operation in operations:
+            error = {}
+            if 'product_id' in operation and operation['product_id'] not in products:
+                error['product_id'] = 'Producto no encontrado'
+            variant_id = operation.get('variant_id')
+            if variant_id and variants.get(variant_id) != operation.get('product_id'):
+                error['variant_id'] = 'Variante no encontrada para este producto'
+            errors.append(error)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return operations
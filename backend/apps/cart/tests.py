@@ -1,3 +1,436 @@
-from django.test import TestCase
+import threading
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from apps.orders.models import Order
+from apps.orders.tests import CHECKOUT
+from apps.products.tests import MediaTestCase, make_image_file
+from apps.products.models import Brand, Category, Product, ProductImage, ProductVariant
+from . import batch, guest
+from .models import Cart, CartItem, StockReservation
+
+User = get_user_model()
+
+
+class ConcurrentAddToCartTests(TransactionTestCase):
+    """Many requests adding to the same cart line at once must all be counted"""
+
+    THREADS = 8
+    ADDS_PER_THREAD = 10
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='cliente', email='cliente@example.com', password='x')
+        category = Category.objects.create(name='mujer', display_name='Mujer')
+        brand = Brand.objects.create(name='Marca')
+        self.product = Product.objects.create(
+            name='Blusa', description='Blusa', category=category, brand=brand, price=50000,
+        )
+        self.variant = ProductVariant.objects.create(product=self.product, size='M', color='azul', stock=100)
+        # The cart exists up front so every thread works on the same one
+        self.cart = Cart.objects.create(user=self.user)
+
+    def hammer(self, variant_id, quantity):
+        errors = []
+        start = threading.Barrier(self.THREADS)
+
+        def add():
+            client = APIClient()
+            client.force_authenticate(self.user)
+            try:
+                start.wait()
+                for _ in range(self.ADDS_PER_THREAD):
+                    response = client.post('/api/cart/add/', {
+                        'product_id': self.product.pk, 'variant_id': variant_id, 'quantity': quantity,
+                    }, format='json')
+                    if response.status_code != 201:
+                        errors.append(response.status_code)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_variant_line(self):
+        self.assertEqual(self.hammer(self.variant.pk, 2), [])
+        item = CartItem.objects.get(cart=self.cart)
+        self.assertEqual(item.variant_id, self.variant.pk)
+        self.assertEqual(item.quantity, self.THREADS * self.ADDS_PER_THREAD * 2)
+
+    def test_line_without_variant(self):
+        self.assertEqual(self.hammer(None, 1), [])
+        item = CartItem.objects.get(cart=self.cart)
+        self.assertIsNone(item.variant_id)
+        self.assertEqual(item.quantity, self.THREADS * self.ADDS_PER_THREAD)
+
+
+@override_settings(STOCK_RESERVATION_TTL=600)
+class StockReservationTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='mujer', display_name='Mujer')
+        self.product = Product.objects.create(name='Blusa', description='Blusa', category=category, price=50000)
+        self.variant = ProductVariant.objects.create(product=self.product, size='M', color='azul', stock=5)
+        self.user = User.objects.create_user(username='cliente', email='cliente@example.com', password='x')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.guest = APIClient()
+
+    def add(self, client, quantity):
+        return client.post('/api/cart/add/', {
+            'product_id': self.product.pk, 'variant_id': self.variant.pk, 'quantity': quantity,
+        }, format='json')
+
+    def held(self):
+        return dict(StockReservation.objects.values_list('holder', 'quantity'))
+
+    def item(self):
+        return CartItem.objects.get(cart__user=self.user)
+
+    def test_add_reserves_and_refuses_what_others_hold(self):
+        self.assertEqual(self.add(self.guest, 3).status_code, 201)
+        response = self.add(self.client, 3)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['available'], 2)
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+        self.assertEqual(self.add(self.client, 2).status_code, 201)
+        self.assertEqual(sorted(self.held().values()), [2, 3])
+
+    def test_patch_reserves_the_new_quantity(self):
+        self.add(self.client, 2)
+        self.add(self.guest, 2)
+        url = f'/api/cart/items/{self.item().pk}/'
+        self.assertEqual(self.client.patch(url, {'quantity': 4}, format='json').status_code, 400)
+        self.assertEqual(self.item().quantity, 2)
+        self.assertEqual(self.client.patch(url, {'quantity': 3}, format='json').status_code, 200)
+        self.assertEqual(self.held()[self.user.cart.get().reservation_holder], 3)
+
+    def test_patch_to_zero_releases(self):
+        self.add(self.client, 2)
+        response = self.client.patch(f'/api/cart/items/{self.item().pk}/', {'quantity': 0}, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.held(), {})
+
+    def test_batch_over_stock_rolls_back(self):
+        self.add(self.guest, 4)
+        response = self.client.post('/api/cart/batch/', {'operations': [
+            {'op': 'add', 'product_id': self.product.pk, 'variant_id': self.variant.pk, 'quantity': 1},
+            {'op': 'add', 'product_id': self.product.pk, 'variant_id': self.variant.pk, 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+        self.assertEqual(list(self.held().values()), [4])
+
+    def test_guest_line_changes_follow_the_reservation(self):
+        self.add(self.guest, 2)
+        line_id = self.guest.get('/api/cart/').data['items'][0]['id']
+        self.assertEqual(self.guest.patch(f'/api/cart/items/{line_id}/', {'quantity': 6}, format='json').status_code, 400)
+        self.assertEqual(list(self.held().values()), [2])
+        self.guest.patch(f'/api/cart/items/{line_id}/', {'quantity': 5}, format='json')
+        self.assertEqual(list(self.held().values()), [5])
+        self.assertEqual(self.guest.delete(f'/api/cart/items/{line_id}/remove/').status_code, 204)
+        self.assertEqual(self.held(), {})
+
+    def checkout(self, client, quantity):
+        return client.post('/api/orders/create/', {**CHECKOUT, 'items': [
+            {'product_id': self.product.pk, 'variant_id': self.variant.pk, 'quantity': quantity},
+        ]}, format='json')
+
+    def test_checkout_consumes_the_reservation(self):
+        self.add(self.client, 3)
+        self.assertEqual(self.checkout(self.client, 3).status_code, 201)
+        self.variant.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual((self.variant.stock, self.product.stock), (2, 2))
+        self.assertEqual(self.held(), {})
+        self.assertTrue(Order.objects.get().stock_deducted)
+
+    def test_checkout_cannot_take_stock_others_hold(self):
+        self.add(self.guest, 4)
+        response = self.checkout(self.client, 2)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['available'], 1)
+        self.assertFalse(Order.objects.exists())
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 5)
+        # The holder itself can check out what it reserved
+        self.assertEqual(self.checkout(self.guest, 4).status_code, 201)
+
+    def test_cancelling_gives_the_stock_back(self):
+        self.checkout(self.client, 3)
+        order = Order.objects.get()
+        self.user.role = 'super_admin'
+        self.user.save()
+        self.client.patch(f'/api/orders/{order.pk}/status/', {'status': 'cancelled'}, format='json')
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.stock, 5)
+        order.refresh_from_db()
+        self.assertFalse(order.stock_deducted)
+
+
+class GuestCartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='mujer', display_name='Mujer')
+        self.product = Product.objects.create(name='Blusa', description='Blusa', category=category, price=50000)
+        self.variant = ProductVariant.objects.create(product=self.product, size='M', color='azul', stock=5)
+        self.client = APIClient()
+
+    def add(self, quantity=1):
+        response = self.client.post('/api/cart/add/', {
+            'product_id': self.product.pk, 'variant_id': self.variant.pk, 'quantity': quantity,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return guest.unsign_token(self.client.cookies[guest.COOKIE_NAME].value)
+
+    def flushed_quantity(self, token):
+        return CartItem.objects.filter(cart__session_key=token).values_list('quantity', flat=True).first()
+
+    def test_changes_stay_in_the_cache_until_checkout(self):
+        token = self.add(2)
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(self.client.get('/api/cart/count/').data['total_items'], 2)
+        self.client.post('/api/cart/checkout/')
+        self.assertEqual(self.flushed_quantity(token), 2)
+
+    def test_evicted_cart_reloads_its_flushed_copy(self):
+        token = self.add(2)
+        self.client.post('/api/cart/checkout/')
+        self.add(1)
+        cache.delete(f'guest-cart:{token}')
+        self.assertEqual(self.client.get('/api/cart/').data['total_items'], 2)
+
+    def test_line_ids_survive_flush_and_eviction(self):
+        token = self.add(2)
+        line_id = self.client.get('/api/cart/').data['items'][0]['id']
+        # Each flush re-creates the rows, so their pks no longer match the line ids
+        self.client.post('/api/cart/checkout/')
+        self.add(1)
+        self.client.post('/api/cart/checkout/')
+        self.assertNotIn(line_id, CartItem.objects.values_list('pk', flat=True))
+        cache.delete(f'guest-cart:{token}')
+
+        response = self.client.patch(f'/api/cart/items/{line_id}/', {'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.data['items']], [line_id])
+        self.assertEqual(response.data['total_items'], 1)
+        cache.delete(f'guest-cart:{token}')
+        self.assertEqual(self.client.delete(f'/api/cart/items/{line_id}/remove/').status_code, 204)
+        self.assertEqual(self.client.get('/api/cart/count/').data['total_items'], 0)
+
+    def test_flush_dirty_carts_writes_changed_carts_once(self):
+        token = self.add(2)
+        self.assertEqual(guest.flush_dirty_carts(), 1)
+        self.assertEqual(self.flushed_quantity(token), 2)
+        self.assertEqual(guest.flush_dirty_carts(), 0)
+        self.add(1)
+        self.assertEqual(guest.flush_dirty_carts(), 1)
+        self.assertEqual(self.flushed_quantity(token), 3)
+
+    @mock.patch.object(guest, 'LOCK_TIMEOUT', 0.05)
+    def test_busy_cart_is_refused_and_the_lock_left_alone(self):
+        token = self.add(1)
+        lock = f'guest-cart:{token}:lock'
+        cache.set(lock, 'other')
+        response = self.client.post('/api/cart/add/', {
+            'product_id': self.product.pk, 'variant_id': self.variant.pk, 'quantity': 1,
+        }, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(cache.get(lock), 'other')
+        self.assertEqual(self.client.get('/api/cart/count/').data['total_items'], 1)
+
+    def test_lock_taken_over_after_expiry_is_not_released(self):
+        lock = 'guest-cart:token:lock'
+        with guest._locked('token'):
+            # Our lock expired and another request took it
+            cache.set(lock, 'other')
+        self.assertEqual(cache.get(lock), 'other')
+
+
+class CartBatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='cliente', email='cliente@example.com', password='x')
+        category = Category.objects.create(name='mujer', display_name='Mujer')
+        self.product = Product.objects.create(name='Blusa', description='Blusa', category=category, price=50000)
+        self.other = Product.objects.create(name='Falda', description='Falda', category=category, price=80000)
+        self.small = ProductVariant.objects.create(product=self.product, size='S', color='azul', stock=10)
+        self.medium = ProductVariant.objects.create(product=self.product, size='M', color='azul', stock=10)
+        self.client = APIClient()
+
+    def batch(self, *operations):
+        return self.client.post('/api/cart/batch/', {'operations': list(operations)}, format='json')
+
+    def lines(self, response):
+        return sorted(
+            (item['product']['id'], item['variant']['id'] if item['variant'] else None, item['quantity'])
+            for item in response.data['items']
+        )
+
+    def stored_lines(self, cart):
+        return sorted(cart.items.values_list('product_id', 'variant_id', 'quantity'))
+
+    def test_add_set_and_remove_in_one_batch(self):
+        self.client.force_authenticate(self.user)
+        cart = Cart.objects.create(user=self.user)
+        small = CartItem.objects.create(cart=cart, product=self.product, variant=self.small, quantity=1)
+        plain = CartItem.objects.create(cart=cart, product=self.other, quantity=1)
+        response = self.batch(
+            {'op': 'add', 'product_id': self.product.pk, 'variant_id': self.small.pk, 'quantity': 2},
+            {'op': 'add', 'product_id': self.product.pk, 'variant_id': self.medium.pk, 'quantity': 1},
+            {'op': 'set', 'item_id': plain.pk, 'quantity': 4},
+            {'op': 'set', 'product_id': self.product.pk, 'variant_id': self.medium.pk, 'quantity': 5},
+            {'op': 'add', 'product_id': self.product.pk, 'variant_id': self.medium.pk, 'quantity': 1},
+        )
+        self.assertEqual(response.status_code, 200)
+        expected = [
+            (self.product.pk, self.small.pk, 3), (self.product.pk, self.medium.pk, 6), (self.other.pk, None, 4),
+        ]
+        self.assertEqual(self.stored_lines(cart), sorted(expected))
+        self.assertEqual(self.lines(response), sorted(expected))
+        # Existing lines are updated in place
+        self.assertEqual(cart.items.get(variant=self.small).pk, small.pk)
+        self.assertEqual(cart.items.get(variant=None).pk, plain.pk)
+
+        response = self.batch({'op': 'remove', 'item_id': small.pk}, {'op': 'set', 'item_id': plain.pk, 'quantity': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stored_lines(cart), [(self.product.pk, self.medium.pk, 6)])
+
+    def test_adding_to_an_existing_line_without_variant(self):
+        self.client.force_authenticate(self.user)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.other, quantity=2)
+        response = self.batch({'op': 'add', 'product_id': self.other.pk, 'quantity': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stored_lines(cart), [(self.other.pk, None, 3)])
+
+    def test_line_added_by_a_concurrent_request_is_merged(self):
+        self.client.force_authenticate(self.user)
+        cart = Cart.objects.create(user=self.user)
+        apply_operations = batch.apply_operations
+
+        def add_concurrently(*args):
+            # Another request adds the same lines after the batch has read the cart
+            CartItem.objects.add_quantities(cart, [(self.other.pk, None, 1), (self.product.pk, self.small.pk, 1)])
+            return apply_operations(*args)
+
+        with mock.patch.object(batch, 'apply_operations', side_effect=add_concurrently):
+            response = self.batch(
+                {'op': 'add', 'product_id': self.other.pk, 'quantity': 2},
+                {'op': 'add', 'product_id': self.product.pk, 'variant_id': self.small.pk, 'quantity': 2},
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.stored_lines(cart), sorted([(self.other.pk, None, 3), (self.product.pk, self.small.pk, 3)]),
+        )
+
+    def test_unknown_item_rolls_the_whole_batch_back(self):
+        self.client.force_authenticate(self.user)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, variant=self.small, quantity=1)
+        response = self.batch(
+            {'op': 'add', 'product_id': self.product.pk, 'variant_id': self.medium.pk, 'quantity': 2},
+            {'op': 'remove', 'product_id': self.product.pk, 'variant_id': self.small.pk},
+            {'op': 'set', 'item_id': 999999, 'quantity': 1},
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['operation'], 2)
+        self.assertEqual(self.stored_lines(cart), [(self.product.pk, self.small.pk, 1)])
+
+    def test_invalid_operations_are_refused_before_anything_is_applied(self):
+        self.client.force_authenticate(self.user)
+        response = self.batch(
+            {'op': 'add', 'product_id': self.product.pk, 'variant_id': self.small.pk, 'quantity': 1},
+            {'op': 'add', 'product_id': self.other.pk, 'variant_id': self.medium.pk, 'quantity': 1},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['operations'][0], {})
+        self.assertIn('variant_id', response.data['operations'][1])
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_guest_batch(self):
+        response = self.batch(
+            {'op': 'add', 'product_id': self.product.pk, 'variant_id': self.small.pk, 'quantity': 2},
+            {'op': 'add', 'product_id': self.other.pk, 'quantity': 1},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(guest.COOKIE_NAME, self.client.cookies)
+        plain = next(item['id'] for item in response.data['items'] if item['variant'] is None)
+
+        response = self.batch(
+            {'op': 'set', 'item_id': plain, 'quantity': 3},
+            {'op': 'remove', 'product_id': self.product.pk, 'variant_id': self.small.pk},
+        )
+        self.assertEqual(self.lines(response), [(self.other.pk, None, 3)])
+        # Guest batches only touch the cached cart
+        self.assertFalse(Cart.objects.exists())
+
+        response = self.batch({'op': 'add', 'product_id': self.other.pk, 'quantity': 1}, {'op': 'remove', 'item_id': 999999})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get('/api/cart/count/').data['total_items'], 3)
+
+
+class CartRepresentationTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user(username='cliente', email='cliente@example.com', password='x')
+        category = Category.objects.create(name='mujer', display_name='Mujer')
+        self.cart = Cart.objects.create(user=self.user)
+        with mock.patch('apps.products.signals.schedule_derivatives'):
+            for index in range(10):
+                product = Product.objects.create(
+                    name=f'Producto {index}', description='-', category=category, price=10000,
+                    brand=Brand.objects.create(name=f'Marca {index}'),
+                )
+                ProductImage.objects.create(product=product, image=make_image_file(color=(index, 0, 0)), is_main=True)
+                variant = None
+                if index % 2:
+                    variant = ProductVariant.objects.create(
+                        product=product, size='M', color='azul', stock=5, price_adjustment=1000 * index,
+                    )
+                CartItem.objects.create(cart=self.cart, product=product, variant=variant, quantity=index + 1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_cart_is_loaded_with_a_fixed_number_of_queries(self):
+        # The cart, its lines with products, brands, images and variants, and the totals
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/cart/')
+        self.assertEqual(len(response.data['items']), 10)
+        self.assertTrue(all(item['product']['brand_name'] and item['product']['main_image'] for item in response.data['items']))
+
+    def test_count_is_a_single_aggregate(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/cart/count/')
+        self.assertEqual(response.data, {'total_items': 55})
+
+    def test_guest_count_reads_only_the_cache(self):
+        guest_client = APIClient()
+        guest_client.post('/api/cart/add/', {'product_id': Product.objects.first().pk, 'quantity': 2}, format='json')
+        with self.assertNumQueries(0):
+            response = guest_client.get('/api/cart/count/')
+        self.assertEqual(response.data, {'total_items': 2})
+
+    def test_totals_include_variant_price_adjustments(self):
+        # Lines 0..9 hold index + 1 units; odd lines have a variant adding 1000 * index
+        expected = sum(
+            (10000 + (1000 * index if index % 2 else 0)) * (index + 1) for index in range(10)
+        )
+        with self.assertNumQueries(1):
+            totals = self.cart.totals
+        self.assertEqual(totals, {'total_items': 55, 'total_price': expected})
+        response = self.client.get('/api/cart/')
+        self.assertEqual(Decimal(response.data['total_price']), expected)
+        line = next(item for item in response.data['items'] if item['quantity'] == 4)
+        self.assertEqual((Decimal(line['price']), Decimal(line['subtotal'])), (13000, 52000))
@@ -3,8 +3,11 @@ from . import views
 
 urlpatterns = [
     path('', views.CartView.as_view(), name='cart'),
+    path('count/', views.cart_count, name='cart-count'),
     path('add/', views.add_to_cart, name='add-to-cart'),
+    path('batch/', views.batch_cart, name='batch-cart'),
     path('items/<int:item_id>/', views.update_cart_item, name='update-cart-item'),
     path('items/<int:item_id>/remove/', views.remove_from_cart, name='remove-from-cart'),
+    path('checkout/', views.checkout_cart, name='checkout-cart'),
     path('clear/', views.clear_cart, name='clear-cart'),
 ]
\ No newline at end of file
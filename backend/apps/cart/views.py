@@ -1,24 +1,41 @@
 from rest_framework import generics, permissions, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
 from django.shortcuts import get_object_or_404
+from . import reservations
+from .batch import CartOperationError, apply_to_cart
+from .guest import GuestCart
 from .models import Cart, CartItem
-from .serializers import CartSerializer, AddToCartSerializer
+from .serializers import CartSerializer, AddToCartSerializer, CartBatchSerializer, GuestCartSerializer
 from apps.products.models import Product, ProductVariant
 
+
+def guest_cart_response(cart, status=status.HTTP_200_OK):
+    return cart.set_token(Response(GuestCartSerializer(cart).data, status=status))
+
+
+def insufficient_stock_response(error):
+    return Response(
+        {'error': 'Stock insuficiente', 'variant_id': error.variant_id, 'available': error.available},
+        status=status.HTTP_400_BAD_REQUEST,
+    )
+
+
 class CartView(generics.RetrieveAPIView):
     serializer_class = CartSerializer
     permission_classes = [permissions.AllowAny]
+
+    def retrieve(self, request, *args, **kwargs):
+        # Guest carts are served from the cache, see apps.cart.guest
+        if not request.user.is_authenticated:
+            return guest_cart_response(GuestCart.from_request(request))
+        return super().retrieve(request, *args, **kwargs)
     
     def get_object(self):
-        if self.request.user.is_authenticated:
-            cart, created = Cart.objects.get_or_create(user=self.request.user)
-        else:
-            session_key = self.request.session.session_key
-            if not session_key:
-                self.request.session.create()
-                session_key = self.request.session.session_key
-            cart, created = Cart.objects.get_or_create(session_key=session_key)
+        cart, created = Cart.objects.get_or_create(user=self.request.user)
         return cart
 
 @api_view(['POST'])
@@ -35,66 +52,95 @@ def add_to_cart(request):
         if variant_id:
             variant = get_object_or_404(ProductVariant, id=variant_id)
         
-        # Get or create cart
-        if request.user.is_authenticated:
+        variant_id = variant.pk if variant else None
+        try:
+            if not request.user.is_authenticated:
+                cart = GuestCart.from_request(request)
+                cart.add(product.pk, variant_id, quantity)
+                return guest_cart_response(cart, status=status.HTTP_201_CREATED)
+
             cart, created = Cart.objects.get_or_create(user=request.user)
-        else:
-            session_key = request.session.session_key
-            if not session_key:
-                request.session.create()
-                session_key = request.session.session_key
-            cart, created = Cart.objects.get_or_create(session_key=session_key)
-        
-        # Add or update cart item
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            variant=variant,
-            defaults={'quantity': quantity}
-        )
-        
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+            with transaction.atomic():
+                # Add or update cart item; double clicks and parallel tabs each add their quantity
+                CartItem.objects.add_quantity(cart, product.pk, variant_id, quantity)
+                reservations.sync(cart, [variant_id])
+        except reservations.InsufficientStock as e:
+            return insufficient_stock_response(e)
         
         return Response(CartSerializer(cart).data, status=status.HTTP_201_CREATED)
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['POST'])
+@permission_classes([permissions.AllowAny])
+def batch_cart(request):
+    """Apply a list of add / set / remove operations atomically and return the cart once"""
+    serializer = CartBatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    operations = serializer.validated_data['operations']
+
+    try:
+        if not request.user.is_authenticated:
+            cart = GuestCart.from_request(request)
+            cart.apply(operations)
+            return guest_cart_response(cart)
+
+        cart, created = Cart.objects.get_or_create(user=request.user)
+        apply_to_cart(cart, operations)
+    except CartOperationError as e:
+        return Response({'error': e.message, 'operation': e.index}, status=status.HTTP_404_NOT_FOUND)
+    except reservations.InsufficientStock as e:
+        return insufficient_stock_response(e)
+    return Response(CartSerializer(cart).data)
+
 @api_view(['PATCH'])
 @permission_classes([permissions.AllowAny])
 def update_cart_item(request, item_id):
     quantity = request.data.get('quantity', 1)
-    
+
     try:
-        if request.user.is_authenticated:
-            cart_item = CartItem.objects.get(id=item_id, cart__user=request.user)
-        else:
-            session_key = request.session.session_key
-            cart_item = CartItem.objects.get(id=item_id, cart__session_key=session_key)
-        
-        if quantity <= 0:
-            cart_item.delete()
-            return Response({'message': 'Item eliminado'}, status=status.HTTP_204_NO_CONTENT)
-        else:
-            cart_item.quantity = quantity
-            cart_item.save()
-            return Response(CartSerializer(cart_item.cart).data)
+        if not request.user.is_authenticated:
+            cart = GuestCart.from_request(request)
+            found = cart.remove(item_id) if quantity <= 0 else cart.set_quantity(item_id, quantity)
+            if not found:
+                return Response({'error': 'Item no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+            if quantity <= 0:
+                return Response({'message': 'Item eliminado'}, status=status.HTTP_204_NO_CONTENT)
+            return guest_cart_response(cart)
+
+        with transaction.atomic():
+            cart_item = CartItem.objects.select_related('cart').get(id=item_id, cart__user=request.user)
+            if quantity <= 0:
+                cart_item.delete()
+            else:
+                cart_item.quantity = quantity
+                cart_item.save()
+            reservations.sync(cart_item.cart, [cart_item.variant_id])
     
     except CartItem.DoesNotExist:
         return Response({'error': 'Item no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+    except reservations.InsufficientStock as e:
+        return insufficient_stock_response(e)
+
+    if quantity <= 0:
+        return Response({'message': 'Item eliminado'}, status=status.HTTP_204_NO_CONTENT)
+    return Response(CartSerializer(cart_item.cart).data)
 
 @api_view(['DELETE'])
 @permission_classes([permissions.AllowAny])
 def remove_from_cart(request, item_id):
+    if not request.user.is_authenticated:
+        cart = GuestCart.from_request(request)
+        # Removing a line drops its reservation, see GuestCart.changing
+        if not cart.remove(item_id):
+            return Response({'error': 'Item no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'message': 'Item eliminado'}, status=status.HTTP_204_NO_CONTENT)
+
     try:
-        if request.user.is_authenticated:
-            cart_item = CartItem.objects.get(id=item_id, cart__user=request.user)
-        else:
-            session_key = request.session.session_key
-            cart_item = CartItem.objects.get(id=item_id, cart__session_key=session_key)
-        
+        cart_item = CartItem.objects.get(id=item_id, cart__user=request.user)
         cart_item.delete()
+        if cart_item.variant_id:
+            reservations.release(cart_item.cart, [cart_item.variant_id])
         return Response({'message': 'Item eliminado'}, status=status.HTTP_204_NO_CONTENT)
     
     except CartItem.DoesNotExist:
@@ -104,9 +150,35 @@ def remove_from_cart(request, item_id):
 @permission_classes([permissions.AllowAny])
 def clear_cart(request):
     if request.user.is_authenticated:
-        Cart.objects.filter(user=request.user).delete()
+        carts = Cart.objects.filter(user=request.user)
+        for cart in carts:
+            reservations.release(cart)
+        carts.delete()
     else:
-        session_key = request.session.session_key
-        Cart.objects.filter(session_key=session_key).delete()
+        cart = GuestCart.from_request(request)
+        reservations.release(cart)
+        cart.clear()
     
-    return Response({'message': 'Carrito limpiado'}, status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+    return Response({'message': 'Carrito limpiado'}, status=status.HTTP_204_NO_CONTENT)
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def cart_count(request):
+    """Item count for the header badge; never creates a cart or a session"""
+    if not request.user.is_authenticated:
+        return Response({'total_items': GuestCart.from_request(request).total_items})
+    items = CartItem.objects.filter(cart__user=request.user)
+    return Response(items.aggregate(total_items=Coalesce(Sum('quantity'), 0)))
+
+
+@api_view(['POST'])
+@permission_classes([permissions.AllowAny])
+def checkout_cart(request):
+    """Called when checkout starts: guest carts are written through to the database"""
+    if not request.user.is_authenticated:
+        cart = GuestCart.from_request(request)
+        if cart.data['dirty']:
+            cart.flush()
+        return guest_cart_response(cart)
+    cart, created = Cart.objects.get_or_create(user=request.user)
+    return Response(CartSerializer(cart).data)
@@ -0,0 +1,85 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('products', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_number', models.CharField(max_length=20, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'Pendiente'), ('preparing', 'Preparando paquete'), ('shipped', 'Paquete enviado'), ('delivered', 'Entregado'), ('cancelled', 'Cancelado'), ('rejected', 'Rechazado')], default='pending', max_length=20)),
+                ('tracking_number', models.CharField(blank=True, max_length=50)),
+                ('shipping_company', models.CharField(blank=True, max_length=100)),
+                ('billing_first_name', models.CharField(max_length=30)),
+                ('billing_last_name', models.CharField(max_length=30)),
+                ('billing_email', models.EmailField(max_length=254)),
+                ('billing_phone', models.CharField(max_length=20)),
+                ('billing_address', models.TextField()),
+                ('billing_city', models.CharField(max_length=50)),
+                ('billing_department', models.CharField(max_length=50)),
+                ('billing_postal_code', models.CharField(max_length=10)),
+                ('shipping_first_name', models.CharField(max_length=30)),
+                ('shipping_last_name', models.CharField(max_length=30)),
+                ('shipping_address', models.TextField()),
+                ('shipping_city', models.CharField(max_length=50)),
+                ('shipping_department', models.CharField(max_length=50)),
+                ('shipping_postal_code', models.CharField(max_length=10)),
+                ('subtotal', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('shipping_cost', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('tax', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('total', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('assigned_admin', models.ForeignKey(blank=True, limit_choices_to={'role__in': ['admin', 'super_admin']}, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='assigned_orders', to=settings.AUTH_USER_MODEL)),
+                ('guest_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='accounts.guestuser')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='OrderItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('is_prepared', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='orders.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='products.product')),
+                ('variant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='products.productvariant')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='OrderStatusHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pendiente'), ('preparing', 'Preparando paquete'), ('shipped', 'Paquete enviado'), ('delivered', 'Entregado'), ('cancelled', 'Cancelado'), ('rejected', 'Rechazado')], max_length=20)),
+                ('notes', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('changed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_history', to='orders.order')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
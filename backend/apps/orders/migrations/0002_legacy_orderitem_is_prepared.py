@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def add_is_prepared(apps, schema_editor):
+    # Databases created before is_prepared existed (formerly patched by run_migrations.py)
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        columns = {column.name for column in connection.introspection.get_table_description(cursor, OrderItem._meta.db_table)}
+    if 'is_prepared' not in columns:
+        schema_editor.add_field(OrderItem, OrderItem._meta.get_field('is_prepared'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_is_prepared, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_order_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='stock_deducted',
+            field=models.BooleanField(default=False),
+        ),
+    ]
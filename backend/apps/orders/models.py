@@ -16,7 +16,8 @@ class Order(models.Model):
         ('rejected', 'Rechazado'),
     ]
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    # user and assigned_admin are indexed together with created_at in Meta.indexes
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, db_index=False)
     guest_user = models.ForeignKey(GuestUser, on_delete=models.CASCADE, null=True, blank=True)
     order_number = models.CharField(max_length=20, unique=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
@@ -28,6 +29,7 @@ class Order(models.Model):
         null=True,
         blank=True,
         related_name='assigned_orders',
+        db_index=False,
         limit_choices_to={'role__in': ['admin', 'super_admin']},
     )
 
@@ -54,11 +56,18 @@ class Order(models.Model):
     tax = models.DecimalField(max_digits=10, decimal_places=2)
     total = models.DecimalField(max_digits=10, decimal_places=2)
 
+    # Set while the order holds the stock it took from its variants (see apps.cart.reservations)
+    stock_deducted = models.BooleanField(default=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['assigned_admin', '-created_at'], name='order_admin_created_idx'),
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.order_number}"
@@ -89,7 +98,8 @@ class Order(models.Model):
         return self.billing_email
     
 class OrderItem(models.Model):
-    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
+    # Indexed together with created_at in Meta.indexes
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items', db_index=False)
     product = models.ForeignKey('products.Product', on_delete=models.CASCADE)
     variant = models.ForeignKey('products.ProductVariant', on_delete=models.CASCADE, null=True, blank=True)
     quantity = models.PositiveIntegerField(default=1)
@@ -99,6 +109,9 @@ class OrderItem(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['order', '-created_at'], name='orderitem_order_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.order.order_number} - {self.product.name} x {self.quantity}"
@@ -1,3 +1,125 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from apps.products.models import Category, Product, ProductVariant
+from .models import Order, OrderItem
+
+User = get_user_model()
+
+CHECKOUT = {
+    'first_name': 'Ana', 'last_name': 'Gómez', 'email': 'ana@example.com', 'phone': '300',
+    'address': 'Calle 1', 'city': 'Bogotá', 'department': 'Cundinamarca',
+}
+
+
+class CreateOrderTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='mujer', display_name='Mujer')
+        self.product = Product.objects.create(
+            name='Blusa', description='Blusa', category=category, price=50000,
+        )
+        self.variant = ProductVariant.objects.create(product=self.product, size='M', color='azul', stock=10)
+        self.client = APIClient()
+
+    def checkout(self, *items):
+        return self.client.post('/api/orders/create/', {**CHECKOUT, 'items': list(items)}, format='json')
+
+    def test_creates_order_with_items(self):
+        response = self.checkout({'product_id': self.product.pk, 'variant_id': self.variant.pk, 'quantity': 2})
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get()
+        self.assertEqual(order.total, 100000)
+        self.assertEqual(order.items.get().quantity, 2)
+
+    def test_failing_item_leaves_no_partial_order(self):
+        response = self.checkout(
+            {'product_id': self.product.pk, 'variant_id': self.variant.pk, 'quantity': 1},
+            {'product_id': self.product.pk, 'quantity': -1},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+
+
+class OrderStatusTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='mujer', display_name='Mujer')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.blusa = Product.objects.create(name='Blusa', description='Blusa', category=category, price=50000)
+            self.falda = Product.objects.create(name='Falda', description='Falda', category=category, price=60000)
+        self.client = APIClient()
+        self.admin = APIClient()
+        self.admin.force_authenticate(
+            User.objects.create_user(username='admin', email='admin@example.com', password='x', role='super_admin')
+        )
+
+    def best_sellers(self):
+        # Cache hits are plain HttpResponses, so the body is decoded here
+        response = self.client.get('/api/products/best-sellers/?period=total')
+        return [product['name'] for product in response.json()['results']]
+
+    def order(self, product, quantity):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/orders/create/', {
+                **CHECKOUT, 'items': [{'product_id': product.pk, 'quantity': quantity}],
+            }, format='json')
+        return response.data['order']['id']
+
+    def set_status(self, order_id, new_status):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.admin.patch(f'/api/orders/{order_id}/status/', {'status': new_status}, format='json')
+
+    def test_cached_best_sellers_follow_orders_and_cancellations(self):
+        self.assertEqual(self.best_sellers(), [])
+        self.assertEqual(self.best_sellers(), [])
+        self.order(self.blusa, 2)
+        self.assertEqual(self.best_sellers(), ['Blusa'])
+        falda = self.order(self.falda, 3)
+        self.assertEqual(self.best_sellers(), ['Falda', 'Blusa'])
+        self.set_status(falda, 'cancelled')
+        self.assertEqual(self.best_sellers(), ['Blusa'])
+
+    @override_settings(STOCK_RESERVATION_TTL=600)
+    def test_reopening_a_cancelled_order_takes_the_stock_again(self):
+        variant = ProductVariant.objects.create(product=self.blusa, size='M', color='azul', stock=5)
+
+        def order(quantity):
+            with self.captureOnCommitCallbacks(execute=True):
+                return self.client.post('/api/orders/create/', {**CHECKOUT, 'items': [
+                    {'product_id': self.blusa.pk, 'variant_id': variant.pk, 'quantity': quantity},
+                ]}, format='json').data['order']['id']
+
+        def stock():
+            variant.refresh_from_db()
+            self.blusa.refresh_from_db()
+            return variant.stock, self.blusa.sales_total
+
+        first = order(2)
+        self.assertEqual(stock(), (3, 2))
+        self.set_status(first, 'cancelled')
+        self.assertEqual(stock(), (5, 0))
+        self.assertEqual(self.set_status(first, 'pending').status_code, 200)
+        self.assertEqual(stock(), (3, 2))
+        self.assertTrue(Order.objects.get(pk=first).stock_deducted)
+
+        # Reopening is refused when the stock has been sold in the meantime
+        self.set_status(first, 'cancelled')
+        order(4)
+        response = self.set_status(first, 'processing')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((response.data['variant_id'], response.data['available']), (variant.pk, 1))
+        self.assertEqual(stock(), (1, 4))
+        self.assertEqual(Order.objects.get(pk=first).status, 'cancelled')
+
+    def test_repeated_cancellation_takes_sales_back_once(self):
+        first = self.order(self.blusa, 2)
+        self.order(self.blusa, 3)
+        self.assertEqual(self.set_status(first, 'cancelled').status_code, 200)
+        self.set_status(first, 'cancelled')
+        self.blusa.refresh_from_db()
+        self.assertEqual(self.blusa.sales_total, 3)
+        history = Order.objects.get(pk=first).status_history.order_by('pk').values_list('status', flat=True)
+        self.assertEqual(list(history), ['pending', 'cancelled', 'cancelled'])
@@ -1,28 +1,39 @@
 from rest_framework import generics, permissions, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
+from django.db import transaction
+from django.db.models import Sum
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
 from .models import Order, OrderStatusHistory
 from .serializers import OrderSerializer, OrderCreateSerializer
 from apps.products.models import Product, ProductVariant
+from apps.products.sales import is_counted, record_order_sales
 from apps.accounts.models import GuestUser
+from apps.cart import reservations
+from apps.cart.guest import GuestCart
+from apps.cart.models import Cart
 
 User = get_user_model()
 
+# Everything OrderSerializer reads for each item and status change
+ORDER_PREFETCH = ('items__product__main_image_ref', 'items__variant__product', 'status_history__changed_by')
+
+
 class OrderListView(generics.ListAPIView):
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
         user = self.request.user
+        orders = Order.objects.prefetch_related(*ORDER_PREFETCH)
         if user.role in ['admin', 'super_admin']:
             if user.role == 'super_admin':
-                return Order.objects.all()
+                return orders.all()
             else:
-                return Order.objects.filter(assigned_admin=user)
+                return orders.filter(assigned_admin=user)
         else:
-            return Order.objects.filter(user=user)
+            return orders.filter(user=user)
 
 class OrderDetailView(generics.RetrieveAPIView):
     serializer_class = OrderSerializer
@@ -30,10 +41,17 @@ class OrderDetailView(generics.RetrieveAPIView):
     
     def get_queryset(self):
         user = self.request.user
+        orders = Order.objects.prefetch_related(*ORDER_PREFETCH)
         if user.role in ['admin', 'super_admin']:
-            return Order.objects.all()
+            return orders.all()
         else:
-            return Order.objects.filter(user=user)
+            return orders.filter(user=user)
+
+def variant_quantities(order):
+    """{variant_id: quantity} of the order's variant lines"""
+    items = order.items.filter(variant__isnull=False).order_by()
+    return dict(items.values_list('variant_id').annotate(Sum('quantity')))
+
 
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
@@ -102,43 +120,63 @@ def create_order(request):
     }
     
     try:
-        # Create the order
-        order = Order.objects.create(**order_data)
+        # The order and its items are written together; batch jobs never see half an order
+        with transaction.atomic():
+            # Create the order
+            order = Order.objects.create(**order_data)
         
-        # Assign to user or guest
-        if request.user.is_authenticated:
-            order.user = request.user
-        else:
-            order.guest_user = guest_user
+            # Assign to user or guest
+            if request.user.is_authenticated:
+                order.user = request.user
+            else:
+                order.guest_user = guest_user
         
-        # Set initial status
-        order.status = 'pending'
-        order.save()
+            # Set initial status
+            order.status = 'pending'
+            order.save()
         
-        # Create order items
-        from .models import OrderItem
-        for item_data in items_data:
-            OrderItem.objects.create(
+            # Create order items
+            from .models import OrderItem
+            for item_data in items_data:
+                OrderItem.objects.create(
+                    order=order,
+                    product=item_data['product'],
+                    variant=item_data.get('variant'),
+                    quantity=item_data['quantity'],
+                    price=item_data['price']
+                )
+            record_order_sales(order)
+
+            # The ordered stock is taken and the cart's reservations of it are consumed
+            if request.user.is_authenticated:
+                cart = Cart.objects.filter(user=request.user).first()
+            else:
+                cart = GuestCart.from_request(request)
+            if reservations.consume(cart, variant_quantities(order)):
+                order.stock_deducted = True
+                order.save(update_fields=['stock_deducted'])
+        
+            # Create status history
+            OrderStatusHistory.objects.create(
                 order=order,
-                product=item_data['product'],
-                variant=item_data.get('variant'),
-                quantity=item_data['quantity'],
-                price=item_data['price']
+                status='pending',
+                changed_by=request.user if request.user.is_authenticated else None,
+                notes='Pedido creado'
             )
         
-        # Create status history
-        OrderStatusHistory.objects.create(
-            order=order,
-            status='pending',
-            changed_by=request.user if request.user.is_authenticated else None,
-            notes='Pedido creado'
-        )
-        
         return Response({
             'success': True,
             'order': OrderSerializer(order).data
         }, status=status.HTTP_201_CREATED)
         
+    except reservations.InsufficientStock as e:
+        return Response({
+            'success': False,
+            'error': 'Stock insuficiente',
+            'variant_id': e.variant_id,
+            'available': e.available,
+        }, status=status.HTTP_400_BAD_REQUEST)
+
     except Exception as e:
         return Response({
             'success': False,
@@ -151,27 +189,48 @@ def update_order_status(request, order_id):
     if request.user.role not in ['admin', 'super_admin']:
         return Response({'error': 'Sin permisos'}, status=status.HTTP_403_FORBIDDEN)
     
-    order = get_object_or_404(Order, id=order_id)
     new_status = request.data.get('status')
     tracking_number = request.data.get('tracking_number', '')
     shipping_company = request.data.get('shipping_company', '')
     notes = request.data.get('notes', '')
     
     if new_status:
-        order.status = new_status
-        if tracking_number:
-            order.tracking_number = tracking_number
-        if shipping_company:
-            order.shipping_company = shipping_company
-        order.save()
-        
-        # Create status history
-        OrderStatusHistory.objects.create(
-            order=order,
-            status=new_status,
-            changed_by=request.user,
-            notes=notes
-        )
+        try:
+            with transaction.atomic():
+                # Concurrent status changes queue up here, so each one sees the status the previous one left
+                order = get_object_or_404(Order.objects.select_for_update(), id=order_id)
+                previous_status = order.status
+                order.status = new_status
+                if tracking_number:
+                    order.tracking_number = tracking_number
+                if shipping_company:
+                    order.shipping_company = shipping_company
+                # Cancelled and rejected orders give back the stock they took
+                if not is_counted(new_status) and order.stock_deducted:
+                    reservations.restock(variant_quantities(order))
+                    order.stock_deducted = False
+                # and take it again when reopened, if it is still there
+                elif is_counted(new_status) and not is_counted(previous_status) and not order.stock_deducted:
+                    order.stock_deducted = reservations.consume(None, variant_quantities(order))
+                order.save()
+
+                # Cancelled and rejected orders do not count towards best-seller rankings
+                if is_counted(previous_status) != is_counted(new_status):
+                    record_order_sales(order, sign=1 if is_counted(new_status) else -1)
+
+                # Create status history
+                OrderStatusHistory.objects.create(
+                    order=order,
+                    status=new_status,
+                    changed_by=request.user,
+                    notes=notes
+                )
+        except reservations.InsufficientStock as e:
+            return Response({
+                'error': 'Stock insuficiente',
+                'variant_id': e.variant_id,
+                'available': e.available,
+            }, status=status.HTTP_400_BAD_REQUEST)
         
         return Response(OrderSerializer(order).data)
     
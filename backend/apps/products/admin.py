@@ -74,6 +74,7 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ('category', 'subcategory', 'brand', 'is_active', 'is_featured', 'created_at')
     search_fields = ('name', 'description')
     list_editable = ('is_active', 'is_featured', 'stock')
+    list_select_related = ('category', 'subcategory', 'brand', 'main_image_ref')
     inlines = [ProductImageInline, ProductVariantInline]
     readonly_fields = ('created_at', 'updated_at', 'main_image_preview')
     
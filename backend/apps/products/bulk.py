@@ -0,0 +1,346 @@
+"""Bulk catalog import and export in CSV or JSONL.
+
+Both formats share one flat row per variant (a product without variants
+takes a single row with empty size and color):
+
+    product_id, name, description, category, subcategory, brand, price,
+    stock, is_active, is_featured, size, color, variant_stock, price_adjustment
+
+Rows are matched to existing products by product_id when present, otherwise
+by (category, name). Category, subcategory and brand are given by name and
+must already exist. Empty product columns keep the stored value; variant
+rows always carry their full stock and price adjustment. The stock column
+only applies to products without variants, the others get their total.
+
+Imports run in chunks of rows, each in its own transaction, with bulk
+inserts and updates. A bad row is reported and skipped without stopping
+the rest of the file.
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from .catalog import products_changed
+from .models import Brand, Category, Product, ProductVariant, Subcategory
+
+FORMATS = ('csv', 'jsonl')
+
+COLUMNS = [
+    'product_id', 'name', 'description', 'category', 'subcategory', 'brand', 'price',
+    'stock', 'is_active', 'is_featured', 'size', 'color', 'variant_stock', 'price_adjustment',
+]
+
+PRODUCT_UPDATE_FIELDS = [
+    'name', 'description', 'category', 'subcategory', 'brand', 'price', 'stock',
+    'is_active', 'is_featured', 'updated_at',
+]
+
+TRUE_VALUES = {'1', 'true', 'yes', 'si', 'sí'}
+FALSE_VALUES = {'0', 'false', 'no'}
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(lines, file_format):
+    """Yield (line number, row dict) from an iterable of text lines; unparseable JSON yields None"""
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if row is None or isinstance(row, dict) else None
+
+
+def _text(row, name):
+    value = row.get(name)
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+def _decimal(row, name):
+    value = _text(row, name)
+    if not value:
+        return None
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise RowError(f'{name}: número inválido "{value}"')
+
+
+def _integer(row, name):
+    value = _text(row, name)
+    if not value:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise RowError(f'{name}: entero inválido "{value}"')
+    if number < 0:
+        raise RowError(f'{name}: no puede ser negativo')
+    return number
+
+
+def _boolean(row, name):
+    value = _text(row, name).lower()
+    if not value:
+        return None
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise RowError(f'{name}: valor booleano inválido "{value}"')
+
+
+class CatalogImporter:
+    """Upsert products and variants from parsed rows; see the module docstring for the format"""
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.result = {'rows': 0, 'products_created': 0, 'products_updated': 0, 'variants': 0, 'errors': []}
+        # Reference tables are small, so they are read once up front
+        self.categories = {category.name: category for category in Category.objects.all()}
+        self.subcategories = {
+            (subcategory.category_id, subcategory.name): subcategory for subcategory in Subcategory.objects.all()
+        }
+        self.subcategory_category = {
+            subcategory.pk: subcategory.category_id for subcategory in self.subcategories.values()
+        }
+        self.brands = {}
+        for brand in Brand.objects.order_by('-pk'):
+            self.brands[brand.name] = brand
+        self.sizes = {value for value, label in ProductVariant.SIZE_CHOICES}
+        self.colors = {value for value, label in ProductVariant.COLOR_CHOICES}
+
+    def run(self, rows):
+        chunk = []
+        for number, row in rows:
+            self.result['rows'] += 1
+            if row is None:
+                self.error(number, 'JSON inválido')
+                continue
+            chunk.append((number, row))
+            if len(chunk) >= self.batch_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        return self.result
+
+    def error(self, number, message):
+        self.result['errors'].append({'row': number, 'error': message})
+
+    def import_chunk(self, chunk):
+        try:
+            with transaction.atomic():
+                counts = self.write_chunk(chunk)
+        except DatabaseError as e:
+            # Nothing from the chunk was written; report every row that had not failed already
+            failed = {error['row'] for error in self.result['errors']}
+            for number, row in chunk:
+                if number not in failed:
+                    self.error(number, f'Error de base de datos: {e}')
+            return
+        for key, count in counts.items():
+            self.result[key] += count
+
+    def write_chunk(self, chunk):
+        parsed = []
+        for number, row in chunk:
+            try:
+                values, variant = self.parse_row(row)
+            except RowError as e:
+                self.error(number, str(e))
+                continue
+            parsed.append((number, values, variant))
+
+        by_id = Product.objects.in_bulk({values['product_id'] for number, values, variant in parsed if values['product_id']})
+        by_key = {}
+        keys = {self.product_key(values) for number, values, variant in parsed if not values['product_id']}
+        if keys:
+            existing = Product.objects.filter(
+                category_id__in={category_id for category_id, name in keys},
+                name__in={name for category_id, name in keys},
+            ).order_by('-pk')
+            for product in existing:
+                # A product referenced both by id and by (category, name) is one instance
+                by_key[(product.category_id, product.name)] = by_id.setdefault(product.pk, product)
+
+        now = timezone.now()
+        products, created, updated, variants = {}, [], {}, {}
+        for number, values, variant in parsed:
+            if values['product_id']:
+                product = by_id.get(values['product_id'])
+                if product is None:
+                    self.error(number, f'Producto {values["product_id"]} no existe')
+                    continue
+            else:
+                product = by_key.get(self.product_key(values))
+            if product is None:
+                missing = [name for name in ('name', 'category', 'price') if values.get(name) is None]
+                if missing:
+                    self.error(number, f'Faltan columnas para crear el producto: {", ".join(missing)}')
+                    continue
+
+            category = values.get('category')
+            category_id = category.pk if category else product.category_id
+            subcategory = values.get('subcategory')
+            subcategory_id = subcategory.pk if subcategory else product and product.subcategory_id
+            if subcategory_id and self.subcategory_category[subcategory_id] != category_id:
+                self.error(number, 'La subcategoría no pertenece a la categoría')
+                continue
+
+            if product is None:
+                product = Product(description='', stock=0)
+                created.append(product)
+            elif product.pk:
+                updated[product.pk] = product
+            # New products have no pk yet, so the shared instance itself identifies them
+            key = product.pk or id(product)
+            products[key] = product
+            for name, value in values.items():
+                if name != 'product_id' and value is not None:
+                    setattr(product, name, value)
+            product.updated_at = now
+            # Later rows find the product under its name as of this row, renamed or not
+            by_key[(product.category_id, product.name)] = product
+            if variant:
+                variants[(key, variant['size'], variant['color'])] = (product, variant)
+
+        # One INSERT ... ON CONFLICT for new and existing rows; bulk_update's CASE per field is far slower
+        Product.objects.bulk_create(
+            created + list(updated.values()), update_conflicts=True, unique_fields=['pk'],
+            update_fields=PRODUCT_UPDATE_FIELDS, batch_size=self.batch_size,
+        )
+        ProductVariant.objects.bulk_create(
+            [ProductVariant(product=product, **variant) for product, variant in variants.values()],
+            update_conflicts=True, unique_fields=['product', 'size', 'color'],
+            update_fields=['stock', 'price_adjustment'], batch_size=self.batch_size,
+        )
+        # Bulk writes skip the model methods and signals: recompute stock totals now and
+        # refresh the catalog once the chunk commits
+        product_ids = [product.pk for product in products.values()]
+        Product.objects.filter(pk__in=product_ids).recompute_stock()
+        products_changed(product_ids)
+        return {'products_created': len(created), 'products_updated': len(updated), 'variants': len(variants)}
+
+    def product_key(self, values):
+        category = values.get('category')
+        return (category.pk if category else None, values.get('name'))
+
+    def parse_row(self, row):
+        values = {'product_id': _integer(row, 'product_id')}
+
+        for name in ('name', 'description'):
+            if _text(row, name):
+                values[name] = _text(row, name)
+
+        category_name = _text(row, 'category')
+        if category_name:
+            values['category'] = self.categories.get(category_name)
+            if values['category'] is None:
+                raise RowError(f'Categoría "{category_name}" no existe')
+
+        subcategory_name = _text(row, 'subcategory')
+        if subcategory_name:
+            if 'category' not in values:
+                raise RowError('subcategory requiere la columna category')
+            values['subcategory'] = self.subcategories.get((values['category'].pk, subcategory_name))
+            if values['subcategory'] is None:
+                raise RowError(f'Subcategoría "{subcategory_name}" no existe en {category_name}')
+
+        brand_name = _text(row, 'brand')
+        if brand_name:
+            values['brand'] = self.brands.get(brand_name)
+            if values['brand'] is None:
+                raise RowError(f'Marca "{brand_name}" no existe')
+
+        values['price'] = _decimal(row, 'price')
+        values['stock'] = _integer(row, 'stock')
+        values['is_active'] = _boolean(row, 'is_active')
+        values['is_featured'] = _boolean(row, 'is_featured')
+
+        size, color = _text(row, 'size'), _text(row, 'color')
+        if not size and not color:
+            return values, None
+        if size not in self.sizes:
+            raise RowError(f'Talla inválida "{size}"')
+        if color not in self.colors:
+            raise RowError(f'Color inválido "{color}"')
+        variant = {
+            'size': size,
+            'color': color,
+            'stock': _integer(row, 'variant_stock') or 0,
+            'price_adjustment': _decimal(row, 'price_adjustment') or Decimal('0'),
+        }
+        return values, variant
+
+
+def import_catalog(lines, file_format, batch_size=1000):
+    """Import an iterable of text lines and return counts plus per-row errors"""
+    return CatalogImporter(batch_size=batch_size).run(read_rows(lines, file_format))
+
+
+def export_rows(batch_size=1000):
+    """Yield one dict per variant, or per product without variants, in COLUMNS order"""
+    products = (
+        Product.objects.select_related('category', 'subcategory', 'brand')
+        .prefetch_related('variants').order_by('pk')
+    )
+    for product in products.iterator(chunk_size=batch_size):
+        base = {
+            'product_id': product.pk,
+            'name': product.name,
+            'description': product.description,
+            'category': product.category.name,
+            'subcategory': product.subcategory.name if product.subcategory else '',
+            'brand': product.brand.name if product.brand else '',
+            'price': str(product.price),
+            'stock': product.stock,
+            'is_active': product.is_active,
+            'is_featured': product.is_featured,
+        }
+        variants = sorted(product.variants.all(), key=lambda variant: (variant.size, variant.color))
+        if not variants:
+            yield {**base, 'size': '', 'color': '', 'variant_stock': '', 'price_adjustment': ''}
+        for variant in variants:
+            yield {
+                **base,
+                'size': variant.size,
+                'color': variant.color,
+                'variant_stock': variant.stock,
+                'price_adjustment': str(variant.price_adjustment),
+            }
+
+
+class _Echo:
+    """File-like object whose write() hands the line back to the csv writer's caller"""
+
+    def write(self, value):
+        return value
+
+
+def export_lines(file_format, batch_size=1000):
+    """Yield the export as text lines, ready to stream"""
+    rows = export_rows(batch_size=batch_size)
+    if file_format == 'csv':
+        writer = csv.DictWriter(_Echo(), fieldnames=COLUMNS)
+        yield writer.writeheader()
+        for row in rows:
+            yield writer.writerow(row)
+        return
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
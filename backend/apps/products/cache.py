@@ -0,0 +1,88 @@
+"""Versioned cache keys for catalog data.
+
+Cached entries embed the current namespace version in their key. Writes to
+the catalog bump the version instead of deleting keys, so stale entries are
+simply never read again and expire on their own.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+CATALOG_NAMESPACE = 'catalog'
+
+
+def _version_key(namespace):
+    return f'{namespace}:version'
+
+
+def get_version(namespace=CATALOG_NAMESPACE):
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so an evicted counter never falls back to a version already used
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace=CATALOG_NAMESPACE):
+    key = _version_key(namespace)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def make_key(prefix, params, namespace=CATALOG_NAMESPACE):
+    """Build a versioned key from a prefix and an iterable of (name, value) pairs"""
+    digest = hashlib.md5(repr(sorted(params)).encode()).hexdigest()
+    return f'{namespace}:{get_version(namespace)}:{prefix}:{digest}'
+
+
+def cache_response(prefix, namespace=CATALOG_NAMESPACE):
+    """Cache successful GET responses of a view under the namespace version.
+
+    Hits are answered straight from the cached bytes, before authentication,
+    the view or any serializer runs. Wrap ``dispatch`` of class based views
+    with method_decorator, or the function view itself.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            # Pagination links are absolute, so the host is part of the key
+            params = [('host', request.get_host()), ('path', request.path)]
+            params += [(name, tuple(values)) for name, values in request.GET.lists()]
+            key = make_key(f'response:{prefix}', params, namespace)
+            cached = cache.get(key)
+            if cached is not None:
+                content, content_type, etag, last_modified = cached
+                # Revalidations of a cached body are answered from the stored validators
+                response = get_conditional_response(
+                    request, etag=etag, last_modified=parse_http_date_safe(last_modified) if last_modified else None,
+                )
+                if response is None:
+                    response = HttpResponse(content, content_type=content_type)
+                if etag:
+                    response['ETag'] = etag
+                if last_modified:
+                    response['Last-Modified'] = last_modified
+                return response
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                if hasattr(response, 'render'):
+                    response.render()
+                cached = (response.content, response['Content-Type'], response.get('ETag'), response.get('Last-Modified'))
+                cache.set(key, cached, settings.RESPONSE_CACHE_TIMEOUT)
+            return response
+        return wrapped
+    return decorator
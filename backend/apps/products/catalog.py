@@ -0,0 +1,115 @@
+"""Maintenance of the CatalogEntry read model"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Max, Min, OuterRef, Subquery
+
+from .cache import bump_version
+from .models import CatalogEntry, Product, ProductImage, ProductVariant
+from .search import index_products
+from .suggest import suggestion_index
+
+ENTRY_FIELDS = [
+    'name', 'category', 'category_name', 'category_display_name', 'subcategory', 'subcategory_name',
+    'brand', 'brand_name', 'price', 'min_price', 'max_price', 'total_stock', 'sizes', 'colors',
+    'main_image_name', 'main_image_derivatives', 'is_active', 'is_featured', 'sales_total', 'sales_7d',
+    'sales_30d', 'created_at', 'updated_at',
+]
+
+
+def _delimited(values):
+    return f",{','.join(values)}," if values else ''
+
+
+def refresh_catalog(product_ids):
+    """Recompute the catalog rows of the given products in a fixed number of queries"""
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+
+    products = (
+        Product.objects.filter(pk__in=product_ids)
+        .select_related('category', 'subcategory', 'brand', 'main_image_ref')
+        .annotate(
+            min_adjustment=Min('variants__price_adjustment'),
+            max_adjustment=Max('variants__price_adjustment'),
+        )
+    )
+
+    sizes, colors = defaultdict(set), defaultdict(set)
+    for product_id, size, color in ProductVariant.objects.filter(product_id__in=product_ids).values_list(
+        'product_id', 'size', 'color'
+    ):
+        sizes[product_id].add(size)
+        colors[product_id].add(color)
+    size_order = [value for value, label in ProductVariant.SIZE_CHOICES]
+
+    entries = []
+    for product in products:
+        main_image = product.main_image_ref
+        has_variants = product.min_adjustment is not None
+        entries.append(CatalogEntry(
+            product=product,
+            name=product.name,
+            category=product.category,
+            category_name=product.category.name,
+            category_display_name=product.category.display_name or product.category.name,
+            subcategory=product.subcategory,
+            subcategory_name=product.subcategory.name if product.subcategory else '',
+            brand=product.brand,
+            brand_name=product.brand.name if product.brand else '',
+            price=product.price,
+            min_price=product.price + product.min_adjustment if has_variants else product.price,
+            max_price=product.price + product.max_adjustment if has_variants else product.price,
+            total_stock=product.stock,
+            sizes=_delimited(sorted(sizes[product.pk], key=lambda size: size_order.index(size) if size in size_order else len(size_order))),
+            colors=_delimited(sorted(colors[product.pk])),
+            main_image_name=main_image.image.name if main_image else '',
+            main_image_derivatives=main_image.derivatives if main_image else {},
+            is_active=product.is_active,
+            is_featured=product.is_featured,
+            sales_total=product.sales_total,
+            sales_7d=product.sales_7d,
+            sales_30d=product.sales_30d,
+            created_at=product.created_at,
+        ))
+
+    CatalogEntry.objects.bulk_create(
+        entries, update_conflicts=True, unique_fields=['product'], update_fields=ENTRY_FIELDS,
+    )
+    found = {entry.product_id for entry in entries}
+    CatalogEntry.objects.filter(pk__in=product_ids - found).delete()
+
+
+def products_changed(product_ids):
+    """Bring the catalog rows, search index and cache version in line with product writes.
+
+    Runs once the surrounding transaction commits, so cascaded deletes and
+    half-written rows are never copied into the read model.
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+
+    def apply():
+        refresh_catalog(product_ids)
+        index_products(product_ids)
+        suggestion_index.update_products(product_ids)
+        bump_version()
+
+    transaction.on_commit(apply)
+
+
+def rebuild_catalog(batch_size=500):
+    """Recreate every catalog row from the source tables"""
+    product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+    main_image = ProductImage.objects.filter(product=OuterRef('pk'), is_main=True).order_by('order', 'pk')
+    with transaction.atomic():
+        # Also repairs main image references and stock totals of rows written without the model methods
+        Product.objects.update(main_image_ref=Subquery(main_image.values('pk')[:1]))
+        Product.objects.recompute_stock()
+        CatalogEntry.objects.all().delete()
+        for start in range(0, len(product_ids), batch_size):
+            refresh_catalog(product_ids[start:start + batch_size])
+    bump_version()
+    return len(product_ids)
@@ -0,0 +1,64 @@
+"""Conditional GET (ETag / Last-Modified) support for catalog views"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import CatalogEntry
+
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+class ConditionalGetMixin:
+    """Answer If-None-Match and If-Modified-Since before any serialization.
+
+    Subclasses implement ``get_validators`` returning an (etag, last_modified)
+    pair from a cheap query, or None to skip conditional handling. The
+    validators are computed from CatalogEntry.updated_at, which moves on
+    every product, variant and image change.
+    """
+
+    def get_validators(self):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        validators = self.get_validators()
+        if validators is None:
+            return super().get(request, *args, **kwargs)
+
+        etag, last_modified = validators
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+        return response
+
+
+class CatalogListConditionalMixin(ConditionalGetMixin):
+    """Validators for list views: newest updated_at and row count of the filtered result set"""
+
+    def get_validators(self):
+        queryset = self.filter_queryset(self.get_queryset()).order_by()
+        stats = queryset.aggregate(last_modified=Max('updated_at'), count=Count('pk'))
+        etag = make_etag(self.request.get_full_path(), stats['last_modified'], stats['count'])
+        return etag, stats['last_modified']
+
+
+class CatalogDetailConditionalMixin(ConditionalGetMixin):
+    """Validators for a single product read from its catalog row"""
+
+    def get_validators(self):
+        last_modified = CatalogEntry.objects.filter(
+            pk=self.kwargs[self.lookup_url_kwarg or self.lookup_field], is_active=True
+        ).values_list('updated_at', flat=True).first()
+        if last_modified is None:
+            # Let the view answer 404 as usual
+            return None
+        return make_etag(self.request.get_full_path(), last_modified), last_modified
@@ -0,0 +1,87 @@
+"""Facet counts for the product catalog"""
+from django.db.models import Case, Count, IntegerField, Value, When
+
+from .models import CatalogEntry, ProductVariant
+
+# (min, max) in COP; max is exclusive and None means unbounded
+PRICE_RANGES = [
+    (0, 50000),
+    (50000, 100000),
+    (100000, 200000),
+    (200000, None),
+]
+
+
+def _price_range_expression():
+    whens = []
+    for index, (low, high) in enumerate(PRICE_RANGES):
+        if high is None:
+            whens.append(When(price__gte=low, then=Value(index)))
+        else:
+            whens.append(When(price__gte=low, price__lt=high, then=Value(index)))
+    return Case(*whens, default=Value(None), output_field=IntegerField())
+
+
+def _add(counts, key, label, count):
+    if key is None:
+        return
+    entry = counts.setdefault(key, {'value': key, 'label': label, 'count': 0})
+    entry['count'] += count
+
+
+def _sorted(counts):
+    return sorted(counts.values(), key=lambda entry: (-entry['count'], str(entry['label'])))
+
+
+def compute_facets(queryset):
+    """Count catalog entries per category, subcategory, brand, size, color and price range.
+
+    Category, subcategory, brand and price range counts come from a single
+    GROUP BY over their combinations, rolled up in Python. Sizes and colors
+    need their own distinct product counts since a product has many variants.
+    """
+    entries = CatalogEntry.objects.filter(pk__in=queryset.order_by().values('pk'))
+
+    groups = (
+        entries.annotate(price_range=_price_range_expression())
+        .values('category_name', 'category_display_name', 'subcategory_id', 'subcategory_name',
+                'brand_id', 'brand_name', 'price_range')
+        .annotate(count=Count('pk'))
+        .order_by()
+    )
+
+    total = 0
+    categories, subcategories, brands, price_ranges = {}, {}, {}, {}
+    for group in groups:
+        count = group['count']
+        total += count
+        _add(categories, group['category_name'], group['category_display_name'], count)
+        _add(subcategories, group['subcategory_id'], group['subcategory_name'], count)
+        _add(brands, group['brand_id'], group['brand_name'], count)
+        if group['price_range'] is not None:
+            low, high = PRICE_RANGES[group['price_range']]
+            entry = price_ranges.setdefault(group['price_range'], {'min': low, 'max': high, 'count': 0})
+            entry['count'] += count
+
+    variants = ProductVariant.objects.filter(product_id__in=entries.values('pk')).order_by()
+    size_labels = dict(ProductVariant.SIZE_CHOICES)
+    color_labels = dict(ProductVariant.COLOR_CHOICES)
+    sizes = [
+        {'value': row['size'], 'label': size_labels.get(row['size'], row['size']), 'count': row['count']}
+        for row in variants.values('size').annotate(count=Count('product', distinct=True))
+    ]
+    colors = [
+        {'value': row['color'], 'label': color_labels.get(row['color'], row['color']), 'count': row['count']}
+        for row in variants.values('color').annotate(count=Count('product', distinct=True))
+    ]
+    size_order = list(size_labels)
+
+    return {
+        'total': total,
+        'categories': _sorted(categories),
+        'subcategories': _sorted(subcategories),
+        'brands': _sorted(brands),
+        'sizes': sorted(sizes, key=lambda entry: size_order.index(entry['value']) if entry['value'] in size_order else len(size_order)),
+        'colors': sorted(colors, key=lambda entry: -entry['count']),
+        'price_ranges': [price_ranges[index] for index in sorted(price_ranges)],
+    }
@@ -0,0 +1,127 @@
+"""Resized and re-encoded derivatives of product images.
+
+Every ProductImage gets a fixed set of sizes in JPEG and WebP, generated by
+a small background thread pool after the upload transaction commits so the
+upload request never waits on Pillow.
+"""
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Longest side in pixels for each derivative
+DERIVATIVE_SIZES = {
+    'thumbnail': 160,
+    'card': 480,
+    'detail': 1200,
+}
+
+DERIVATIVE_FORMATS = {
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+}
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_DERIVATIVE_WORKERS, thread_name_prefix='image-derivatives',
+        )
+    return _executor
+
+
+def schedule_derivatives(image_id):
+    """Queue derivative generation for an image once the current transaction commits"""
+    transaction.on_commit(lambda: get_executor().submit(_run, image_id))
+
+
+def _run(image_id):
+    try:
+        generate_derivatives(image_id)
+    except Exception:
+        logger.exception('Could not generate derivatives for product image %s', image_id)
+    finally:
+        close_old_connections()
+
+
+def derivative_name(size, extension):
+    # Only a hint: the content addressed storage renames derivatives after their hash
+    return f'products/derivatives/{size}.{extension}'
+
+
+def _flatten(source):
+    # JPEG has no alpha channel, so transparent images are composed on white
+    if source.mode in ('RGBA', 'LA', 'P'):
+        source = source.convert('RGBA')
+        background = Image.new('RGB', source.size, (255, 255, 255))
+        background.paste(source, mask=source.getchannel('A'))
+        return background
+    return source.convert('RGB')
+
+
+def generate_derivatives(image_id):
+    from .catalog import products_changed
+    from .models import ProductImage
+
+    image = ProductImage.objects.filter(pk=image_id).first()
+    if image is None or not image.image:
+        return None
+
+    # The same file uploaded for another image already has its derivatives
+    existing = (
+        ProductImage.objects.filter(image=image.image.name, derivatives__source=image.image.name)
+        .exclude(pk=image.pk).values_list('derivatives', flat=True).first()
+    )
+    if existing:
+        ProductImage.objects.filter(pk=image.pk).update(derivatives=existing)
+        products_changed([image.product_id])
+        return existing
+
+    storage = image.image.storage
+    with image.image.open('rb') as original:
+        source = Image.open(original)
+        source = ImageOps.exif_transpose(source)
+        source = _flatten(source)
+
+    derivatives = {'source': image.image.name}
+    for size, longest_side in DERIVATIVE_SIZES.items():
+        resized = source.copy()
+        # Never upscale: small originals keep their own dimensions
+        resized.thumbnail((longest_side, longest_side), Image.LANCZOS)
+        entry = {'width': resized.width}
+        for extension, (image_format, options) in DERIVATIVE_FORMATS.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, image_format, **options)
+            entry[extension] = storage.save(derivative_name(size, extension), ContentFile(buffer.getvalue()))
+        derivatives[size] = entry
+
+    ProductImage.objects.filter(pk=image.pk).update(derivatives=derivatives)
+    products_changed([image.product_id])
+    return derivatives
+
+
+def build_srcset(derivatives, url_for):
+    """Return {'jpeg': 'url 160w, url 480w, ...', 'webp': ...} from stored derivatives"""
+    if not derivatives:
+        return None
+    srcset = {}
+    for extension in DERIVATIVE_FORMATS:
+        candidates, widths = [], set()
+        for size in DERIVATIVE_SIZES:
+            entry = derivatives.get(size, {})
+            # Small originals produce the same width several times; list each width once
+            if extension in entry and entry['width'] not in widths:
+                widths.add(entry['width'])
+                candidates.append(f"{url_for(entry[extension])} {entry['width']}w")
+        if candidates:
+            srcset[extension] = ', '.join(candidates)
+    return srcset or None
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.recommendations import TOP_K, build_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Fold orders placed since the last run into the co-purchase recommendations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=TOP_K, help='Recommendations kept per product')
+        parser.add_argument('--full', action='store_true', help='Drop the pair counts and rebuild from every order')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        run = build_recommendations(top_k=options['top_k'], full=options['full'], batch_size=options['batch_size'])
+        if run is None:
+            self.stdout.write('No new orders since the last run')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {run.orders} orders up to #{run.last_order_id}, re-ranked {run.products} products'
+        ))
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+from django.utils import timezone
+
+from apps.cart.models import Cart, StockReservation
+from apps.orders.models import Order, OrderItem
+from apps.products.models import CatalogEntry, Product
+
+
+def listing_queries():
+    """(description, queryset, index expected in its plan) for every hot listing query"""
+    catalog = CatalogEntry.objects.filter(is_active=True)
+    return [
+        ('Product list', catalog.order_by('-created_at'), 'catalog_active_idx'),
+        ('Product list by category', catalog.filter(category_name='ninos').order_by('-created_at'), 'catalog_category_idx'),
+        ('Product list in stock', catalog.filter(total_stock__gt=0).order_by('-created_at'), 'catalog_in_stock_idx'),
+        ('Featured products', catalog.filter(is_featured=True).order_by('-created_at'), 'catalog_featured_idx'),
+        ('Product list by sales', catalog.order_by('-sales_30d'), 'catalog_sales_30d_idx'),
+        ('Best sellers of the week', catalog.filter(sales_7d__gt=0).order_by('-sales_7d'), 'catalog_sales_7d_idx'),
+        ('Products by category', Product.objects.filter(is_active=True, category_id=1).order_by('-created_at'),
+         'product_active_category_idx'),
+        ('Featured products (source table)', Product.objects.filter(is_active=True, is_featured=True).order_by('-created_at'),
+         'product_active_featured_idx'),
+        ('Orders of a customer', Order.objects.filter(user_id=1), 'order_user_created_idx'),
+        ('Orders assigned to an admin', Order.objects.filter(assigned_admin_id=1), 'order_admin_created_idx'),
+        ('Order items', OrderItem.objects.filter(order_id__in=[1, 2, 3]), 'orderitem_order_created_idx'),
+        ('Guest cart', Cart.objects.filter(session_key='abc'), 'cart_session_idx'),
+        ('Reserved stock of a variant',
+         StockReservation.objects.filter(variant_id=1, expires_at__gt=timezone.now()).values('variant').annotate(Sum('quantity')),
+         'reservation_available_idx'),
+        ('Expired reservations', StockReservation.objects.filter(expires_at__lte=timezone.now()), 'reservation_expires_idx'),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Check that EXPLAIN QUERY PLAN of each listing query uses its expected index'
+
+    def handle(self, *args, **options):
+        failures = []
+        for description, queryset, index in listing_queries():
+            plan = queryset.explain()
+            if index in plan:
+                self.stdout.write(f'{description}: {index}')
+            else:
+                failures.append(description)
+                self.stderr.write(f'{description}: expected {index}, got\n{plan}')
+        if failures:
+            raise CommandError(f'{len(failures)} queries do not use their index')
+        self.stdout.write(self.style.SUCCESS('All listing queries use their indexes'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.snapshot import export_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Render the public catalog API to precompressed static JSON files for a CDN'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--base-url', help='Origin the snapshot is served from (default: SNAPSHOT_BASE_URL)')
+        parser.add_argument('--full', action='store_true', help='Re-render every file instead of only the changed ones')
+
+    def handle(self, *args, **options):
+        result = export_snapshot(options['directory'], base_url=options['base_url'], full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {result['rendered']} responses, wrote {result['written']} files, removed {result['removed']}"
+        ))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.images import generate_derivatives
+from apps.products.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Generate resized JPEG and WebP derivatives for product images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Regenerate images that already have derivatives')
+
+    def handle(self, *args, **options):
+        images = ProductImage.objects.order_by('pk')
+        generated = 0
+        for image in images.iterator():
+            if not options['all'] and image.derivatives.get('source') == image.image.name:
+                continue
+            try:
+                if generate_derivatives(image.pk):
+                    generated += 1
+            except Exception as e:
+                self.stderr.write(f'Image {image.pk}: {e}')
+        self.stdout.write(self.style.SUCCESS(f'Generated derivatives for {generated} images'))
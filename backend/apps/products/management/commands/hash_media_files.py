@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.cache import bump_version
+from apps.products.catalog import refresh_catalog
+from apps.products.models import Category, ProductImage
+from apps.products.storage import is_hashed_name
+
+
+class Command(BaseCommand):
+    help = 'Move category and product images stored before content addressing to their hashed names'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-originals', action='store_true', help='Do not delete the old files')
+
+    def handle(self, *args, **options):
+        product_ids = set()
+        moved = self.rename(Category, options['keep_originals'])
+        moved += self.rename(ProductImage, options['keep_originals'], product_ids)
+        if product_ids:
+            refresh_catalog(product_ids)
+        bump_version()
+        self.stdout.write(self.style.SUCCESS(f'Moved {moved} files'))
+
+    def rename(self, model, keep_originals, product_ids=None):
+        moved = 0
+        renamed = {}
+        storage = model._meta.get_field('image').storage
+        for instance in model.objects.exclude(image='').order_by('pk').iterator():
+            old_name = instance.image.name
+            if is_hashed_name(old_name):
+                continue
+            if old_name not in renamed:
+                if not storage.exists(old_name):
+                    self.stderr.write(f'{model.__name__} {instance.pk}: missing file {old_name}')
+                    continue
+                with storage.open(old_name, 'rb') as content:
+                    renamed[old_name] = storage.save(old_name, content)
+
+            # update() skips the save signals, so derivatives are not regenerated for the same bytes
+            changes = {'image': renamed[old_name]}
+            if model is ProductImage:
+                product_ids.add(instance.product_id)
+                if instance.derivatives.get('source') == old_name:
+                    changes['derivatives'] = {**instance.derivatives, 'source': renamed[old_name]}
+            model.objects.filter(pk=instance.pk).update(**changes)
+            moved += 1
+
+        if not keep_originals:
+            for old_name in renamed:
+                storage.delete(old_name)
+        return moved
@@ -0,0 +1,29 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.products.bulk import FORMATS, import_catalog
+
+
+class Command(BaseCommand):
+    help = 'Upsert products and variants from a CSV or JSONL file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if file_format not in FORMATS:
+            raise CommandError('Unknown format, pass --format csv or --format jsonl')
+
+        with open(options['path'], encoding='utf-8-sig', newline='') as lines:
+            result = import_catalog(lines, file_format, batch_size=options['batch_size'])
+
+        for error in result['errors']:
+            self.stderr.write(f"Row {error['row']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['rows']} rows: {result['products_created']} products created, "
+            f"{result['products_updated']} updated, {result['variants']} variants, {len(result['errors'])} errors"
+        ))
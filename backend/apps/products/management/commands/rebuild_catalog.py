@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.catalog import rebuild_catalog
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized catalog table from products, variants and images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        count = rebuild_catalog(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} catalog entries'))
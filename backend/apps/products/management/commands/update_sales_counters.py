@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from apps.products.sales import decay_sales, rebuild_sales
+
+
+class Command(BaseCommand):
+    help = 'Decay the 7 and 30 day sales counters and compact old daily buckets; run once a day'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Recompute every counter from the order history')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            count = rebuild_sales()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt sales counters of {count} products'))
+            return
+        updated, deleted = decay_sales()
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} products, removed {deleted} daily buckets'))
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+from django.db.models import Case, F, Value, When
+
+
+def add_display_name(apps, schema_editor):
+    # Databases created before display_name existed (formerly patched by run_migrations.py)
+    Category = apps.get_model('products', 'Category')
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        columns = {column.name for column in connection.introspection.get_table_description(cursor, Category._meta.db_table)}
+    if 'display_name' in columns:
+        return
+    # Existing rows need a value before the names below are filled in
+    field = models.CharField(max_length=100, default='')
+    field.set_attributes_from_name('display_name')
+    schema_editor.add_field(Category, field)
+    Category.objects.update(display_name=Case(
+        When(name='hombres', then=Value('Hombres')),
+        When(name='mujeres', then=Value('Mujeres')),
+        When(name='ninos', then=Value('Niños')),
+        When(name='bebes', then=Value('Bebés')),
+        default=F('name'),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_display_name, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogEntry',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='catalog_entry', serialize=False, to='products.product')),
+                ('name', models.CharField(max_length=100)),
+                ('category_name', models.CharField(max_length=50)),
+                ('category_display_name', models.CharField(max_length=100)),
+                ('subcategory_name', models.CharField(blank=True, max_length=50)),
+                ('brand_name', models.CharField(blank=True, max_length=100)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('min_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('max_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('total_stock', models.PositiveIntegerField(default=0)),
+                ('sizes', models.CharField(blank=True, max_length=50)),
+                ('colors', models.CharField(blank=True, max_length=200)),
+                ('main_image_name', models.CharField(blank=True, max_length=255)),
+                ('is_active', models.BooleanField(default=True)),
+                ('is_featured', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('brand', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.brand')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.category')),
+                ('subcategory', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.subcategory')),
+            ],
+            options={
+                'verbose_name_plural': 'Catalog entries',
+            },
+        ),
+    ]
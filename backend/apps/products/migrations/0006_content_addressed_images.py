@@ -0,0 +1,24 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:09
+
+import apps.products.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='image',
+            field=models.ImageField(blank=True, storage=apps.products.storage.ContentAddressedStorage(), upload_to='categories/'),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(storage=apps.products.storage.ContentAddressedStorage(), upload_to='products/'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_product_main_image_ref'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(condition=models.Q(('is_active', True), ('total_stock__gt', 0)), fields=['-created_at'], name='catalog_in_stock_idx'),
+        ),
+    ]
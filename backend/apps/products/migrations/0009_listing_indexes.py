@@ -0,0 +1,40 @@
+# Generated by Django 5.2.3 on 2026-10-18 20:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_catalog_in_stock_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-created_at'], name='catalog_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['category_name', '-created_at'], name='catalog_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(condition=models.Q(('is_active', True), ('is_featured', True)), fields=['-created_at'], name='catalog_featured_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['category', '-created_at'], name='product_active_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True), ('is_featured', True)), fields=['-created_at'], name='product_active_featured_idx'),
+        ),
+        # Without statistics SQLite breaks ties in favour of the newest index; recreate the
+        # narrower in-stock index after catalog_active_idx so ?in_stock=true keeps using it
+        migrations.RemoveIndex(model_name='catalogentry', name='catalog_in_stock_idx'),
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(condition=models.Q(('is_active', True), ('total_stock__gt', 0)), fields=['-created_at'], name='catalog_in_stock_idx'),
+        ),
+    ]
@@ -1,11 +1,15 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Exists, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest
+
+from .storage import content_addressed_storage, media_url
 
 
 class Category(models.Model):
     name = models.CharField(max_length=50, unique=True)
     display_name = models.CharField(max_length=100)  # Nombre amigable para mostrar
     description = models.TextField(blank=True)
-    image = models.ImageField(upload_to='categories/', blank=True)
+    image = models.ImageField(upload_to='categories/', storage=content_addressed_storage, blank=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -38,6 +42,25 @@ class Brand(models.Model):
         return self.name
     
 
+class ProductQuerySet(models.QuerySet):
+    def with_related(self):
+        """Join and prefetch everything ProductSerializer reads"""
+        return self.select_related('category', 'subcategory', 'brand', 'main_image_ref').prefetch_related('images', 'variants')
+
+    def for_listing(self, expand=()):
+        """Join and prefetch what ProductListSerializer reads, plus any expanded relations"""
+        return self.select_related('category', 'brand', 'main_image_ref').prefetch_related(*sorted(expand))
+
+    def recompute_stock(self):
+        """Set stock to the variant total for products that have variants, in one UPDATE.
+
+        For bulk writes that bypass ProductVariant.save() and delete().
+        """
+        variants = ProductVariant.objects.filter(product=OuterRef('pk'))
+        total = variants.order_by().values('product').annotate(total=Sum('stock')).values('total')
+        return self.filter(Exists(variants)).update(stock=Coalesce(Subquery(total), 0))
+
+
 class Product(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField()
@@ -50,19 +73,41 @@ class Product(models.Model):
     is_featured = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    
+    # Kept in sync with the is_main flag of the images by sync_main_image()
+    main_image_ref = models.ForeignKey(
+        'ProductImage', related_name='+', on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+    )
+    # Units sold, maintained by apps.products.sales
+    sales_total = models.PositiveIntegerField(default=0, editable=False)
+    sales_7d = models.PositiveIntegerField(default=0, editable=False)
+    sales_30d = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        # Partial on is_active: SQLite cannot seek on a bare boolean column, but matches index conditions
+        indexes = [
+            models.Index(fields=['category', '-created_at'], condition=Q(is_active=True), name='product_active_category_idx'),
+            models.Index(fields=['-created_at'], condition=Q(is_active=True, is_featured=True), name='product_active_featured_idx'),
+        ]
     
     def __str__(self):
         return self.name
     
     @property
     def main_image(self):
-        from django.conf import settings
-        image = self.images.filter(is_main=True).first()
-        if image:
-            # Return full URL for frontend
-            return f"http://localhost:8000{image.image.url}"
-        return None
+        # Select main_image_ref along with the product to render this without a query
+        if self.main_image_ref_id is None:
+            return None
+        return media_url(self.main_image_ref.image.name)
+
+    def sync_main_image(self):
+        """Point main_image_ref at the image flagged is_main, if it changed"""
+        main_image = self.images.filter(is_main=True).order_by('order', 'pk').first()
+        if self.main_image_ref_id != (main_image.pk if main_image else None):
+            self.main_image_ref = main_image
+            # update() leaves updated_at and the save signals alone; image signals refresh the catalog
+            Product.objects.filter(pk=self.pk).update(main_image_ref=main_image)
     
     @property
     def is_in_stock(self):
@@ -71,9 +116,11 @@ class Product(models.Model):
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='products/')
+    image = models.ImageField(upload_to='products/', storage=content_addressed_storage)
     is_main = models.BooleanField(default=False)
     order = models.IntegerField(default=0)
+    # Filled in by apps.products.images: {'source': name, size: {'width': px, 'jpeg': name, 'webp': name}}
+    derivatives = models.JSONField(default=dict, blank=True)
 
     class Meta:
         ordering = ['order']
@@ -114,7 +161,156 @@ class ProductVariant(models.Model):
 
     def __str__(self):
         return f"{self.product.name} - {self.size} - {self.color}"
+
+    # Product.stock of a product with variants is the sum of their stock. Saves and
+    # deletes move it by the difference with F(), reading the previous value under
+    # a row lock so concurrent writers cannot lose an update.
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = ProductVariant.objects.select_for_update().filter(pk=self.pk).values('product_id', 'stock').first()
+            super().save(*args, **kwargs)
+            if previous is None:
+                # The first variant replaces the product's own stock, so recompute instead of adding
+                Product.objects.filter(pk=self.product_id).recompute_stock()
+            elif previous['product_id'] != self.product_id:
+                Product.objects.filter(pk__in=[previous['product_id'], self.product_id]).recompute_stock()
+            elif previous['stock'] != self.stock:
+                _add_stock(self.product_id, self.stock - previous['stock'])
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            stock = ProductVariant.objects.select_for_update().filter(pk=self.pk).values_list('stock', flat=True).first()
+            result = super().delete(*args, **kwargs)
+            if stock:
+                _add_stock(self.product_id, -stock)
+        return result
     
     @property
     def final_price(self):
         return self.product.price + self.price_adjustment
+
+
+
+def _add_stock(product_id, delta):
+    Product.objects.filter(pk=product_id).update(stock=Greatest(F('stock') + delta, 0))
+
+
+class ProductSalesDay(models.Model):
+    """Units of a product sold on one day; the rolling sales counters are summed from these"""
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE, db_index=False)
+    day = models.DateField()
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'day'], name='sales_day_product_day_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['day'], name='sales_day_day_idx'),
+        ]
+
+
+class CatalogEntry(models.Model):
+    """Flattened copy of a product holding everything catalog listings filter and sort on.
+
+    Rows are maintained by apps.products.catalog whenever a product or one of
+    its variants, images, category, subcategory or brand changes, so public
+    listings never have to join those tables at read time.
+    """
+    product = models.OneToOneField(Product, primary_key=True, related_name='catalog_entry', on_delete=models.CASCADE)
+    name = models.CharField(max_length=100)
+    category = models.ForeignKey(Category, related_name='+', on_delete=models.CASCADE)
+    category_name = models.CharField(max_length=50)
+    category_display_name = models.CharField(max_length=100)
+    subcategory = models.ForeignKey(Subcategory, related_name='+', on_delete=models.CASCADE, null=True, blank=True)
+    subcategory_name = models.CharField(max_length=50, blank=True)
+    brand = models.ForeignKey(Brand, related_name='+', on_delete=models.CASCADE, null=True, blank=True)
+    brand_name = models.CharField(max_length=100, blank=True)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    min_price = models.DecimalField(max_digits=10, decimal_places=2)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2)
+    total_stock = models.PositiveIntegerField(default=0)
+    # Delimited as ",S,M," so a single size or color can be matched with __contains
+    sizes = models.CharField(max_length=50, blank=True)
+    colors = models.CharField(max_length=200, blank=True)
+    main_image_name = models.CharField(max_length=255, blank=True)
+    main_image_derivatives = models.JSONField(default=dict, blank=True)
+    is_active = models.BooleanField(default=True)
+    is_featured = models.BooleanField(default=False)
+    sales_total = models.PositiveIntegerField(default=0)
+    sales_7d = models.PositiveIntegerField(default=0)
+    sales_30d = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'Catalog entries'
+        # Partial indexes in the newest-first order public listings default to
+        indexes = [
+            models.Index(fields=['-created_at'], condition=Q(is_active=True), name='catalog_active_idx'),
+            models.Index(fields=['category_name', '-created_at'], condition=Q(is_active=True), name='catalog_category_idx'),
+            models.Index(fields=['-created_at'], condition=Q(is_active=True, is_featured=True), name='catalog_featured_idx'),
+            models.Index(fields=['-created_at'], condition=Q(is_active=True, total_stock__gt=0), name='catalog_in_stock_idx'),
+            models.Index(fields=['-sales_7d'], condition=Q(is_active=True), name='catalog_sales_7d_idx'),
+            models.Index(fields=['-sales_30d'], condition=Q(is_active=True), name='catalog_sales_30d_idx'),
+            models.Index(fields=['-sales_total'], condition=Q(is_active=True), name='catalog_sales_total_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def main_image(self):
+        return media_url(self.main_image_name)
+
+    @property
+    def is_in_stock(self):
+        return self.total_stock > 0
+
+
+class ProductPairCount(models.Model):
+    """Sparse co-occurrence matrix: how many orders contained both products.
+
+    Each pair is stored in both directions so the neighbours of a product
+    are a single range of the unique index. Maintained by
+    apps.products.recommendations.
+    """
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE, db_index=False)
+    other = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'other'], name='pair_count_product_other_uniq'),
+        ]
+
+
+class ProductRecommendation(models.Model):
+    """Top co-purchased products of a product, ranked from 1 by ProductPairCount.orders"""
+    product = models.ForeignKey(Product, related_name='recommendations', on_delete=models.CASCADE, db_index=False)
+    recommended = models.ForeignKey(Product, related_name='recommended_with', on_delete=models.CASCADE)
+    score = models.PositiveIntegerField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='recommendation_product_rank_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.recommended_id} ({self.rank})"
+
+
+class RecommendationRun(models.Model):
+    """One pass of the co-purchase job; the latest last_order_id is where the next one starts"""
+    last_order_id = models.PositiveBigIntegerField()
+    orders = models.PositiveIntegerField(default=0)
+    products = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
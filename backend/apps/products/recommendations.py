@@ -0,0 +1,110 @@
+"""Co-purchase ("frequently bought together") recommendations.
+
+A batch job folds new orders into ProductPairCount, the sparse product x
+product co-occurrence matrix, with one set-based INSERT ... SELECT ... ON
+CONFLICT per run: the database self-joins the order items and adds the
+pair counts to the stored ones without any rows reaching Python. The top
+neighbours of every product touched by those orders are then re-ranked
+with a window function and written to ProductRecommendation, which the
+recommendations endpoint reads with a single indexed query.
+
+Runs are incremental: each one records the highest order id it covered in
+RecommendationRun and the next starts after it. Only orders older than
+SETTLE_SECONDS are covered: ids are handed out before commit, so a newer
+committed order can have a higher id than one still being written, which
+would otherwise fall behind the recorded id for good. Cancelled and
+rejected orders are left out; an order cancelled after it was counted stays
+counted until the next full rebuild.
+"""
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F, Max, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from apps.orders.models import Order, OrderItem
+
+from .cache import bump_version
+from .models import ProductPairCount, ProductRecommendation, RecommendationRun
+
+TOP_K = 10
+EXCLUDED_STATUSES = ('cancelled', 'rejected')
+# Age an order must reach before a run covers it
+SETTLE_SECONDS = 300
+
+
+def _count_pairs(first_order_id, last_order_id):
+    """Add the pairs of orders in (first_order_id, last_order_id] to the stored counts"""
+    quote = connection.ops.quote_name
+    pairs, items, orders = (
+        quote(ProductPairCount._meta.db_table), quote(OrderItem._meta.db_table), quote(Order._meta.db_table),
+    )
+    placeholders = ', '.join(['%s'] * len(EXCLUDED_STATUSES))
+    sql = f"""
+        INSERT INTO {pairs} (product_id, other_id, orders)
+        SELECT a.product_id, b.product_id, COUNT(DISTINCT a.order_id)
+        FROM {items} a
+        INNER JOIN {items} b ON b.order_id = a.order_id AND b.product_id <> a.product_id
+        INNER JOIN {orders} o ON o.id = a.order_id
+        WHERE a.order_id > %s AND a.order_id <= %s AND o.status NOT IN ({placeholders})
+        GROUP BY a.product_id, b.product_id
+        ON CONFLICT (product_id, other_id) DO UPDATE SET orders = {pairs}.orders + excluded.orders
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [first_order_id, last_order_id, *EXCLUDED_STATUSES])
+
+
+def _rank(product_ids, top_k):
+    """Replace the stored recommendations of the given products with their top_k neighbours"""
+    ranked = (
+        ProductPairCount.objects.filter(product_id__in=product_ids)
+        .annotate(rank=Window(
+            RowNumber(), partition_by=[F('product_id')], order_by=[F('orders').desc(), F('other_id').asc()],
+        ))
+        .filter(rank__lte=top_k)
+        .values_list('product_id', 'other_id', 'orders', 'rank')
+    )
+    recommendations = [
+        ProductRecommendation(product_id=product_id, recommended_id=other_id, score=orders, rank=rank)
+        for product_id, other_id, orders, rank in ranked
+    ]
+    ProductRecommendation.objects.filter(product_id__in=product_ids).delete()
+    ProductRecommendation.objects.bulk_create(recommendations)
+
+
+def build_recommendations(top_k=TOP_K, full=False, batch_size=500):
+    """Fold orders placed since the last run into the recommendations and return the run.
+
+    With full=True the pair counts are dropped and rebuilt from every order.
+    Returns None when there were no new orders.
+    """
+    with transaction.atomic():
+        if full:
+            ProductPairCount.objects.all().delete()
+            ProductRecommendation.objects.all().delete()
+            first_order_id = 0
+        else:
+            first_order_id = RecommendationRun.objects.aggregate(last=Max('last_order_id'))['last'] or 0
+        # Recent orders, and those committed while the job runs, are left for the next one
+        settled = Order.objects.filter(created_at__lte=timezone.now() - timedelta(seconds=SETTLE_SECONDS))
+        last_order_id = settled.aggregate(last=Max('pk'))['last'] or 0
+        if last_order_id <= first_order_id:
+            return None
+
+        new_orders = Order.objects.filter(pk__gt=first_order_id, pk__lte=last_order_id).exclude(
+            status__in=EXCLUDED_STATUSES
+        )
+        _count_pairs(first_order_id, last_order_id)
+        product_ids = list(
+            OrderItem.objects.filter(order__in=new_orders).order_by('product_id').values_list('product_id', flat=True).distinct()
+        )
+        for start in range(0, len(product_ids), batch_size):
+            _rank(product_ids[start:start + batch_size], top_k)
+
+        run = RecommendationRun.objects.create(
+            last_order_id=last_order_id, orders=new_orders.count(), products=len(product_ids),
+        )
+        # Recommendation responses are cached under the catalog version
+        transaction.on_commit(bump_version)
+    return run
@@ -0,0 +1,125 @@
+"""Rolling per-product sales counters for best-seller rankings.
+
+Product.sales_total, sales_7d and sales_30d count units sold in orders that
+were not cancelled or rejected. Placing an order adds its quantities with
+F() updates, and a status change into or out of cancelled/rejected takes
+them back or adds them again. Each update goes to the product, its catalog
+row (where listings sort on it) and the ProductSalesDay bucket of the day
+the order was placed, so no request ever sums the order history.
+
+The 7 and 30 day counters only move forward as orders come in; the daily
+decay_sales() run recomputes them from the buckets so old sales drop out,
+and compacts buckets older than the longest window. rebuild_sales()
+recomputes everything from the order history.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest, TruncDate
+from django.utils import timezone
+
+from apps.orders.models import OrderItem
+
+from .cache import bump_version
+from .models import CatalogEntry, Product, ProductSalesDay
+from .recommendations import EXCLUDED_STATUSES
+
+# Counter field -> days it covers, today included
+WINDOWS = {'sales_7d': 7, 'sales_30d': 30}
+RETENTION_DAYS = max(WINDOWS.values())
+
+
+def is_counted(status):
+    return status not in EXCLUDED_STATUSES
+
+
+def record_order_sales(order, sign=1):
+    """Add the quantities of an order to the sales counters, or take them back with sign=-1"""
+    day = timezone.localdate(order.created_at)
+    age = (timezone.localdate() - day).days
+    quantities = (
+        OrderItem.objects.filter(order=order).order_by()
+        .values_list('product_id').annotate(quantity=Sum('quantity'))
+    )
+    now = timezone.now()
+    with transaction.atomic():
+        for product_id, quantity in quantities:
+            delta = sign * quantity
+            counters = {'sales_total': Greatest(F('sales_total') + delta, 0)}
+            for field, days in WINDOWS.items():
+                if age < days:
+                    counters[field] = Greatest(F(field) + delta, 0)
+            Product.objects.filter(pk=product_id).update(**counters)
+            # updated_at moves so conditional GETs of sales-ordered listings see the change
+            CatalogEntry.objects.filter(pk=product_id).update(updated_at=now, **counters)
+            if age < RETENTION_DAYS:
+                _add_to_day(product_id, day, delta)
+        # Best-seller responses are cached under the catalog version
+        transaction.on_commit(bump_version)
+
+
+def _add_to_day(product_id, day, delta):
+    days = ProductSalesDay.objects.filter(product_id=product_id, day=day)
+    if days.update(quantity=Greatest(F('quantity') + delta, 0)) or delta <= 0:
+        return
+    try:
+        with transaction.atomic():
+            ProductSalesDay.objects.create(product_id=product_id, day=day, quantity=delta)
+    except IntegrityError:
+        # Another order created the bucket in the meantime
+        days.update(quantity=F('quantity') + delta)
+
+
+def _window(days, today):
+    totals = (
+        ProductSalesDay.objects.filter(product=OuterRef('pk'), day__gt=today - timedelta(days=days))
+        .order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    )
+    return Coalesce(Subquery(totals), 0)
+
+
+def decay_sales(today=None):
+    """Recompute the windowed counters from the daily buckets and drop expired buckets.
+
+    Returns (products updated, buckets deleted).
+    """
+    today = today or timezone.localdate()
+    counters = {field: _window(days, today) for field, days in WINDOWS.items()}
+    # Rows with nothing in any window cannot change
+    recent = Q(sales_7d__gt=0) | Q(sales_30d__gt=0)
+    with transaction.atomic():
+        updated = Product.objects.filter(recent).update(**counters)
+        # The catalog primary key is the product id, so the same subqueries apply
+        CatalogEntry.objects.filter(recent).update(updated_at=timezone.now(), **counters)
+        deleted, _ = ProductSalesDay.objects.filter(day__lte=today - timedelta(days=RETENTION_DAYS)).delete()
+        transaction.on_commit(bump_version)
+    return updated, deleted
+
+
+def rebuild_sales(today=None):
+    """Recompute all counters and buckets from the order history; returns the number of products"""
+    today = today or timezone.localdate()
+    items = OrderItem.objects.exclude(order__status__in=EXCLUDED_STATUSES).order_by()
+    totals = items.filter(product=OuterRef('pk')).values('product').annotate(total=Sum('quantity')).values('total')
+    since = timezone.make_aware(datetime.combine(today - timedelta(days=RETENTION_DAYS - 1), time.min))
+    by_day = (
+        items.filter(order__created_at__gte=since)
+        .annotate(day=TruncDate('order__created_at'))
+        .values_list('product_id', 'day').annotate(quantity=Sum('quantity'))
+    )
+    counters = {field: _window(days, today) for field, days in WINDOWS.items()}
+    with transaction.atomic():
+        ProductSalesDay.objects.all().delete()
+        ProductSalesDay.objects.bulk_create(
+            [ProductSalesDay(product_id=product_id, day=day, quantity=quantity) for product_id, day, quantity in by_day],
+            batch_size=1000,
+        )
+        count = Product.objects.update(sales_total=Coalesce(Subquery(totals), 0), **counters)
+        product = Product.objects.filter(pk=OuterRef('pk'))
+        CatalogEntry.objects.update(
+            updated_at=timezone.now(),
+            **{field: Subquery(product.values(field)) for field in ['sales_total', *WINDOWS]},
+        )
+        transaction.on_commit(bump_version)
+    return count
@@ -0,0 +1,110 @@
+"""Full-text product search backed by an SQLite FTS5 index"""
+import re
+
+from django.db import connection, connections
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+SEARCH_TABLE = 'products_product_search'
+
+# Column weights for bm25(): name, description, brand, category
+SEARCH_WEIGHTS = (10.0, 1.0, 4.0, 2.0)
+
+
+def search_available(using='default'):
+    return connections[using].vendor == 'sqlite'
+
+
+def create_search_index(using='default'):
+    """Create the FTS5 table if it does not exist yet"""
+    if not search_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        # remove_diacritics folds accents so "niño" and "nino" index to the same token,
+        # prefix adds tokens for 2 and 3 character prefixes so "cam*" stays cheap
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            "name, description, brand, category, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+
+
+def index_products(product_ids):
+    """Replace the index rows for the given products with their current data.
+
+    Products that no longer exist simply lose their rows.
+    """
+    from .models import Product
+
+    product_ids = list(product_ids)
+    if not product_ids or not search_available():
+        return
+    rows = Product.objects.filter(pk__in=product_ids).values_list(
+        'pk', 'name', 'description', 'brand__name', 'category__display_name'
+    )
+    with connection.cursor() as cursor:
+        _delete_rows(cursor, product_ids)
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, name, description, brand, category) VALUES (%s, %s, %s, %s, %s)",
+            [(pk, name, description, brand or '', category or '') for pk, name, description, brand, category in rows],
+        )
+
+
+def rebuild_search_index(batch_size=1000):
+    """Drop every index row and re-index the whole catalog"""
+    from .models import Product
+
+    if not search_available():
+        return 0
+    create_search_index()
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+    product_ids = list(Product.objects.values_list('pk', flat=True))
+    for start in range(0, len(product_ids), batch_size):
+        index_products(product_ids[start:start + batch_size])
+    return len(product_ids)
+
+
+def build_match_query(text):
+    """Turn free text into an FTS5 query where every word is a quoted prefix term"""
+    terms = re.findall(r'\w+', text.lower())
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _delete_rows(cursor, product_ids):
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})", product_ids)
+
+
+class ProductSearchFilter(SearchFilter):
+    """SearchFilter that answers ?search= from the FTS5 index.
+
+    Matches are annotated with ``search_rank`` (bm25, lower is better) and
+    sorted by it unless the client asked for an explicit ?ordering=. This
+    backend must run after OrderingFilter so relevance can take precedence
+    over the view's default ordering. Falls back to the icontains search on
+    ``search_fields`` when the database is not SQLite.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        match = build_match_query(request.query_params.get(self.search_param, ''))
+        if not match:
+            return queryset
+        if not search_available():
+            return super().filter_queryset(request, queryset, view)
+
+        opts = queryset.model._meta
+        row_ref = f'"{opts.db_table}"."{opts.pk.column}"'
+        weights = ', '.join(str(weight) for weight in SEARCH_WEIGHTS)
+        queryset = queryset.filter(
+            pk__in=RawSQL(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s", (match,))
+        ).annotate(
+            search_rank=RawSQL(
+                f"SELECT bm25({SEARCH_TABLE}, {weights}) FROM {SEARCH_TABLE} "
+                f"WHERE {SEARCH_TABLE} MATCH %s AND rowid = {row_ref}",
+                (match,),
+            )
+        )
+        if not request.query_params.get('ordering'):
+            queryset = queryset.order_by('search_rank', f'-{opts.pk.name}')
+        return queryset
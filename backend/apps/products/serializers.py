@@ -1,18 +1,14 @@
 from rest_framework import serializers
-from .models import Category, Subcategory, Brand, Product, ProductVariant, ProductImage
+from .images import build_srcset
+from .models import Category, Subcategory, Brand, Product, ProductVariant, ProductImage, CatalogEntry
+from .storage import media_url
 
 
 class CategorySerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
     
     def get_image(self, obj):
-        if obj.image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.image.url)
-            else:
-                return f"http://localhost:8000{obj.image.url}"
-        return None
+        return media_url(obj.image.name)
     
     class Meta:
         model = Category
@@ -42,19 +38,17 @@ class BrandSerializer(serializers.ModelSerializer):
 
 class ProductImageSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
     
     def get_image(self, obj):
-        if obj.image:
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.image.url)
-            else:
-                return f"http://localhost:8000{obj.image.url}"
-        return None
+        return media_url(obj.image.name)
+
+    def get_srcset(self, obj):
+        return build_srcset(obj.derivatives, media_url)
     
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'is_main', 'order']
+        fields = ['id', 'image', 'srcset', 'is_main', 'order']
 
 class ProductVariantSerializer(serializers.ModelSerializer):
     final_price = serializers.ReadOnlyField()
@@ -64,6 +58,30 @@ class ProductVariantSerializer(serializers.ModelSerializer):
         fields = ['id', 'size', 'color', 'stock', 'price_adjustment', 'final_price']
 
 
+class VariantCellSerializer(serializers.Serializer):
+    size = serializers.ChoiceField(choices=ProductVariant.SIZE_CHOICES)
+    color = serializers.ChoiceField(choices=ProductVariant.COLOR_CHOICES)
+    stock = serializers.IntegerField(min_value=0, required=False)
+    price_adjustment = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+
+
+class VariantMatrixSerializer(serializers.Serializer):
+    """A size x color grid of variants with default values and per-cell overrides"""
+    sizes = serializers.ListField(child=serializers.ChoiceField(choices=ProductVariant.SIZE_CHOICES), allow_empty=False)
+    colors = serializers.ListField(child=serializers.ChoiceField(choices=ProductVariant.COLOR_CHOICES), allow_empty=False)
+    stock = serializers.IntegerField(min_value=0, required=False)
+    price_adjustment = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    cells = VariantCellSerializer(many=True, required=False)
+
+    def validate(self, data):
+        for cell in data.get('cells', []):
+            if cell['size'] not in data['sizes'] or cell['color'] not in data['colors']:
+                raise serializers.ValidationError(
+                    f"La celda {cell['size']}/{cell['color']} no está en las tallas y colores enviados"
+                )
+        return data
+
+
 class ProductSerializer(serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.display_name', read_only=True)
     subcategory_name = serializers.CharField(source='subcategory.name', read_only=True)
@@ -79,15 +97,101 @@ class ProductSerializer(serializers.ModelSerializer):
                  'subcategory', 'subcategory_name', 'brand', 'brand_name', 
                  'price', 'stock', 'is_active', 'is_featured', 'images', 
                  'variants', 'main_image', 'is_in_stock', 'created_at', 'updated_at']
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # Products with variants keep the variant total in stock (see ProductVariant.save)
+        if hasattr(self, 'initial_data') and isinstance(self.instance, Product) and self.instance.variants.exists():
+            fields['stock'].read_only = True
+        return fields
         
 
-class ProductListSerializer(serializers.ModelSerializer):
+def get_list_param(request, name):
+    """Parse a comma separated query param such as ?fields=id,name into a list"""
+    if request is None:
+        return []
+    value = request.query_params.get(name, '')
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+class SparseFieldsMixin:
+    """Honour ?fields= and ?expand= on list serializers.
+
+    ``expandable_fields`` maps a field name to a (serializer class, source)
+    pair; expanded fields are only added when the client asks for them, and
+    count as selected when ?fields= is given too.
+    """
+    expandable_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+
+        expand = self.get_expand(request)
+        for name in expand:
+            serializer_class, source = self.expandable_fields[name]
+            extra = {'source': source} if source != name else {}
+            self.fields[name] = serializer_class(many=True, read_only=True, **extra)
+
+        requested = set(get_list_param(request, 'fields'))
+        if requested:
+            requested.update(expand)
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+    @classmethod
+    def get_expand(cls, request):
+        return [name for name in get_list_param(request, 'expand') if name in cls.expandable_fields]
+
+
+class ProductListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Compact product representation for listings.
+
+    Clients can pick fields with ?fields=id,name,price and include nested
+    relations only when asked with ?expand=images,variants.
+    """
     category_name = serializers.CharField(source='category.display_name', read_only=True)
     brand_name = serializers.CharField(source='brand.name', read_only=True)
     main_image = serializers.ReadOnlyField()
     is_in_stock = serializers.ReadOnlyField()
+
+    expandable_fields = {
+        'images': (ProductImageSerializer, 'images'),
+        'variants': (ProductVariantSerializer, 'variants'),
+    }
     
     class Meta:
         model = Product
         fields = ['id', 'name', 'category_name', 'brand_name', 'price', 
-                 'main_image', 'is_in_stock', 'is_featured']
\ No newline at end of file
+                 'main_image', 'is_in_stock', 'is_featured']
+
+
+class AdminProductListSerializer(ProductListSerializer):
+    class Meta(ProductListSerializer.Meta):
+        fields = ProductListSerializer.Meta.fields + ['stock', 'is_active']
+
+
+class CatalogEntrySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Same compact representation as ProductListSerializer, read from the catalog table"""
+    id = serializers.IntegerField(source='product_id', read_only=True)
+    category_name = serializers.CharField(source='category_display_name', read_only=True)
+    brand_name = serializers.SerializerMethodField()
+    main_image = serializers.ReadOnlyField()
+    main_image_srcset = serializers.SerializerMethodField()
+    is_in_stock = serializers.ReadOnlyField()
+
+    expandable_fields = {
+        'images': (ProductImageSerializer, 'product.images'),
+        'variants': (ProductVariantSerializer, 'product.variants'),
+    }
+
+    class Meta:
+        model = CatalogEntry
+        fields = ['id', 'name', 'category_name', 'brand_name', 'price',
+                  'main_image', 'main_image_srcset', 'is_in_stock', 'is_featured']
+
+    def get_brand_name(self, obj):
+        return obj.brand_name or None
+
+    def get_main_image_srcset(self, obj):
+        return build_srcset(obj.main_image_derivatives, media_url)
@@ -0,0 +1,59 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import bump_version
+from .catalog import products_changed
+from .images import schedule_derivatives
+from .models import Category, Subcategory, Brand, Product, ProductImage, ProductVariant
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    products_changed([instance.pk])
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_child_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    products_changed([instance.product_id])
+
+
+@receiver(post_save, sender=ProductImage)
+def product_image_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # Covers the image views, the admin and scripts alike; deleting the main image nulls the reference
+    instance.product.sync_main_image()
+    # Derivatives record the file they were made from, so a replaced file is regenerated
+    if not instance.image:
+        return
+    if instance.derivatives.get('source') != instance.image.name:
+        schedule_derivatives(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Subcategory)
+@receiver(post_save, sender=Brand)
+def product_labels_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # Category, subcategory and brand listings are cached even when no product uses them
+    transaction.on_commit(bump_version)
+    # Names and display names are copied into every catalog row and search entry
+    products_changed(instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Subcategory)
+@receiver(post_delete, sender=Brand)
+def product_labels_deleted(sender, **kwargs):
+    # Their products are removed by the cascade and report themselves
+    transaction.on_commit(bump_version)
@@ -0,0 +1,187 @@
+"""Static snapshot of the public catalog API for CDN hosting.
+
+Responses are rendered through the real views, so every file is byte for
+byte what the API would answer, and written under a directory mirroring the
+URL path together with .gz and, when the optional brotli package is
+installed, .br copies. A request without a query string maps to
+``<path>/index.json``, one with a query string to ``<path>/index@<query>.json``:
+
+    api/products/categories/index.json
+    api/products/index@category=ninos&page=2.json
+    api/products/12/index.json
+
+manifest.json lists every URL with its file, digest and encodings, which is
+what the CDN rules are generated from. Each run re-renders only the groups
+of URLs affected by catalog rows updated since the previous one (the product
+detail, its category listing, the global listings) and only rewrites files
+whose content changed; pages and products that disappeared are removed.
+"""
+import gzip
+import hashlib
+import json
+import os
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.test import RequestFactory
+from django.urls import resolve
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import CatalogEntry
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+API_PREFIX = '/api/products/'
+MANIFEST_NAME = 'manifest.json'
+# Rendered on every run; their content is compared before anything is written
+ALWAYS = ('categories', 'brands')
+# Depend on every product
+GLOBAL_LISTINGS = ('listing:', 'featured', 'best-sellers')
+
+
+def file_name(path, query):
+    name = f'index@{urlencode(query)}.json' if query else 'index.json'
+    return f'{path.strip("/")}/{name}'
+
+
+def group_url(group):
+    """(path, query) of the first page of a group"""
+    kind, _, value = group.partition(':')
+    if kind == 'product':
+        return f'{API_PREFIX}{value}/', {}
+    if kind == 'listing':
+        return API_PREFIX, {'category': value} if value else {}
+    return f'{API_PREFIX}{kind}/', {}
+
+
+class SnapshotWriter:
+    def __init__(self, directory, base_url=None):
+        self.directory = directory
+        base = urlsplit(base_url or settings.SNAPSHOT_BASE_URL)
+        self.factory = RequestFactory(HTTP_HOST=base.netloc)
+        self.secure = base.scheme == 'https'
+        self.manifest = self.read_manifest()
+        self.result = {'rendered': 0, 'written': 0, 'removed': 0}
+
+    def read_manifest(self):
+        try:
+            with open(os.path.join(self.directory, MANIFEST_NAME), encoding='utf-8') as manifest:
+                return json.load(manifest)
+        except FileNotFoundError:
+            return {'generated_at': None, 'files': {}, 'products': {}}
+
+    def run(self, full=False):
+        started = timezone.now()
+        products = dict(
+            CatalogEntry.objects.filter(is_active=True).values_list('product_id', 'category_name')
+        )
+        previous = {int(product_id): category for product_id, category in self.manifest['products'].items()}
+        last_run = parse_datetime(self.manifest['generated_at']) if self.manifest['generated_at'] and not full else None
+
+        if last_run is None:
+            changed = set(products) | set(previous)
+        else:
+            changed = set(
+                CatalogEntry.objects.filter(updated_at__gte=last_run).values_list('product_id', flat=True)
+            ) | (set(previous) - set(products))
+
+        groups = set(ALWAYS)
+        if changed:
+            groups.update(GLOBAL_LISTINGS)
+        for product_id in changed:
+            groups.add(f'product:{product_id}')
+            # Both the category it is in now and the one the last snapshot listed it under
+            for category in (products.get(product_id), previous.get(product_id)):
+                if category:
+                    groups.add(f'listing:{category}')
+
+        for group in sorted(groups):
+            self.render_group(group)
+
+        self.manifest['generated_at'] = started.isoformat()
+        self.manifest['products'] = {str(product_id): category for product_id, category in products.items()}
+        self.write_manifest()
+        return self.result
+
+    def render_group(self, group):
+        path, query = group_url(group)
+        rendered = set()
+        page = 1
+        while True:
+            page_query = {**query, 'page': page} if page > 1 else query
+            url = f'{path}?{urlencode(page_query)}' if page_query else path
+            data = self.render(url, path, page_query, group)
+            if data is None:
+                break
+            rendered.add(url)
+            # Paginated responses are followed page by page
+            if not (isinstance(data, dict) and data.get('next')):
+                break
+            page += 1
+
+        # Pages past the new last one, deactivated products, emptied categories
+        for url, entry in list(self.manifest['files'].items()):
+            if entry['group'] == group and url not in rendered:
+                self.remove(url)
+
+    def render(self, url, path, query, group):
+        match = resolve(path)
+        response = match.func(self.factory.get(path, query, secure=self.secure), *match.args, **match.kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        self.result['rendered'] += 1
+        if response.status_code != 200:
+            return None
+
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        entry = self.manifest['files'].get(url)
+        if entry is None or entry['sha256'] != digest:
+            self.write(file_name(path, query), content)
+            self.result['written'] += 1
+        self.manifest['files'][url] = {
+            'file': file_name(path, query),
+            'group': group,
+            'sha256': digest,
+            'size': len(content),
+            'encodings': ['gzip', 'br'] if brotli else ['gzip'],
+        }
+        return json.loads(content)
+
+    def write(self, name, content):
+        target = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        variants = [('', content), ('.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+        if brotli:
+            variants.append(('.br', brotli.compress(content)))
+        for suffix, data in variants:
+            # Write next to the target and rename, so the CDN never fetches a half-written file
+            with open(f'{target}{suffix}.tmp', 'wb') as output:
+                output.write(data)
+            os.replace(f'{target}{suffix}.tmp', f'{target}{suffix}')
+
+    def remove(self, url):
+        entry = self.manifest['files'].pop(url)
+        target = os.path.join(self.directory, entry['file'])
+        for suffix in ('', '.gz', '.br'):
+            try:
+                os.remove(f'{target}{suffix}')
+            except FileNotFoundError:
+                pass
+        self.result['removed'] += 1
+
+    def write_manifest(self):
+        os.makedirs(self.directory, exist_ok=True)
+        target = os.path.join(self.directory, MANIFEST_NAME)
+        with open(f'{target}.tmp', 'w', encoding='utf-8') as output:
+            json.dump(self.manifest, output, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(f'{target}.tmp', target)
+
+
+def export_snapshot(directory, base_url=None, full=False):
+    """Bring the snapshot in directory up to date; returns rendered/written/removed counts"""
+    return SnapshotWriter(directory, base_url=base_url).run(full=full)
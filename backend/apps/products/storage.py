@@ -0,0 +1,67 @@
+"""Content-addressed storage for catalog images.
+
+Files are named after the sha256 of their bytes, e.g.
+``products/3a/3a7bd3e2...c1.jpg``. Uploading a file that is already stored
+returns the existing name without writing anything, and since a name can
+never point to different bytes, it can be cached by clients forever.
+"""
+import hashlib
+import os
+import re
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import cached_property
+
+HASHED_NAME_RE = re.compile(r'(?:^|/)([0-9a-f]{2})/\1[0-9a-f]{62}(?:\.\w+)?$')
+
+
+def file_digest(content):
+    sha256 = hashlib.sha256()
+    for chunk in content.chunks():
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def is_hashed_name(name):
+    return bool(HASHED_NAME_RE.search(name))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that stores each distinct file once, under its content hash.
+
+    URLs are absolute, built from MEDIA_BASE_URL (the site or CDN origin) and
+    MEDIA_URL, so they can be rendered without a request.
+    """
+
+    @cached_property
+    def base_url(self):
+        base_url = self._value_or_setting(self._base_url, urljoin(settings.MEDIA_BASE_URL, settings.MEDIA_URL))
+        return base_url if base_url.endswith('/') else f'{base_url}/'
+
+    def hashed_name(self, name, digest):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(directory, digest[:2], f'{digest}{extension}').replace('\\', '/')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, file_digest(content))
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+content_addressed_storage = ContentAddressedStorage()
+
+
+def media_url(name):
+    """Absolute URL of a stored catalog image, or None when there is no file"""
+    return content_addressed_storage.url(name) if name else None
@@ -0,0 +1,202 @@
+"""In-process prefix index for search-as-you-type suggestions.
+
+Product names, brand names and category display names are folded to
+lowercase without accents and stored in a sorted list once per word start,
+so "azu" finds "Pantalón azul". A lookup is a bisect plus a scan of every
+key with the prefix; rankings of broad prefixes are memoized until the
+index changes.
+
+Suggestions rank by sales: products by their 30 day and total sales
+counters, brands and categories by the sums over their active products and
+then by how many they have. In-stock and featured products win ties.
+
+The index is built as each WSGI worker starts (see store/wsgi.py), so no
+search waits for it; processes that skip that, like the test runner, build
+it on first use. Product writes in this process update it in place, products and their brand and category totals
+alike (see catalog.products_changed); writes made by other processes, and
+sales counters, show up once the catalog version has moved and
+SUGGESTIONS_REBUILD_INTERVAL seconds have passed since the last build.
+"""
+import heapq
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from .cache import get_version
+
+# Short prefixes match thousands of keys, so their ranking is memoized above this many matches
+MEMO_THRESHOLD = 100
+MAX_LIMIT = 20
+
+ROW_FIELDS = (
+    'product_id', 'name', 'is_featured', 'total_stock', 'sales_30d', 'sales_total',
+    'brand_id', 'brand_name', 'category_name', 'category_display_name',
+)
+
+
+def normalize(text):
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).lower().strip()
+
+
+def _word_starts(text):
+    words = normalize(text).split()
+    return {' '.join(words[index:]) for index in range(len(words))}
+
+
+def _product_score(row):
+    product_id, name, is_featured, total_stock, sales_30d, sales_total = row[:6]
+    return sales_30d, sales_total, int(total_stock > 0) + int(is_featured)
+
+
+def _count(groups, row, sign):
+    """Add a catalog row to, or with sign=-1 take it from, its brand and category totals.
+
+    groups maps ('brand', id) and ('category', name) to [text, sales_30d,
+    sales_total, products]. Returns the groups touched.
+    """
+    sales_30d, sales_total = row[4:6]
+    brand_id, brand_name, category_name, category_display_name = row[6:]
+    touched = [('category', category_name, category_display_name)]
+    if brand_id:
+        touched.append(('brand', brand_id, brand_name))
+    for kind, value, text in touched:
+        totals = groups.setdefault((kind, value), [text, 0, 0, 0])
+        if sign > 0:
+            # The latest row carries the current name
+            totals[0] = text
+        totals[1] += sign * sales_30d
+        totals[2] += sign * sales_total
+        totals[3] += sign
+    return [(kind, value) for kind, value, text in touched]
+
+
+class SuggestionIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.keys = []
+        self.items = {}
+        # The catalog row each product was indexed from, and the brand and category totals built from them
+        self.products = {}
+        self.groups = {}
+        self.memo = {}
+        self.version = None
+        self.built_at = 0
+
+    def build(self):
+        from .models import CatalogEntry
+
+        rows = CatalogEntry.objects.filter(is_active=True).values_list(*ROW_FIELDS)
+        version = get_version()
+        products, groups = {}, {}
+        for row in rows:
+            products[row[0]] = row
+            _count(groups, row, 1)
+        items = {('product', product_id): (row[1], _product_score(row)) for product_id, row in products.items()}
+        items.update({group: (text, tuple(totals)) for group, (text, *totals) in groups.items()})
+
+        keys = sorted(
+            (key, kind, value) for (kind, value), (text, score) in items.items() for key in _word_starts(text)
+        )
+        with self.lock:
+            self.items, self.keys, self.memo = items, keys, {}
+            self.products, self.groups = products, groups
+            self.version, self.built_at = version, time.monotonic()
+
+    def warm(self):
+        """Build the index ahead of the first search; returns whether it could"""
+        try:
+            self.build()
+        except DatabaseError:
+            # Tables not migrated yet: the first search builds it instead
+            return False
+        return True
+
+    def ensure_fresh(self):
+        if self.version is None:
+            self.build()
+        elif time.monotonic() - self.built_at > settings.SUGGESTIONS_REBUILD_INTERVAL and get_version() != self.version:
+            self.build()
+
+    def update_products(self, product_ids):
+        """Re-read the given products from the catalog table and replace their entries and group totals"""
+        from .models import CatalogEntry
+
+        if self.version is None:
+            return
+        rows = {
+            row[0]: row
+            for row in CatalogEntry.objects.filter(pk__in=product_ids, is_active=True).values_list(*ROW_FIELDS)
+        }
+        with self.lock:
+            self.memo = {}
+            touched = set()
+            for product_id in product_ids:
+                self._remove(('product', product_id))
+                previous = self.products.pop(product_id, None)
+                if previous is not None:
+                    touched.update(_count(self.groups, previous, -1))
+                row = rows.get(product_id)
+                if row is not None:
+                    self.products[product_id] = row
+                    touched.update(_count(self.groups, row, 1))
+                    self._add(('product', product_id), (row[1], _product_score(row)))
+            # Renamed groups need new keys, so touched groups are re-added whole
+            for group in touched:
+                self._remove(group)
+                text, *totals = self.groups[group]
+                if totals[-1] > 0:
+                    self._add(group, (text, tuple(totals)))
+                else:
+                    del self.groups[group]
+
+    def _remove(self, item):
+        entry = self.items.pop(item, None)
+        if entry is None:
+            return
+        kind, value = item
+        for key in _word_starts(entry[0]):
+            index = bisect_left(self.keys, (key, kind, value))
+            if index < len(self.keys) and self.keys[index] == (key, kind, value):
+                del self.keys[index]
+
+    def _add(self, item, entry):
+        kind, value = item
+        self.items[item] = entry
+        for key in _word_starts(entry[0]):
+            insort(self.keys, (key, kind, value))
+
+    def suggest(self, prefix, limit=8):
+        """Return up to ``limit`` (kind, value, text) tuples matching prefix, most popular first"""
+        prefix = normalize(prefix)
+        limit = max(0, min(limit, MAX_LIMIT))
+        if not prefix:
+            return []
+        self.ensure_fresh()
+        with self.lock:
+            best = self.memo.get(prefix)
+            if best is None:
+                # Every key with the prefix is ranked, however many there are
+                matches = set()
+                index = bisect_left(self.keys, (prefix,))
+                while index < len(self.keys) and self.keys[index][0].startswith(prefix):
+                    matches.add(self.keys[index][1:])
+                    index += 1
+                best = [
+                    (kind, value, self.items[(kind, value)][0])
+                    for kind, value in heapq.nsmallest(MAX_LIMIT, matches, key=self._rank)
+                ]
+                if len(matches) > MEMO_THRESHOLD:
+                    self.memo[prefix] = best
+            return best[:limit]
+
+    def _rank(self, item):
+        text, score = self.items[item]
+        return tuple(-value for value in score), len(text), text
+
+
+suggestion_index = SuggestionIndex()
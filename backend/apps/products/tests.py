@@ -1,3 +1,836 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from apps.orders.models import Order, OrderItem
+from store.media import serve_media
+from store.pagination import KeysetPagination
+from .bulk import import_catalog
+from .catalog import rebuild_catalog, refresh_catalog
+from .images import DERIVATIVE_SIZES, generate_derivatives
+from .models import (
+    Brand, CatalogEntry, Category, Product, ProductImage, ProductRecommendation, ProductVariant, Subcategory,
+)
+from .recommendations import SETTLE_SECONDS, build_recommendations
+from .snapshot import SnapshotWriter, export_snapshot
+from .storage import content_addressed_storage
+from .suggest import SuggestionIndex
+
+User = get_user_model()
+
+
+def make_admin():
+    return User.objects.create_user(username='admin', email='admin@example.com', password='x', role='super_admin')
+
+
+def make_image_file(name='foto.png', color='red', size=(40, 30)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+def make_product(name, category=None, brand=None, price=50000, **fields):
+    category = category or Category.objects.get_or_create(name='mujer', defaults={'display_name': 'Mujer'})[0]
+    return Product.objects.create(
+        name=name, description=fields.pop('description', name), category=category, brand=brand, price=price, **fields,
+    )
+
+
+def make_order(products, age=timedelta(hours=1), status='pending'):
+    order = Order.objects.create(
+        billing_first_name='Ana', billing_last_name='Gómez', billing_email='ana@example.com', billing_phone='300',
+        billing_address='Calle 1', billing_city='Bogotá', billing_department='Cundinamarca',
+        shipping_first_name='Ana', shipping_last_name='Gómez', shipping_address='Calle 1', shipping_city='Bogotá',
+        shipping_department='Cundinamarca', subtotal=0, shipping_cost=0, tax=0, total=0, status=status,
+    )
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=product, quantity=1, price=product.price) for product in products
+    ])
+    Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - age)
+    return order
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.blusa, self.falda, self.jean = make_product('Blusa'), make_product('Falda'), make_product('Jean')
+
+    def recommended(self, product):
+        return list(
+            ProductRecommendation.objects.filter(product=product).order_by('rank').values_list('recommended__name', 'score')
+        )
+
+    def test_counts_pairs_incrementally(self):
+        make_order([self.blusa, self.falda])
+        make_order([self.blusa, self.jean])
+        build_recommendations()
+        make_order([self.blusa, self.jean])
+        build_recommendations()
+        self.assertEqual(self.recommended(self.blusa), [('Jean', 2), ('Falda', 1)])
+
+    def test_cancelled_orders_are_left_out(self):
+        make_order([self.blusa, self.falda], status='cancelled')
+        build_recommendations()
+        self.assertEqual(self.recommended(self.blusa), [])
+
+    def test_recent_orders_wait_for_a_later_run(self):
+        settled = make_order([self.blusa, self.falda])
+        recent = make_order([self.blusa, self.jean], age=timedelta(seconds=SETTLE_SECONDS // 2))
+        run = build_recommendations()
+        self.assertEqual(run.last_order_id, settled.pk)
+        self.assertEqual(self.recommended(self.blusa), [('Falda', 1)])
+
+        Order.objects.filter(pk=recent.pk).update(created_at=timezone.now() - timedelta(seconds=SETTLE_SECONDS + 1))
+        run = build_recommendations()
+        self.assertEqual(run.last_order_id, recent.pk)
+        self.assertEqual(self.recommended(self.blusa), [('Falda', 1), ('Jean', 1)])
+
+    def test_nothing_new(self):
+        make_order([self.blusa, self.falda])
+        build_recommendations()
+        self.assertIsNone(build_recommendations())
+
+
+class MediaTestCase(TestCase):
+    """Writes uploads to a throwaway MEDIA_ROOT"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+# Derivatives are generated on a thread pool; these tests only look at the database
+@mock.patch('apps.products.signals.schedule_derivatives')
+class UploadProductImageTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(make_admin())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = make_product('Blusa')
+
+    def upload(self, color, is_main):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f'/api/products/admin/{self.product.pk}/images/upload/',
+                {'image': make_image_file(color=color), 'is_main': is_main}, format='multipart',
+            )
+        self.assertEqual(response.status_code, 201)
+        return ProductImage.objects.get(pk=response.data['id'])
+
+    def test_new_main_image_replaces_the_old_one(self, schedule_derivatives):
+        first = self.upload('red', 'true')
+        second = self.upload('blue', 'true')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.main_image_ref_id, second.pk)
+        self.assertEqual(list(self.product.images.filter(is_main=True)), [second])
+        self.assertNotEqual(first.image.name, second.image.name)
+        self.assertEqual(CatalogEntry.objects.get(pk=self.product.pk).main_image_name, second.image.name)
+
+    def test_is_main_false_keeps_the_main_image(self, schedule_derivatives):
+        first = self.upload('red', 'true')
+        self.upload('blue', 'false')
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.main_image_ref_id, first.pk)
+        self.assertEqual(CatalogEntry.objects.get(pk=self.product.pk).main_image_name, first.image.name)
+
+
+@mock.patch.object(KeysetPagination, 'page_size', 3)
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        created_at = timezone.now() - timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            for index, (name, price) in enumerate([
+                ('Blusa', 30000), ('Falda', 50000), ('Jean', 30000), ('Abrigo', 90000),
+                ('Camisa', 50000), ('Vestido', 30000), ('Bufanda', 20000), ('Saco', 50000),
+            ]):
+                make_product(name, price=price, sales_30d=index % 3)
+        # Ties on the ordering field are broken by the primary key
+        CatalogEntry.objects.filter(name__in=['Falda', 'Jean', 'Camisa']).update(created_at=created_at)
+        self.client = APIClient()
+
+    def walk(self, ordering):
+        names, url = [], f'/api/products/?ordering={ordering}&cursor='
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 3)
+            names += [product['name'] for product in response.data['results']]
+            url = response.data['next']
+        return names
+
+    def test_pages_cover_every_product_once_in_order(self):
+        for ordering, field in [
+            ('-created_at', '-created_at'), ('created_at', 'created_at'), ('price', 'price'), ('-price', '-price'),
+            ('name', 'name'), ('-name', '-name'), ('-sales', '-sales_30d'), ('sales_30d', 'sales_30d'),
+        ]:
+            with self.subTest(ordering=ordering):
+                pk = '-pk' if field.startswith('-') else 'pk'
+                expected = list(CatalogEntry.objects.order_by(field, pk).values_list('name', flat=True))
+                self.assertEqual(self.walk(ordering), expected)
+
+    def test_malformed_cursors_are_not_found(self):
+        for ordering, cursor in [
+            ('-created_at', 'WzEsImEiXQ=='),  # [1, "a"]
+            ('-created_at', 'WyJ4IiwxXQ=='),  # ["x", 1]
+            ('price', 'WyIxMCIsdHJ1ZV0='),  # ["10", true]
+            ('price', 'WzEwLDFd'),  # [10, 1]: prices are encoded as strings
+            ('name', 'eyJhIjoxLCJiIjoyfQ=='),  # {"a": 1, "b": 2}
+            ('name', 'WyJhIiwxLDJd'),  # ["a", 1, 2]
+            ('name', 'no-es-base64!'),
+        ]:
+            with self.subTest(ordering=ordering, cursor=cursor):
+                response = self.client.get(f'/api/products/?ordering={ordering}&cursor={cursor}')
+                self.assertEqual(response.status_code, 404)
+
+
+class AdminProductStockTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(make_admin())
+
+    def patch_stock(self, product, stock):
+        response = self.client.patch(f'/api/products/admin/{product.pk}/', {'name': 'Blusa', 'stock': stock}, format='json')
+        self.assertEqual(response.status_code, 200)
+        product.refresh_from_db()
+        return product.stock
+
+    def test_stock_of_a_product_without_variants_is_editable(self):
+        self.assertEqual(self.patch_stock(make_product('Blusa', stock=2), 7), 7)
+
+    def test_stock_derived_from_variants_is_kept(self):
+        product = make_product('Blusa')
+        ProductVariant.objects.create(product=product, size='S', color='azul', stock=3)
+        ProductVariant.objects.create(product=product, size='M', color='azul', stock=4)
+        self.assertEqual(self.patch_stock(product, 100), 7)
+
+
+class SuggestionIndexTests(TestCase):
+    def setUp(self):
+        self.mujer = Category.objects.create(name='mujer', display_name='Mujer')
+        self.hombre = Category.objects.create(name='hombre', display_name='Hombre')
+        self.index = SuggestionIndex()
+
+    def product(self, name, **fields):
+        product = make_product(name, **{'category': self.mujer, **fields})
+        refresh_catalog([product.pk])
+        return product
+
+    def suggest(self, prefix):
+        return [text for kind, value, text in self.index.suggest(prefix)]
+
+    def test_ranks_by_sales_and_folds_accents(self):
+        self.product('Camisa lino', sales_30d=1, sales_total=50)
+        self.product('Camiseta básica', sales_30d=9, sales_total=9)
+        self.product('Camión de juguete')
+        self.assertEqual(self.suggest('CAMI'), ['Camiseta básica', 'Camisa lino', 'Camión de juguete'])
+        self.assertEqual(self.suggest('basica'), ['Camiseta básica'])
+
+    def test_broad_prefixes_rank_every_match(self):
+        Product.objects.bulk_create([
+            Product(name=f'Producto {number:04}', description='x', category=self.mujer, price=1000)
+            for number in range(2500)
+        ])
+        bestseller = self.product('Producto estrella', sales_30d=5)
+        refresh_catalog(Product.objects.values_list('pk', flat=True))
+        self.assertEqual(self.index.suggest('pro', limit=1), [('product', bestseller.pk, 'Producto estrella')])
+
+    def test_updates_keep_brand_and_category_totals(self):
+        nike, nadia = Brand.objects.create(name='Nike'), Brand.objects.create(name='Nadia')
+        first = self.product('Tenis', brand=nike, sales_30d=1)
+        second = self.product('Sandalia', brand=nike, sales_30d=1)
+        self.product('Bolso', brand=nadia, sales_30d=3)
+        self.index.build()
+        self.assertEqual(self.suggest('n'), ['Nadia', 'Nike'])
+
+        # Moving both products to another brand and category empties the old ones
+        Product.objects.filter(pk__in=[first.pk, second.pk]).update(brand=nadia, category=self.hombre, sales_30d=2)
+        refresh_catalog([first.pk, second.pk])
+        self.index.update_products([first.pk, second.pk])
+        self.assertEqual(self.suggest('n'), ['Nadia'])
+        self.assertEqual(self.index.items[('brand', nadia.pk)], ('Nadia', (7, 0, 3)))
+        self.assertEqual(self.suggest('hom'), ['Hombre'])
+        self.assertEqual(self.index.items[('category', 'mujer')], ('Mujer', (3, 0, 1)))
+
+    def test_warmed_index_answers_the_first_search_without_queries(self):
+        self.product('Camisa lino')
+        self.assertTrue(self.index.warm())
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('cam'), ['Camisa lino'])
+
+    def test_warming_before_migrate_leaves_the_build_to_the_first_search(self):
+        with mock.patch.object(CatalogEntry.objects, 'filter', side_effect=DatabaseError('no such table')):
+            self.assertFalse(self.index.warm())
+        self.assertIsNone(self.index.version)
+        self.product('Camisa lino')
+        self.assertEqual(self.suggest('cam'), ['Camisa lino'])
+
+
+class ProductListQueryTests(MediaTestCase):
+    """The listing runs a fixed number of queries however many products a page holds"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        brands = [Brand.objects.create(name=f'Marca {index}') for index in range(3)]
+        with mock.patch('apps.products.signals.schedule_derivatives'), self.captureOnCommitCallbacks(execute=True):
+            for index in range(25):
+                product = make_product(f'Producto {index}', brand=brands[index % 3])
+                ProductVariant.objects.create(product=product, size='S', color='azul', stock=2)
+                ProductVariant.objects.create(product=product, size='M', color='rojo', stock=1)
+                ProductImage.objects.create(product=product, image=make_image_file(color=(index, 0, 0)), is_main=True)
+        self.client = APIClient()
+
+    def get(self, url, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 20)
+        return response.data['results']
+
+    def test_list_page(self):
+        # Last-Modified, count and the page, all from the catalog table
+        results = self.get('/api/products/', 3)
+        self.assertTrue(all(product['brand_name'] and product['main_image'] for product in results))
+
+    def test_expanded_list_page(self):
+        # Plus the products, their images and their variants
+        results = self.get('/api/products/?expand=images,variants', 6)
+        self.assertTrue(all(len(product['variants']) == 2 and len(product['images']) == 1 for product in results))
+
+    def test_admin_list_page(self):
+        self.client.force_authenticate(make_admin())
+        # The page with its joins, the count, and the two prefetches
+        results = self.get('/api/products/admin/?expand=images,variants', 4)
+        self.assertTrue(all(product['brand_name'] and product['main_image'] for product in results))
+        self.assertTrue(all(len(product['variants']) == 2 for product in results))
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            product = make_product('Blusa')
+            ProductVariant.objects.create(product=product, size='M', color='azul', stock=3)
+        self.client = APIClient()
+
+    def first(self, query):
+        return self.client.get(f'/api/products/?{query}').data['results'][0]
+
+    def test_fields_select_the_returned_keys(self):
+        self.assertEqual(set(self.first('fields=id,name')), {'id', 'name'})
+
+    def test_expanded_relations_are_selected_implicitly(self):
+        product = self.first('fields=id,name&expand=variants')
+        self.assertEqual(set(product), {'id', 'name', 'variants'})
+        self.assertEqual([variant['size'] for variant in product['variants']], ['M'])
+        self.assertIn('images', self.first('expand=images'))
+
+
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        self.product = make_product('Blusa', price=30000)
+        ProductVariant.objects.create(product=self.product, size='S', color='azul', stock=1)
+
+    def test_product_referenced_by_id_and_by_name_is_written_once(self):
+        result = import_catalog([
+            'product_id,name,description,category,price,size,color,variant_stock\n',
+            f'{self.product.pk},,Algodón,,,S,azul,4\n',
+            ',Blusa,,mujer,40000,M,azul,6\n',
+        ], 'csv')
+        self.assertEqual(result['errors'], [])
+        self.assertEqual((result['products_created'], result['products_updated'], result['variants']), (0, 1, 2))
+        self.assertEqual(Product.objects.count(), 1)
+        self.product.refresh_from_db()
+        # Each row's columns land on the same product
+        self.assertEqual((self.product.description, self.product.price, self.product.stock), ('Algodón', 40000, 10))
+        self.assertEqual(
+            list(self.product.variants.order_by('size').values_list('size', 'stock')), [('M', 6), ('S', 4)],
+        )
+
+    def test_new_product_rows_share_one_instance(self):
+        result = import_catalog([
+            '{"name": "Falda", "category": "mujer", "price": "50000", "size": "S", "color": "rojo", "variant_stock": "2"}\n',
+            '{"name": "Falda", "category": "mujer", "size": "M", "color": "rojo", "variant_stock": "3"}\n',
+        ], 'jsonl')
+        self.assertEqual(result['errors'], [])
+        falda = Product.objects.get(name='Falda')
+        self.assertEqual((result['products_created'], falda.stock, falda.variants.count()), (1, 5, 2))
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            make_product('Camisa de lino', description='Combina con un pantalón claro')
+            make_product('Pantalón azul', description='Tela de algodón')
+            make_product('Chaqueta', description='Impermeable')
+        self.client = APIClient()
+
+    def search(self, text, **params):
+        response = self.client.get('/api/products/', {'search': text, **params})
+        return [product['name'] for product in response.data['results']]
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('pantalón'), ['Pantalón azul', 'Camisa de lino'])
+
+    def test_accents_are_folded_both_ways(self):
+        self.assertEqual(self.search('pantalon'), ['Pantalón azul', 'Camisa de lino'])
+        self.assertEqual(self.search('algodon'), ['Pantalón azul'])
+        self.assertEqual(self.search('ALGODÓN'), ['Pantalón azul'])
+
+    def test_words_are_prefixes_and_all_must_match(self):
+        self.assertEqual(self.search('panta az'), ['Pantalón azul'])
+        self.assertEqual(self.search('chaq lino'), [])
+
+    def test_explicit_ordering_overrides_relevance(self):
+        self.assertEqual(self.search('pantalon', ordering='name'), ['Camisa de lino', 'Pantalón azul'])
+
+    def test_index_follows_product_changes(self):
+        chaqueta = Product.objects.get(name='Chaqueta')
+        with self.captureOnCommitCallbacks(execute=True):
+            chaqueta.name = 'Chaqueta de jean'
+            chaqueta.save()
+        self.assertEqual(self.search('jean'), ['Chaqueta de jean'])
+        with self.captureOnCommitCallbacks(execute=True):
+            chaqueta.delete()
+        self.assertEqual(self.search('jean'), [])
+
+
+class ProductFacetsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        hombre = Category.objects.create(name='hombre', display_name='Hombre')
+        nike = Brand.objects.create(name='Nike')
+        with self.captureOnCommitCallbacks(execute=True):
+            blusa = make_product('Blusa', price=40000, brand=nike)
+            falda = make_product('Falda', price=120000)
+            make_product('Camisa', category=hombre, price=60000, brand=nike)
+            make_product('Oculta', price=10000, is_active=False)
+            # Two variants of one product count it once per size and color
+            ProductVariant.objects.create(product=blusa, size='S', color='azul', stock=1)
+            ProductVariant.objects.create(product=blusa, size='M', color='azul', stock=1)
+            ProductVariant.objects.create(product=falda, size='M', color='rojo', stock=1)
+        self.client = APIClient()
+
+    def facets(self, **params):
+        return self.client.get('/api/products/facets/', params).data
+
+    def counts(self, entries, key='value'):
+        return {entry[key]: entry['count'] for entry in entries}
+
+    def test_counts_active_products_per_facet(self):
+        facets = self.facets()
+        self.assertEqual(facets['total'], 3)
+        self.assertEqual(self.counts(facets['categories']), {'mujer': 2, 'hombre': 1})
+        self.assertEqual(self.counts(facets['brands'], 'label'), {'Nike': 2})
+        self.assertEqual(self.counts(facets['sizes']), {'S': 1, 'M': 2})
+        self.assertEqual(self.counts(facets['colors']), {'azul': 1, 'rojo': 1})
+        self.assertEqual(self.counts(facets['price_ranges'], 'min'), {0: 1, 50000: 1, 100000: 1})
+
+    def test_counts_follow_the_list_filters(self):
+        facets = self.facets(category='mujer', search='blusa')
+        self.assertEqual(facets['total'], 1)
+        self.assertEqual(self.counts(facets['sizes']), {'S': 1, 'M': 1})
+
+    def test_cached_counts_follow_catalog_writes(self):
+        self.assertEqual(self.facets()['total'], 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            make_product('Vestido', price=80000)
+        self.assertEqual(self.facets()['total'], 4)
+
+
+class CatalogRefreshTests(TestCase):
+    def setUp(self):
+        self.brand = Brand.objects.create(name='Marca')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = make_product('Blusa', price=50000, brand=self.brand)
+
+    def entry(self):
+        return CatalogEntry.objects.get(pk=self.product.pk)
+
+    def test_entry_follows_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.create(product=self.product, size='L', color='rojo', stock=2, price_adjustment=5000)
+            ProductVariant.objects.create(product=self.product, size='S', color='azul', stock=3)
+        entry = self.entry()
+        self.assertEqual((entry.total_stock, entry.min_price, entry.max_price), (5, 50000, 55000))
+        self.assertEqual((entry.sizes, entry.colors), (',S,L,', ',azul,rojo,'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.variants.get(size='L').delete()
+        entry = self.entry()
+        self.assertEqual((entry.total_stock, entry.max_price, entry.sizes), (3, 50000, ',S,'))
+
+    def test_entry_follows_labels_and_deletes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.brand.name = 'Otra marca'
+            self.brand.save()
+        self.assertEqual(self.entry().brand_name, 'Otra marca')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(is_active=False)
+            self.product.refresh_from_db()
+            self.product.save()
+        self.assertFalse(self.entry().is_active)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        self.assertFalse(CatalogEntry.objects.exists())
+
+    def test_rebuild_repairs_rows_written_around_the_model(self):
+        ProductVariant.objects.bulk_create([ProductVariant(product=self.product, size='M', color='azul', stock=4)])
+        CatalogEntry.objects.all().delete()
+        self.assertEqual(rebuild_catalog(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.entry().total_stock, self.entry().sizes), (4, 4, ',M,'))
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = make_product('Blusa', is_featured=True)
+        self.client = APIClient()
+
+    def revalidate(self, url):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        again = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        return first, again
+
+    def change_product(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = 45000
+            self.product.save()
+
+    def test_unchanged_resources_answer_not_modified(self):
+        for url in [f'/api/products/{self.product.pk}/', '/api/products/', '/api/products/featured/']:
+            with self.subTest(url=url):
+                first, again = self.revalidate(url)
+                self.assertEqual(again.status_code, 304)
+                self.assertEqual(again.content, b'')
+                self.assertEqual(again['ETag'], first['ETag'])
+                self.assertIn('Last-Modified', first)
+
+    def test_changes_produce_a_new_etag(self):
+        for url in [f'/api/products/{self.product.pk}/', '/api/products/', '/api/products/featured/']:
+            with self.subTest(url=url):
+                first = self.client.get(url)
+                self.change_product()
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], first['ETag'])
+
+    def test_list_etag_depends_on_the_filters(self):
+        mujer = self.client.get('/api/products/?category=mujer')
+        hombre = self.client.get('/api/products/?category=hombre', HTTP_IF_NONE_MATCH=mujer['ETag'])
+        self.assertEqual(hombre.status_code, 200)
+
+    def test_inactive_product_is_not_found(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.is_active = False
+            self.product.save()
+        self.assertEqual(self.client.get(f'/api/products/{self.product.pk}/').status_code, 404)
+
+
+@mock.patch('apps.products.signals.schedule_derivatives')
+class ImageDerivativeTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = make_product('Blusa')
+
+    def image(self, upload, is_main=True):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ProductImage.objects.create(product=self.product, image=upload, is_main=is_main)
+
+    def generate(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            return generate_derivatives(image.pk)
+
+    def test_sizes_and_formats(self, schedule_derivatives):
+        image = self.image(make_image_file(size=(1600, 800)))
+        schedule_derivatives.assert_called_with(image.pk)
+        derivatives = self.generate(image)
+        self.assertEqual(derivatives['source'], image.image.name)
+        for size, longest_side in DERIVATIVE_SIZES.items():
+            self.assertEqual(derivatives[size]['width'], longest_side)
+            for extension, image_format in [('jpeg', 'JPEG'), ('webp', 'WEBP')]:
+                with image.image.storage.open(derivatives[size][extension]) as stored:
+                    self.assertEqual(Image.open(stored).format, image_format)
+        image.refresh_from_db()
+        self.assertEqual(image.derivatives, derivatives)
+        # The catalog row serves the derivatives of the main image
+        self.assertEqual(CatalogEntry.objects.get(pk=self.product.pk).main_image_derivatives, derivatives)
+
+    def test_small_originals_are_not_upscaled(self, schedule_derivatives):
+        derivatives = self.generate(self.image(make_image_file(size=(300, 200))))
+        self.assertEqual(
+            {size: derivatives[size]['width'] for size in DERIVATIVE_SIZES},
+            {'thumbnail': 160, 'card': 300, 'detail': 300},
+        )
+
+    def test_transparent_images_are_flattened_on_white(self, schedule_derivatives):
+        buffer = io.BytesIO()
+        Image.new('RGBA', (50, 50), (0, 0, 0, 0)).save(buffer, 'PNG')
+        image = self.image(SimpleUploadedFile('transparente.png', buffer.getvalue(), content_type='image/png'))
+        derivatives = self.generate(image)
+        with image.image.storage.open(derivatives['thumbnail']['jpeg']) as stored:
+            self.assertEqual(Image.open(stored).convert('RGB').getpixel((0, 0)), (255, 255, 255))
+
+    def test_same_file_reuses_existing_derivatives(self, schedule_derivatives):
+        first = self.image(make_image_file(color='green'))
+        derivatives = self.generate(first)
+        second = self.image(make_image_file(name='copia.png', color='green'), is_main=False)
+        self.assertEqual(second.image.name, first.image.name)
+        with mock.patch('apps.products.images.Image.open') as image_open:
+            self.assertEqual(self.generate(second), derivatives)
+        image_open.assert_not_called()
+        second.refresh_from_db()
+        self.assertEqual(second.derivatives, derivatives)
+
+    def test_missing_image_is_ignored(self, schedule_derivatives):
+        self.assertIsNone(generate_derivatives(0))
+
+
+class VariantMatrixTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(make_admin())
+        self.product = make_product('Blusa', stock=0)
+
+    def post(self, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/api/products/admin/{self.product.pk}/variants/matrix/', data, format='json')
+
+    def stocks(self):
+        return dict(((size, color), stock) for size, color, stock in self.product.variants.values_list('size', 'color', 'stock'))
+
+    def test_creates_every_cell_with_defaults_and_overrides(self):
+        response = self.post({
+            'sizes': ['M', 'S'], 'colors': ['azul', 'rojo'], 'stock': 2, 'price_adjustment': '1000',
+            'cells': [{'size': 'S', 'color': 'rojo', 'stock': 9, 'price_adjustment': '-500'}],
+        })
+        self.assertEqual(response.status_code, 200)
+        # Sizes and colors come back in catalog order
+        self.assertEqual(response.data['sizes'], ['S', 'M'])
+        self.assertEqual(response.data['colors'], ['rojo', 'azul'])
+        self.assertEqual(response.data['matrix']['S']['rojo']['stock'], 9)
+        self.assertEqual(response.data['matrix']['S']['rojo']['price_adjustment'], '-500.00')
+        self.assertEqual(response.data['matrix']['M']['azul']['price_adjustment'], '1000.00')
+        self.assertEqual(
+            self.stocks(), {('S', 'azul'): 2, ('S', 'rojo'): 9, ('M', 'azul'): 2, ('M', 'rojo'): 2},
+        )
+        # The product total and its catalog row follow the variants
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 15)
+        self.assertEqual(CatalogEntry.objects.get(pk=self.product.pk).total_stock, 15)
+
+    def test_updates_existing_variants_in_place(self):
+        existing = ProductVariant.objects.create(product=self.product, size='S', color='azul', stock=5, price_adjustment=300)
+        outside = ProductVariant.objects.create(product=self.product, size='XL', color='negro', stock=4)
+        self.post({'sizes': ['S', 'M'], 'colors': ['azul'], 'cells': [{'size': 'M', 'color': 'azul', 'stock': 1}]})
+        # Values given nowhere keep what the variant had, or start at zero
+        existing.refresh_from_db()
+        self.assertEqual((existing.stock, existing.price_adjustment), (5, 300))
+        self.assertEqual(self.stocks(), {('S', 'azul'): 5, ('M', 'azul'): 1, ('XL', 'negro'): 4})
+        self.assertTrue(ProductVariant.objects.filter(pk=outside.pk).exists())
+
+        self.post({'sizes': ['S'], 'colors': ['azul'], 'stock': 8})
+        self.assertEqual(ProductVariant.objects.filter(product=self.product, size='S', color='azul').get().pk, existing.pk)
+        self.assertEqual(self.stocks()[('S', 'azul')], 8)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 13)
+
+    def test_invalid_grid_writes_nothing(self):
+        response = self.post({'sizes': ['S'], 'colors': ['azul'], 'cells': [{'size': 'M', 'color': 'azul', 'stock': 1}]})
+        self.assertEqual(response.status_code, 400)
+        response = self.post({'sizes': ['S', 'XXXL'], 'colors': ['azul']})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.product.variants.exists())
+
+    def test_requires_admin(self):
+        self.client.force_authenticate(User.objects.create_user(username='cliente', password='x'))
+        self.assertEqual(self.post({'sizes': ['S'], 'colors': ['azul']}).status_code, 403)
+        self.assertFalse(self.product.variants.exists())
+
+
+class MigrationTests(TestCase):
+    def test_models_match_the_migrations(self):
+        # Every schema change ships its migration with it
+        call_command('makemigrations', check=True, dry_run=True, verbosity=0)
+
+
+class ContentAddressedMediaTests(MediaTestCase):
+    def test_identical_bytes_are_stored_once(self):
+        name = content_addressed_storage.save('products/foto.PNG', make_image_file())
+        self.assertRegex(name, r'^products/([0-9a-f]{2})/\1[0-9a-f]{62}\.png$')
+        self.assertEqual(content_addressed_storage.save('products/otra.png', make_image_file(name='otra.png')), name)
+        self.assertEqual(content_addressed_storage.listdir(name.rsplit('/', 1)[0])[1], [name.rsplit('/', 1)[1]])
+        self.assertNotEqual(content_addressed_storage.save('products/foto.png', make_image_file(color='blue')), name)
+
+    def serve(self, path, **headers):
+        return serve_media(RequestFactory().get(f'/media/{path}', **headers), path)
+
+    def test_hashed_names_are_served_as_immutable(self):
+        name = content_addressed_storage.save('products/foto.png', make_image_file())
+        response = self.serve(name)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(response['Cache-Control'].split(', ')), ['immutable', 'max-age=31536000', 'public'],
+        )
+        revalidated = self.serve(name, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertIn('immutable', revalidated['Cache-Control'])
+
+    def test_other_names_keep_revalidating(self):
+        # Written as an upload from before content addressing
+        name = FileSystemStorage().save('categories/foto.png', make_image_file())
+        response = self.serve(name)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Cache-Control', response)
+
+    def test_media_is_not_served_without_debug(self):
+        name = content_addressed_storage.save('products/foto.png', make_image_file())
+        self.assertEqual(self.client.get(f'/media/{name}').status_code, 404)
+
+
+class SnapshotExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        hombre = Category.objects.create(name='hombre', display_name='Hombre')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.blusa = make_product('Blusa')
+            self.camisa = make_product('Camisa', category=hombre)
+        self.export()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def read(self, name):
+        with open(self.path(name), encoding='utf-8') as stored:
+            return json.load(stored)
+
+    def export(self):
+        """Run an incremental export; returns (result, names of the files written)"""
+        with mock.patch.object(SnapshotWriter, 'write', autospec=True, side_effect=SnapshotWriter.write) as write:
+            # The test client's host, the only one ALLOWED_HOSTS lets through in tests
+            result = export_snapshot(self.directory, base_url='http://testserver')
+        return result, {call.args[1] for call in write.call_args_list}
+
+    def test_first_export_writes_every_page_and_the_manifest(self):
+        manifest = self.read('manifest.json')
+        self.assertEqual(manifest['products'], {str(self.blusa.pk): 'mujer', str(self.camisa.pk): 'hombre'})
+        for url in [
+            '/api/products/', '/api/products/?category=mujer', '/api/products/categories/',
+            f'/api/products/{self.blusa.pk}/', f'/api/products/{self.camisa.pk}/',
+        ]:
+            entry = manifest['files'][url]
+            with open(self.path(entry['file']), 'rb') as stored:
+                content = stored.read()
+            self.assertEqual(hashlib.sha256(content).hexdigest(), entry['sha256'])
+            with gzip.open(self.path(entry['file'] + '.gz')) as compressed:
+                self.assertEqual(compressed.read(), content)
+        self.assertEqual(self.read(f'api/products/{self.blusa.pk}/index.json')['name'], 'Blusa')
+
+    def test_unchanged_catalog_writes_nothing_but_the_manifest(self):
+        generated_at = self.read('manifest.json')['generated_at']
+        result, written = self.export()
+        self.assertEqual((result['written'], result['removed'], written), (0, 0, set()))
+        self.assertGreater(self.read('manifest.json')['generated_at'], generated_at)
+
+    def test_changed_product_rewrites_only_its_pages(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.blusa.price = 45000
+            self.blusa.save()
+        result, written = self.export()
+        self.assertIn(f'api/products/{self.blusa.pk}/index.json', written)
+        self.assertIn('api/products/index@category=mujer.json', written)
+        self.assertIn('api/products/index.json', written)
+        for untouched in [
+            f'api/products/{self.camisa.pk}/index.json', 'api/products/index@category=hombre.json',
+            'api/products/categories/index.json', 'api/products/brands/index.json',
+        ]:
+            self.assertNotIn(untouched, written)
+        self.assertEqual(result['written'], len(written))
+        self.assertEqual(self.read(f'api/products/{self.blusa.pk}/index.json')['price'], '45000.00')
+
+    def test_deleted_product_page_is_removed(self):
+        url = f'/api/products/{self.camisa.pk}/'
+        name = self.read('manifest.json')['files'][url]['file']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.camisa.delete()
+        result, written = self.export()
+        self.assertFalse(os.path.exists(self.path(name)))
+        self.assertFalse(os.path.exists(self.path(name + '.gz')))
+        manifest = self.read('manifest.json')
+        self.assertNotIn(url, manifest['files'])
+        self.assertNotIn(str(self.camisa.pk), manifest['products'])
+        # The category listing it was in is re-rendered, now empty
+        self.assertIn('api/products/index@category=hombre.json', written)
+        self.assertEqual(self.read('api/products/index@category=hombre.json')['results'], [])
+        self.assertEqual(result['removed'], 1)
+        self.assertNotIn(f'api/products/{self.blusa.pk}/index.json', written)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.mujer = Category.objects.create(name='mujer', display_name='Mujer')
+        self.blusas = Subcategory.objects.create(category=self.mujer, name='Blusas')
+        self.marca = Brand.objects.create(name='Marca')
+        self.client = APIClient()
+
+    def names(self, url, field):
+        # Cache hits are plain HttpResponses, so the body is decoded here
+        return [row[field] for row in self.client.get(url).json()['results']]
+
+    def test_repeat_request_is_served_from_the_cache(self):
+        first = self.client.get('/api/products/categories/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/products/categories/')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+
+    def test_category_save_invalidates_the_listing(self):
+        self.assertEqual(self.names('/api/products/categories/', 'display_name'), ['Mujer'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mujer.display_name = 'Damas'
+            self.mujer.save()
+        self.assertEqual(self.names('/api/products/categories/', 'display_name'), ['Damas'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='hombre', display_name='Hombre')
+        self.assertEqual(sorted(self.names('/api/products/categories/', 'display_name')), ['Damas', 'Hombre'])
+
+    def test_subcategory_and_brand_writes_invalidate_their_listings(self):
+        self.assertEqual(self.names('/api/products/subcategories/', 'name'), ['Blusas'])
+        self.assertEqual(self.names('/api/products/brands/', 'name'), ['Marca'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.blusas.name = 'Camisas'
+            self.blusas.save()
+            self.marca.delete()
+        self.assertEqual(self.names('/api/products/subcategories/', 'name'), ['Camisas'])
+        self.assertEqual(self.names('/api/products/brands/', 'name'), [])
@@ -8,10 +8,17 @@ urlpatterns = [
     path('', views.ProductListView.as_view(), name='products'),
     path('<int:pk>/', views.ProductDetailView.as_view(), name='product-detail'),
     path('featured/', views.FeaturedProductsView.as_view(), name='featured-products'),
+    path('best-sellers/', views.BestSellersView.as_view(), name='best-sellers'),
+    path('facets/', views.ProductFacetsView.as_view(), name='product-facets'),
+    path('<int:pk>/recommendations/', views.product_recommendations, name='product-recommendations'),
+    path('suggestions/', views.product_suggestions, name='product-suggestions'),
     # Admin routes
     path('admin/create/', views.AdminProductCreateView.as_view(), name='admin-product-create'),
     path('admin/', views.AdminProductListView.as_view(), name='admin-products'),
     path('admin/<int:pk>/', views.AdminProductUpdateView.as_view(), name='admin-product-update'),
+    # Bulk import/export routes
+    path('admin/import/', views.import_products, name='admin-product-import'),
+    path('admin/export/<str:file_format>/', views.export_products, name='admin-product-export'),
     # Image management routes
     path('admin/<int:product_id>/images/upload/', views.upload_product_image, name='upload-product-image'),
     path('admin/<int:product_id>/images/<int:image_id>/delete/', views.delete_product_image, name='delete-product-image'),
@@ -28,6 +35,7 @@ urlpatterns = [
     path('admin/brands/<int:pk>/delete/', views.AdminBrandDeleteView.as_view(), name='admin-brand-delete'),
     # Variant management routes
     path('admin/<int:product_id>/variants/', views.AdminProductVariantListView.as_view(), name='admin-product-variants'),
+    path('admin/<int:product_id>/variants/matrix/', views.product_variant_matrix, name='admin-product-variant-matrix'),
     path('admin/variants/<int:pk>/', views.AdminProductVariantUpdateView.as_view(), name='admin-variant-update'),
     path('variant-choices/', views.get_variant_choices, name='variant-choices'),
 ]
\ No newline at end of file
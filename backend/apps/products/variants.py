@@ -0,0 +1,65 @@
+"""Size x color variant grids"""
+from decimal import Decimal
+
+from django.db import transaction
+
+from .catalog import products_changed
+from .models import Product, ProductVariant
+
+SIZE_ORDER = [value for value, label in ProductVariant.SIZE_CHOICES]
+COLOR_ORDER = [value for value, label in ProductVariant.COLOR_CHOICES]
+
+
+def save_variant_matrix(product, sizes, colors, stock=None, price_adjustment=None, cells=()):
+    """Create or update every size x color variant of a product in one transaction.
+
+    Each cell takes its own stock and price adjustment, falling back to the
+    grid defaults. Values given nowhere keep what an existing variant has,
+    or start at zero for a new one. Variants outside the grid are untouched.
+    """
+    overrides = {(cell['size'], cell['color']): cell for cell in cells}
+    with transaction.atomic():
+        existing = {
+            (variant.size, variant.color): variant
+            for variant in ProductVariant.objects.select_for_update().filter(product=product, size__in=sizes, color__in=colors)
+        }
+        variants = []
+        for size in dict.fromkeys(sizes):
+            for color in dict.fromkeys(colors):
+                cell = overrides.get((size, color), {})
+                current = existing.get((size, color))
+                variants.append(ProductVariant(
+                    product=product,
+                    size=size,
+                    color=color,
+                    stock=_pick(cell.get('stock'), stock, current and current.stock, 0),
+                    price_adjustment=_pick(
+                        cell.get('price_adjustment'), price_adjustment, current and current.price_adjustment, Decimal('0'),
+                    ),
+                ))
+        ProductVariant.objects.bulk_create(
+            variants, update_conflicts=True, unique_fields=['product', 'size', 'color'],
+            update_fields=['stock', 'price_adjustment'],
+        )
+        # bulk_create skips ProductVariant.save() and the save signals
+        Product.objects.filter(pk=product.pk).recompute_stock()
+        products_changed([product.pk])
+
+
+def _pick(*values):
+    return next(value for value in values if value is not None)
+
+
+def variant_matrix(product):
+    """Return the product's variants as {'sizes', 'colors', 'matrix': {size: {color: variant or None}}}"""
+    variants = list(ProductVariant.objects.filter(product=product).select_related('product'))
+    sizes = sorted({variant.size for variant in variants}, key=_order(SIZE_ORDER))
+    colors = sorted({variant.color for variant in variants}, key=_order(COLOR_ORDER))
+    matrix = {size: dict.fromkeys(colors) for size in sizes}
+    for variant in variants:
+        matrix[variant.size][variant.color] = variant
+    return {'sizes': sizes, 'colors': colors, 'matrix': matrix}
+
+
+def _order(values):
+    return lambda value: values.index(value) if value in values else len(values)
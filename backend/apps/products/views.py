@@ -1,17 +1,39 @@
-from rest_framework import generics, filters, permissions, status
+from rest_framework import generics, filters, permissions, serializers, status
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
 from django_filters.rest_framework import DjangoFilterBackend
+import codecs
+import os
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from .models import Category, Subcategory, Brand, Product, ProductImage, ProductVariant
+from django.utils.decorators import method_decorator
+from .bulk import FORMATS, export_lines, import_catalog
+from .cache import cache_response, make_key
+from .conditional import CatalogDetailConditionalMixin, CatalogListConditionalMixin
+from .facets import compute_facets
+from .models import Category, Subcategory, Brand, Product, ProductImage, ProductVariant, CatalogEntry
+from .recommendations import TOP_K
+from .sales import WINDOWS
+from .search import ProductSearchFilter, build_match_query
+from .suggest import suggestion_index
 from .serializers import (CategorySerializer, CategoryWriteSerializer, SubcategorySerializer, 
-                         BrandSerializer, ProductSerializer, ProductListSerializer, ProductImageSerializer, ProductVariantSerializer)
+                         BrandSerializer, ProductSerializer, AdminProductListSerializer, CatalogEntrySerializer,
+                         ProductImageSerializer, ProductVariantSerializer, VariantMatrixSerializer)
+from .variants import save_variant_matrix, variant_matrix
+
+SALES_PERIODS = {'total': 'sales_total', **{field.removeprefix('sales_'): field for field in WINDOWS}}
 
+@method_decorator(cache_response('categories'), name='dispatch')
 class CategoryListView(generics.ListAPIView):
     queryset = Category.objects.filter(is_active=True)
     serializer_class = CategorySerializer
     permission_classes = [permissions.AllowAny]
 
+@method_decorator(cache_response('subcategories'), name='dispatch')
 class SubcategoryListView(generics.ListAPIView):
     serializer_class = SubcategorySerializer
     permission_classes = [permissions.AllowAny]
@@ -24,44 +46,131 @@ class SubcategoryListView(generics.ListAPIView):
         return queryset
     
 
+@method_decorator(cache_response('brands'), name='dispatch')
 class BrandListView(generics.ListAPIView):
     queryset = Brand.objects.filter(is_active=True)
     serializer_class = BrandSerializer
     permission_classes = [permissions.AllowAny]
 
 
-class ProductListView(generics.ListAPIView):
-    serializer_class = ProductSerializer
+class CatalogListMixin:
+    """Public listings read from the CatalogEntry table instead of joining Product relations"""
+    serializer_class = CatalogEntrySerializer
     permission_classes = [permissions.AllowAny]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+
+    def with_expanded(self, queryset):
+        expand = CatalogEntrySerializer.get_expand(self.request)
+        if expand:
+            queryset = queryset.prefetch_related(*[f'product__{name}' for name in expand])
+        return queryset
+
+
+class CatalogOrderingFilter(filters.OrderingFilter):
+    """OrderingFilter that also accepts the names in the view's ordering_aliases"""
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        aliases = getattr(view, 'ordering_aliases', {})
+        if not ordering or not aliases:
+            return ordering
+        return [
+            f"{'-' if term.startswith('-') else ''}{aliases.get(term.lstrip('-'), term.lstrip('-'))}"
+            for term in ordering
+        ]
+
+
+class ProductFilterMixin:
+    """Filters shared by the public product list and its facet counts"""
+    # ProductSearchFilter runs last so relevance can override the default ordering
+    filter_backends = [DjangoFilterBackend, CatalogOrderingFilter, ProductSearchFilter]
     filterset_fields = ['subcategory', 'brand', 'is_featured']
-    search_fields = ['name', 'description']
-    ordering_fields = ['price', 'created_at', 'name']
+    search_fields = ['name', 'product__description', 'brand_name', 'category_display_name']
+    ordering_fields = ['price', 'created_at', 'name', 'sales', 'sales_7d', 'sales_30d', 'sales_total']
+    # ?ordering=-sales ranks by the last 30 days
+    ordering_aliases = {'sales': 'sales_30d'}
     ordering = ['-created_at']
 
-    def get_queryset(self):
-        queryset = Product.objects.filter(is_active=True)
+    def get_base_queryset(self):
+        queryset = CatalogEntry.objects.filter(is_active=True)
         
         # Custom filter for category by name
         category_name = self.request.query_params.get('category')
         if category_name:
-            queryset = queryset.filter(category__name=category_name)
+            queryset = queryset.filter(category_name=category_name)
+
+        size = self.request.query_params.get('size')
+        if size:
+            queryset = queryset.filter(sizes__contains=f',{size},')
+
+        color = self.request.query_params.get('color')
+        if color:
+            queryset = queryset.filter(colors__contains=f',{color},')
+
+        # Matches the partial catalog_in_stock_idx index
+        if self.request.query_params.get('in_stock', '').lower() in ('1', 'true'):
+            queryset = queryset.filter(total_stock__gt=0)
             
         return queryset
 
+    def get_filter_params(self):
+        """Normalized (name, value) pairs of the filters present on the request"""
+        names = set(self.filterset_fields) | {'category', 'size', 'color', 'in_stock'}
+        params = []
+        for name in names:
+            value = self.request.query_params.get(name, '').strip()
+            if value:
+                params.append((name, value))
+        match = build_match_query(self.request.query_params.get('search', ''))
+        if match:
+            params.append(('search', match))
+        return sorted(params)
 
-class ProductDetailView(generics.RetrieveAPIView):
-    queryset = Product.objects.filter(is_active=True)
-    serializer_class = ProductSerializer
+
+class ProductListView(CatalogListConditionalMixin, CatalogListMixin, ProductFilterMixin, generics.ListAPIView):
+
+    def get_queryset(self):
+        return self.with_expanded(self.get_base_queryset())
+
+
+class ProductFacetsView(ProductFilterMixin, generics.GenericAPIView):
+    """Facet counts for the product list, accepting the same filters"""
     permission_classes = [permissions.AllowAny]
 
+    def get_queryset(self):
+        return self.get_base_queryset()
+
+    def get(self, request, *args, **kwargs):
+        key = make_key('facets', self.get_filter_params())
+        facets = cache.get(key)
+        if facets is None:
+            facets = compute_facets(self.filter_queryset(self.get_queryset()))
+            cache.set(key, facets, settings.FACETS_CACHE_TIMEOUT)
+        return Response(facets)
+
 
-class FeaturedProductsView(generics.ListAPIView):
-    queryset = Product.objects.filter(is_active=True, is_featured=True)
+class ProductDetailView(CatalogDetailConditionalMixin, generics.RetrieveAPIView):
+    queryset = Product.objects.filter(is_active=True).with_related()
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
 
 
+@method_decorator(cache_response('featured'), name='dispatch')
+class FeaturedProductsView(CatalogListConditionalMixin, CatalogListMixin, generics.ListAPIView):
+
+    def get_queryset(self):
+        return self.with_expanded(CatalogEntry.objects.filter(is_active=True, is_featured=True).order_by('-created_at'))
+
+
+@method_decorator(cache_response('best-sellers'), name='dispatch')
+class BestSellersView(CatalogListConditionalMixin, CatalogListMixin, generics.ListAPIView):
+    """Most sold active products over ?period=7d, 30d (default) or total"""
+
+    def get_queryset(self):
+        field = SALES_PERIODS.get(self.request.query_params.get('period'), 'sales_30d')
+        queryset = CatalogEntry.objects.filter(is_active=True, **{f'{field}__gt': 0}).order_by(f'-{field}')
+        return self.with_expanded(queryset)
+
+
 class AdminProductCreateView(generics.CreateAPIView):
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -73,13 +182,14 @@ class AdminProductCreateView(generics.CreateAPIView):
 
 
 class AdminProductListView(generics.ListAPIView):
-    serializer_class = ProductSerializer
+    serializer_class = AdminProductListSerializer
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
         if self.request.user.role not in ['admin', 'super_admin']:
             raise permissions.PermissionDenied('Sin permisos')
-        return Product.objects.all()
+        expand = AdminProductListSerializer.get_expand(self.request)
+        return Product.objects.for_listing(expand)
 
 
 class AdminProductUpdateView(generics.RetrieveUpdateAPIView):
@@ -109,22 +219,60 @@ def upload_product_image(request, product_id):
     
     # Get the highest order number
     max_order = ProductImage.objects.filter(product=product).count()
+    # Multipart forms send booleans as text
+    is_main = serializers.BooleanField().to_internal_value(request.data.get('is_main', False))
     
-    image = ProductImage.objects.create(
-        product=product,
-        image=request.FILES['image'],
-        is_main=request.data.get('is_main', False),
-        order=max_order
-    )
-    
-    # If this is set as main image, remove main from others
-    if image.is_main:
-        ProductImage.objects.filter(product=product).exclude(id=image.id).update(is_main=False)
+    with transaction.atomic():
+        # Unflag the others first: saving the new image syncs main_image_ref and refreshes the catalog
+        if is_main:
+            ProductImage.objects.filter(product=product, is_main=True).update(is_main=False)
+        image = ProductImage.objects.create(
+            product=product,
+            image=request.FILES['image'],
+            is_main=is_main,
+            order=max_order
+        )
     
     serializer = ProductImageSerializer(image)
     return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def import_products(request):
+    """Upsert products and variants from an uploaded CSV or JSONL file"""
+    if request.user.role not in ['admin', 'super_admin']:
+        return Response({'error': 'Sin permisos'}, status=status.HTTP_403_FORBIDDEN)
+
+    if 'file' not in request.FILES:
+        return Response({'error': 'No se ha enviado ningún archivo'}, status=status.HTTP_400_BAD_REQUEST)
+
+    upload = request.FILES['file']
+    file_format = request.data.get('file_format') or os.path.splitext(upload.name)[1].lstrip('.').lower()
+    if file_format not in FORMATS:
+        return Response({'error': 'Formato no soportado, use csv o jsonl'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # The upload is decoded line by line, never read into memory as a whole
+    result = import_catalog(codecs.iterdecode(upload, 'utf-8-sig'), file_format)
+    return Response(result, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def export_products(request, file_format):
+    """Stream every product and variant as CSV or JSONL"""
+    if request.user.role not in ['admin', 'super_admin']:
+        return Response({'error': 'Sin permisos'}, status=status.HTTP_403_FORBIDDEN)
+
+    if file_format not in FORMATS:
+        return Response({'error': 'Formato no soportado, use csv o jsonl'}, status=status.HTTP_400_BAD_REQUEST)
+
+    content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(export_lines(file_format), content_type=f'{content_type}; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="productos.{file_format}"'
+    return response
+
+
 @api_view(['DELETE'])
 @permission_classes([permissions.IsAuthenticated])
 def delete_product_image(request, product_id, image_id):
@@ -288,6 +436,59 @@ class AdminProductVariantUpdateView(generics.RetrieveUpdateDestroyAPIView):
         return ProductVariant.objects.all()
 
 
+@api_view(['GET', 'POST'])
+@permission_classes([permissions.IsAuthenticated])
+def product_variant_matrix(request, product_id):
+    """Show a product's size x color variant grid, or create/update a whole grid at once"""
+    if request.user.role not in ['admin', 'super_admin']:
+        return Response({'error': 'Sin permisos'}, status=status.HTTP_403_FORBIDDEN)
+
+    product = get_object_or_404(Product, id=product_id)
+    if request.method == 'POST':
+        serializer = VariantMatrixSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        save_variant_matrix(product, **serializer.validated_data)
+
+    grid = variant_matrix(product)
+    return Response({
+        'sizes': grid['sizes'],
+        'colors': grid['colors'],
+        'matrix': {
+            size: {color: ProductVariantSerializer(variant).data if variant else None for color, variant in row.items()}
+            for size, row in grid['matrix'].items()
+        },
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def product_suggestions(request):
+    """Search-as-you-type suggestions for products, brands and categories"""
+    try:
+        limit = int(request.query_params.get('limit', 8))
+    except ValueError:
+        limit = 8
+    suggestions = suggestion_index.suggest(request.query_params.get('q', ''), limit=limit)
+    return Response([{'type': kind, 'value': value, 'text': text} for kind, value, text in suggestions])
+
+
+@cache_response('recommendations')
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def product_recommendations(request, pk):
+    """Products frequently bought together with this one, best first"""
+    try:
+        limit = min(int(request.query_params.get('limit', 8)), TOP_K)
+    except ValueError:
+        limit = 8
+    # One query over the (product, rank) index joined to the catalog rows
+    entries = CatalogEntry.objects.filter(
+        is_active=True, product__recommended_with__product_id=pk,
+    ).order_by('product__recommended_with__rank')[:max(limit, 0)]
+    return Response(CatalogEntrySerializer(entries, many=True).data)
+
+
+@cache_response('variant-choices')
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def get_variant_choices(request):
@@ -0,0 +1,20 @@
+"""Serving of uploaded media in development (DEBUG only).
+
+Content addressed files (see apps.products.storage) never change once
+written, so they are sent with a one year immutable Cache-Control. Anything
+else keeps the default revalidation through Last-Modified. In production
+the web server or CDN serves MEDIA_ROOT and sets the same header for hashed
+names (see the README).
+"""
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
+
+from apps.products.storage import is_hashed_name
+
+
+def serve_media(request, path):
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if response.status_code in (200, 304) and is_hashed_name(path):
+        patch_cache_control(response, public=True, max_age=settings.HASHED_MEDIA_MAX_AGE, immutable=True)
+    return response
@@ -0,0 +1,146 @@
+import base64
+import datetime
+import decimal
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldError, ValidationError
+from django.db.models import FloatField, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(PageNumberPagination):
+    """Page number pagination with an opt-in keyset mode.
+
+    Clients that send ?cursor= (empty for the first page) get keyset pages:
+    rows are selected with a WHERE on the current ordering field plus the
+    primary key as tiebreak instead of OFFSET, and no COUNT(*) is run, so
+    every page costs the same as the first one. The response carries only
+    ``next`` and ``results``, which is what infinite scroll needs.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Cursor inválido'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_keyset = self.cursor_query_param in request.query_params
+        if not self.use_keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        field, descending = self.get_ordering(queryset)
+        sign = '-' if descending else ''
+        queryset = queryset.order_by(f'{sign}{field}', f'{sign}pk')
+
+        position = self.decode_cursor(request, queryset, field)
+        if position is not None:
+            value, pk = position
+            lookup = 'lt' if descending else 'gt'
+            if field == 'pk':
+                queryset = queryset.filter(**{f'pk__{lookup}': pk})
+            else:
+                queryset = queryset.filter(
+                    Q(**{f'{field}__{lookup}': value}) | Q(**{field: value, f'pk__{lookup}': pk})
+                )
+
+        results = list(queryset[:page_size + 1])
+        self.next_position = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            last = results[-1]
+            self.next_position = (getattr(last, field), last.pk)
+        return results
+
+    def get_paginated_response(self, data):
+        if not self.use_keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if not self.use_keyset:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_ordering(self, queryset):
+        """Return the (field, descending) pair the keyset is built on.
+
+        Uses the first ordering term of the queryset, as left by OrderingFilter
+        or the model Meta. Anything that is not a plain field or annotation
+        name falls back to the primary key.
+        """
+        ordering = list(queryset.query.order_by)
+        if not ordering and queryset.query.default_ordering:
+            ordering = list(queryset.model._meta.ordering)
+        if ordering and isinstance(ordering[0], str):
+            term = ordering[0]
+            descending = term.startswith('-')
+            field = term.lstrip('-')
+            if '__' not in field and field != '?':
+                return ('pk' if field == 'id' else field), descending
+        return 'pk', False
+
+    def encode_cursor(self, position):
+        value, pk = position
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            value = value.isoformat()
+        elif isinstance(value, decimal.Decimal):
+            value = str(value)
+        payload = json.dumps([value, pk], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def get_cursor_field(self, queryset, field):
+        """The model field, or annotation output field, the keyset orders on"""
+        if field == 'pk':
+            model_field = queryset.model._meta.pk
+        elif field in queryset.query.annotations:
+            try:
+                model_field = queryset.query.annotations[field].output_field
+            except FieldError:
+                # Raw SQL annotations such as the search rank are numbers
+                model_field = FloatField()
+        else:
+            model_field = queryset.model._meta.get_field(field)
+        # A one-to-one primary key holds the related row's key
+        return model_field.target_field if model_field.is_relation else model_field
+
+    def parse_cursor_value(self, model_field, value):
+        """Check a decoded value has the JSON type encode_cursor gives the field, and convert it"""
+        internal_type = model_field.get_internal_type()
+        if internal_type.endswith(('AutoField', 'IntegerField')):
+            expected = (int,)
+        elif internal_type == 'FloatField':
+            expected = (int, float)
+        else:
+            # Text, dates and decimals are encoded as strings
+            expected = (str,)
+        if isinstance(value, bool) or not isinstance(value, expected):
+            raise TypeError(f'Unexpected cursor value {value!r}')
+        return model_field.to_python(value)
+
+    def decode_cursor(self, request, queryset, field):
+        """Return the (value, pk) position of the cursor, raising NotFound for anything malformed"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            if not isinstance(position, list) or len(position) != 2:
+                raise ValueError('A cursor holds a value and a primary key')
+            value, pk = position
+            value = self.parse_cursor_value(self.get_cursor_field(queryset, field), value)
+            pk = self.parse_cursor_value(self.get_cursor_field(queryset, 'pk'), pk)
+        except (TypeError, ValueError, UnicodeDecodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
@@ -102,10 +102,36 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file instead of the in-memory default, so tests can use several connections at once
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+FACETS_CACHE_TIMEOUT = 60 * 60
+
+# Seconds before a process rebuilds its search suggestions after catalog writes elsewhere
+SUGGESTIONS_REBUILD_INTERVAL = 60
+
+# Cached catalog responses are keyed by version, so the timeout only bounds memory use
+RESPONSE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Guest carts live in the cache (apps.cart.guest), so CACHE_URL must point at a shared
+# backend such as Redis when running more than one process
+GUEST_CART_TIMEOUT = 60 * 60 * 24 * 30
+# Seconds without changes after which a guest cart is copied to the database
+GUEST_CART_FLUSH_AFTER = 60 * 15
+# Seconds adding a variant to the cart holds its stock (apps.cart.reservations); 0 turns reservations off
+STOCK_RESERVATION_TTL = env.int('STOCK_RESERVATION_TTL', default=0)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -146,6 +172,18 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Origin (site or CDN) prepended to MEDIA_URL when rendering image URLs
+MEDIA_BASE_URL = env('MEDIA_BASE_URL', default='http://localhost:8000')
+
+# Origin (site or CDN) the static catalog snapshot is served from; its pagination links point here
+SNAPSHOT_BASE_URL = env('SNAPSHOT_BASE_URL', default=MEDIA_BASE_URL)
+
+# Content addressed media never changes, so browsers may keep it for a year
+HASHED_MEDIA_MAX_AGE = 60 * 60 * 24 * 365
+
+# Background threads generating resized product image derivatives
+IMAGE_DERIVATIVE_WORKERS = env.int('IMAGE_DERIVATIVE_WORKERS', default=2)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -167,7 +205,7 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'store.pagination.KeysetPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -14,3 +14,12 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'store.settings')
 
 application = get_wsgi_application()
+
+# Build the in-process suggestion index while the worker starts rather than
+# during the first search (see apps.products.suggest)
+from django.db import connection  # noqa: E402
+
+from apps.products.suggest import suggestion_index  # noqa: E402
+
+suggestion_index.warm()
+connection.close()
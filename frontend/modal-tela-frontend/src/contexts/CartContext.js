@@ -1,9 +1,13 @@
 import React, { createContext, useContext, useState, useEffect } from 'react';
 import axios from 'axios';
 import { toast } from 'react-toastify';
+import { useAuth } from './AuthContext';
 
 const CartContext = createContext();
 
+// How often the header badge count is refreshed (other tabs may change the cart)
+const COUNT_POLL_INTERVAL = 60000;
+
 export const useCart = () => {
   const context = useContext(CartContext);
   if (!context) {
@@ -15,12 +19,37 @@ export const useCart = () => {
 export const CartProvider = ({ children }) => {
   const [cart, setCart] = useState(null);
   const [loading, setLoading] = useState(false);
+  const [itemsCount, setItemsCount] = useState(0);
+  const { user } = useAuth();
 
-  // Load cart on component mount
+  // Load cart on mount, and again on login or registration, which merge the guest cart into the user's
   useEffect(() => {
     loadCart();
+  }, [user]);
+
+  // Poll the lightweight count endpoint instead of reloading the whole cart
+  useEffect(() => {
+    const interval = setInterval(() => {
+      if (document.visibilityState === 'visible') {
+        loadCount();
+      }
+    }, COUNT_POLL_INTERVAL);
+    return () => clearInterval(interval);
   }, []);
 
+  useEffect(() => {
+    setItemsCount(cart?.total_items || 0);
+  }, [cart]);
+
+  const loadCount = async () => {
+    try {
+      const response = await axios.get('/api/cart/count/');
+      setItemsCount(response.data.total_items);
+    } catch (error) {
+      console.error('Error loading cart count:', error);
+    }
+  };
+
   const loadCart = async () => {
     try {
       setLoading(true);
@@ -82,6 +111,28 @@ export const CartProvider = ({ children }) => {
     }
   };
 
+  // Several changes in one request, e.g. [{ op: 'set', item_id: 3, quantity: 2 }, { op: 'remove', item_id: 5 }]
+  const applyCartOperations = async (operations) => {
+    try {
+      const response = await axios.post('/api/cart/batch/', { operations });
+      setCart(response.data);
+      return { success: true };
+    } catch (error) {
+      toast.error('Error al actualizar el carrito');
+      return { success: false, error: error.response?.data };
+    }
+  };
+
+  // Guest carts live in the server cache until checkout starts; this writes them through
+  const startCheckout = async () => {
+    try {
+      const response = await axios.post('/api/cart/checkout/');
+      setCart(response.data);
+    } catch (error) {
+      console.error('Error starting checkout:', error);
+    }
+  };
+
   const clearCart = async () => {
     try {
       await axios.delete('/api/cart/clear/');
@@ -93,7 +144,7 @@ export const CartProvider = ({ children }) => {
   };
 
   const getCartItemsCount = () => {
-    return cart?.total_items || 0;
+    return itemsCount;
   };
 
   const getCartTotal = () => {
@@ -106,8 +157,11 @@ export const CartProvider = ({ children }) => {
     addToCart,
     updateCartItem,
     removeFromCart,
+    applyCartOperations,
     clearCart,
+    startCheckout,
     loadCart,
+    loadCount,
     getCartItemsCount,
     getCartTotal
   };
@@ -316,7 +316,10 @@ const AdminPanel = () => {
   const updateProduct = async (e) => {
     e.preventDefault();
     try {
-      await axios.patch(`/api/products/admin/${editingProduct.id}/`, productForm);
+      // The stock of a product with variants is the sum of theirs and is edited per variant
+      const { stock, ...fields } = productForm;
+      const hasVariants = editingProduct.variants && editingProduct.variants.length > 0;
+      await axios.patch(`/api/products/admin/${editingProduct.id}/`, hasVariants ? fields : productForm);
       toast.success('Producto actualizado exitosamente');
       setEditingProduct(null);
       setProductForm({
@@ -1006,7 +1009,9 @@ const AdminPanel = () => {
                   placeholder="Stock"
                   value={productForm.stock}
                   onChange={(e) => setProductForm({...productForm, stock: e.target.value})}
-                  className="px-3 py-2 border border-gray-300 rounded-lg"
+                  className="px-3 py-2 border border-gray-300 rounded-lg disabled:bg-gray-100"
+                  title={editingProduct?.variants?.length ? 'Suma del stock de las variantes' : undefined}
+                  disabled={Boolean(editingProduct?.variants?.length)}
                   required
                 />
                 <textarea
@@ -7,7 +7,7 @@ import { useOrders } from '../hooks/useOrders';
 import { getDepartments, getCitiesByDepartment } from '../data/colombiaData';
 
 const Checkout = () => {
-  const { cart, getCartTotal, clearCart } = useCart();
+  const { cart, getCartTotal, clearCart, startCheckout } = useCart();
   const { user } = useAuth();
   const { createOrder, loading } = useOrders();
   const navigate = useNavigate();
@@ -36,6 +36,10 @@ const Checkout = () => {
     }
   }, [formData.department]);
 
+  useEffect(() => {
+    startCheckout();
+  }, []);
+
   useEffect(() => {
     if (!cart || cart.items.length === 0) {
       navigate('/cart');
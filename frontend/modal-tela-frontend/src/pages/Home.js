@@ -5,6 +5,7 @@ const miImagen = require('../assets/home/home.jpeg');
 
 const Home = () => {
   const [featuredProducts, setFeaturedProducts] = useState([]);
+  const [bestSellers, setBestSellers] = useState([]);
   const [categories, setCategories] = useState([]);
 
   useEffect(() => {
@@ -13,9 +14,10 @@ const Home = () => {
 
   const loadData = async () => {
     try {
-      const [productsRes, categoriesRes] = await Promise.all([
+      const [productsRes, categoriesRes, bestSellersRes] = await Promise.all([
         axios.get('/api/products/featured/'),
-        axios.get('/api/products/categories/')
+        axios.get('/api/products/categories/'),
+        axios.get('/api/products/best-sellers/')
       ]);
       
       // Handle featured products response
@@ -25,11 +27,16 @@ const Home = () => {
       // Handle categories response
       const categoriesData = categoriesRes.data?.results || categoriesRes.data || [];
       setCategories(Array.isArray(categoriesData) ? categoriesData : []);
+
+      // Handle best sellers response
+      const bestSellersData = bestSellersRes.data?.results || bestSellersRes.data || [];
+      setBestSellers(Array.isArray(bestSellersData) ? bestSellersData : []);
       
     } catch (error) {
       console.error('Error loading data:', error);
       setFeaturedProducts([]);
       setCategories([]);
+      setBestSellers([]);
     }
   };
 
@@ -104,6 +111,42 @@ const Home = () => {
               >
                 <img
                   src={product.main_image || '/api/placeholder/300/300'}
+                  srcSet={product.main_image_srcset?.webp}
+                  sizes="(min-width: 1024px) 25vw, 50vw"
+                  alt={product.name}
+                  className="w-full h-32 sm:h-40 lg:h-48 object-cover"
+                />
+                <div className="p-3 sm:p-4">
+                  <h3 className="text-xs sm:text-sm font-semibold mb-1 sm:mb-2 line-clamp-2">{product.name}</h3>
+                  <p className="text-[#647787] text-xs mb-1 sm:mb-2">{product.brand_name}</p>
+                  <div className="flex justify-between items-center">
+                    <span className="text-sm sm:text-lg font-bold">${product.price}</span>
+                    {!product.is_in_stock && (
+                      <span className="text-red-500 text-xs">Agotado</span>
+                    )}
+                  </div>
+                </div>
+              </Link>
+            ))}
+          </div>
+        </section>
+      )}
+
+      {/* Best Sellers */}
+      {bestSellers && bestSellers.length > 0 && (
+        <section className="px-4 sm:px-6 lg:px-20 xl:px-40 py-8 sm:py-12">
+          <h2 className="text-xl sm:text-2xl font-bold text-center mb-6 sm:mb-8">Más Vendidos</h2>
+          <div className="grid grid-cols-2 md:grid-cols-3 lg:grid-cols-4 gap-4 sm:gap-6">
+            {bestSellers.slice(0, 8).map((product) => (
+              <Link
+                key={product.id}
+                to={`/products/${product.id}`}
+                className="bg-white rounded-lg shadow-lg overflow-hidden hover:shadow-xl transition-shadow"
+              >
+                <img
+                  src={product.main_image || '/api/placeholder/300/300'}
+                  srcSet={product.main_image_srcset?.webp}
+                  sizes="(min-width: 1024px) 25vw, 50vw"
                   alt={product.name}
                   className="w-full h-32 sm:h-40 lg:h-48 object-cover"
                 />
@@ -190,6 +190,8 @@ const Products = () => {
                 >
                   <img
                     src={product.main_image || '/api/placeholder/300/300'}
+                    srcSet={product.main_image_srcset?.webp}
+                    sizes="(min-width: 1024px) 25vw, 50vw"
                     alt={product.name}
                     className="w-full h-32 sm:h-40 lg:h-48 object-cover"
                   />